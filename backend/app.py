@@ -2,23 +2,37 @@ import os
 import signal
 import sys
 import threading
+import time
+import uuid
 from pathlib import Path
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
+from werkzeug.serving import is_running_from_reloader
 import database
 import config
+from logger import get_logger, request_id_var
+from profiling import register_stack_dump
+from responses import compress_response
 from routes.download import download_bp
 from routes.history import history_bp
+from routes.metrics import metrics_bp
+from routes.admin import admin_bp
 from services.cleanup import CleanupService
+from services.pipeline import get_pipeline
+from services.webhooks import get_dispatcher
+from services.worker import get_worker
 from middleware.rate_limit import start_cleanup_task
 
 # Get the base directory
 BASE_DIR = Path(__file__).parent
 
+logger = get_logger(__name__)
+
 app = Flask(__name__)
 
 # CORS Configuration - Allow all origins globally
-CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
+CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True,
+     expose_headers=['Content-Disposition'])
 
 # JSON configuration
 app.config['JSON_SORT_KEYS'] = False
@@ -29,10 +43,10 @@ def ensure_directories():
     try:
         os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
         os.makedirs(os.path.dirname(config.DATABASE_PATH), exist_ok=True)
-        print('✓ Directories ensured')
+        logger.info('Directories ensured')
         return True
     except Exception as error:
-        print(f'Error creating directories: {error}')
+        logger.error('Error creating directories: %s', error)
         return False
 
 
@@ -40,40 +54,144 @@ def initialize_database():
     """Initialize database."""
     try:
         database.init_db()
-        print('✓ Database initialized')
+        logger.info('Database initialized')
         return True
     except Exception as error:
-        print(f'Error initializing database: {error}')
+        logger.error('Error initializing database: %s', error)
         return False
 
 
 def start_cleanup_service():
-    """Start the cleanup service."""
-    cleanup = CleanupService()
+    """Start the cleanup service.
 
-    # Run cleanup immediately on startup
-    try:
-        stats = cleanup.cleanup_old_files()
-        print(f'✓ Cleanup task completed: {stats}')
-    except Exception as error:
-        print(f'Error running cleanup: {error}')
+    The first sweep runs CLEANUP_STARTUP_DELAY seconds after startup, in the
+    background: on a large upload folder it takes minutes and must not hold
+    up serving.
+    """
+    cleanup = CleanupService()
 
     # Schedule cleanup task to run every 24 hours
     def cleanup_loop():
+        delay = config.CLEANUP_STARTUP_DELAY
         while True:
-            import time
-            time.sleep(config.FILE_CLEANUP_INTERVAL)
+            time.sleep(delay)
+            delay = config.FILE_CLEANUP_INTERVAL
             try:
                 stats = cleanup.cleanup_old_files()
-                print(f'✓ Cleanup task completed: {stats}')
+                logger.info('Cleanup task completed', extra={'stats': stats})
             except Exception as error:
-                print(f'Error running cleanup: {error}')
+                logger.error('Error running cleanup: %s', error)
 
-    thread = threading.Thread(target=cleanup_loop, daemon=True)
+    thread = threading.Thread(target=cleanup_loop, name='cleanup', daemon=True)
     thread.start()
 
     hours = config.FILE_CLEANUP_INTERVAL / 3600
-    print(f'✓ Cleanup task scheduled every {hours} hours')
+    logger.info('Cleanup task scheduled every %s hours, first in %ss', hours, config.CLEANUP_STARTUP_DELAY)
+
+
+# Startup progress, reported by /api/ready. The server answers /api/health
+# (liveness) as soon as it listens; it is ready once warm_up() has finished.
+startup = {
+    'status': 'starting',
+    'stage': None,
+    'started_at': time.monotonic(),
+    'seconds': None,
+}
+_startup_lock = threading.Lock()
+_startup_thread = None
+
+# Endpoints that work before startup has finished
+# (a thread dump is most useful when startup hangs)
+STARTUP_EXEMPT_PATHS = ('/', '/api/health', '/api/ready', '/api/admin/threads')
+
+
+def warm_up():
+    """Startup work that needs the database; runs in the background."""
+    try:
+        startup['stage'] = 'directories'
+        if not ensure_directories():
+            raise RuntimeError('Could not create data directories')
+
+        startup['stage'] = 'database'
+        if not initialize_database():
+            raise RuntimeError('Database initialization failed')
+
+        if config.PROCESS_ROLE == 'all':
+            startup['stage'] = 'worker'
+            # Runs queued downloads, including those interrupted by the previous shutdown
+            get_worker().start()
+            get_dispatcher().start()
+
+        startup['stage'] = 'background tasks'
+        start_cleanup_service()
+        start_cleanup_task(app)
+
+        startup['seconds'] = round(time.monotonic() - startup['started_at'], 3)
+        startup['status'] = 'ready'
+        startup['stage'] = None
+        logger.info('Ready', extra={'startup_seconds': startup['seconds']})
+    except Exception as error:
+        startup['status'] = 'failed'
+        logger.critical('Startup failed during %s: %s', startup['stage'], error)
+
+
+def stop_downloads():
+    """Checkpoint this process's running downloads and release their leases."""
+    if config.PROCESS_ROLE == 'all':
+        get_dispatcher().stop()
+        get_worker().stop()
+    else:
+        get_pipeline().shutdown()
+
+
+def start_warm_up():
+    """Run warm_up() once per process, in a background thread."""
+    global _startup_thread
+    if _startup_thread is not None:
+        return
+    with _startup_lock:
+        if _startup_thread is None:
+            _startup_thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+            _startup_thread.start()
+
+
+@app.before_request
+def require_ready():
+    # WSGI servers (e.g. gunicorn) import `app` without calling start_server
+    start_warm_up()
+    if startup['status'] != 'ready' and request.path not in STARTUP_EXEMPT_PATHS:
+        response = jsonify({
+            'success': False,
+            'message': 'Service is starting' if startup['status'] == 'starting' else 'Service failed to start',
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
+
+# Request correlation ids
+@app.before_request
+def bind_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_id_token = request_id_var.set(g.request_id)
+
+
+@app.after_request
+def add_request_id_header(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+
+@app.teardown_request
+def unbind_request_id(error=None):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
+
+
+# Compress large JSON responses
+app.after_request(compress_response)
 
 
 # Health check endpoint
@@ -85,6 +203,17 @@ def health_check():
     }), 200
 
 
+# Readiness endpoint: 503 until startup has finished
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    ready = startup['status'] == 'ready'
+    return jsonify({
+        'status': startup['status'],
+        'stage': startup['stage'],
+        'startup_seconds': startup['seconds'],
+    }), 200 if ready else 503
+
+
 # Root endpoint
 @app.route('/', methods=['GET'])
 def root():
@@ -93,14 +222,28 @@ def root():
         'version': '1.0.0',
         'endpoints': {
             'health': '/api/health',
+            'ready': '/api/ready',
             'create_download': 'POST /api/download',
             'get_status': 'GET /api/download/<id>',
+            'get_statuses': 'POST /api/download/status {ids, since} or GET ?ids=&since=',
+            'get_timeline': 'GET /api/download/<id>/timeline',
+            'cancel_download': 'POST /api/download/<id>/cancel',
+            'retry_download': 'POST /api/download/<id>/retry',
             'download_file': 'GET /api/download/<id>/file',
+            'download_thumbnail': 'GET /api/download/<id>/thumbnail',
             'delete_download': 'DELETE /api/download/<id>',
             'history': 'GET /api/history',
+            'history_search': 'GET /api/history/search?q=',
             'history_stats': 'GET /api/history/stats',
+            'history_timeseries': 'GET /api/history/stats/timeseries?from=&to=&bucket=hour|day',
             'recent_downloads': 'GET /api/history/recent',
             'clear_history': 'DELETE /api/history/clear',
+            'metrics': 'GET /api/metrics',
+            'admin_cpu_profile': 'POST /api/admin/profile/cpu?seconds= (ADMIN_TOKEN)',
+            'admin_memory_profile': 'POST|GET|DELETE /api/admin/profile/memory (ADMIN_TOKEN)',
+            'admin_threads': 'GET /api/admin/threads (ADMIN_TOKEN)',
+            'admin_webhook_dead_letters': 'GET /api/admin/webhooks/dead-letters (ADMIN_TOKEN)',
+            'admin_webhook_replay': 'POST /api/admin/webhooks/dead-letters/<id>/replay (ADMIN_TOKEN)',
         },
     }), 200
 
@@ -108,6 +251,8 @@ def root():
 # Register blueprints
 app.register_blueprint(download_bp, url_prefix='/api')
 app.register_blueprint(history_bp, url_prefix='/api')
+app.register_blueprint(metrics_bp, url_prefix='/api')
+app.register_blueprint(admin_bp, url_prefix='/api')
 
 
 # Error handling middleware
@@ -130,42 +275,42 @@ def internal_error(error):
 def start_server():
     """Start the server."""
     try:
-        print('🎵 YouTube to MP3 Converter - Starting...\n')
+        logger.info('YouTube to MP3 Converter - Starting...')
 
         # Ensure directories
         if not ensure_directories():
             sys.exit(1)
 
-        # Initialize database
-        if not initialize_database():
-            sys.exit(1)
-
-        # Start cleanup task
-        start_cleanup_service()
-
-        # Start rate limit cleanup
-        start_cleanup_task(app)
+        # Database, queue worker and background tasks start while the server
+        # is already up; /api/ready reports when they are done. With the
+        # debug reloader, only the child process that serves requests (and
+        # is restarted on code changes) runs them, never the watching parent.
+        debug = config.NODE_ENV == 'development'
+        if not debug or is_running_from_reloader():
+            start_warm_up()
 
         # Start server
         PORT = config.PORT
-        print(f'\n✓ Server running on http://localhost:{PORT}')
-        print(f'✓ API available at http://localhost:{PORT}/api')
-        print(f'✓ Environment: {config.NODE_ENV}')
-        print('\nReady for downloads! 🚀\n')
+        logger.info('Server running on http://localhost:%s', PORT)
+        logger.info('API available at http://localhost:%s/api', PORT)
+        logger.info('Environment: %s', config.NODE_ENV)
 
         # Handle graceful shutdown
         def signal_handler(sig, frame):
-            print('\nSIGINT signal received: closing HTTP server')
+            logger.info('%s received: closing HTTP server', signal.Signals(sig).name)
+            if _startup_thread is not None:
+                stop_downloads()
             database.close_db()
             sys.exit(0)
 
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
+        register_stack_dump()
 
-        app.run(host='0.0.0.0', port=PORT, debug=(config.NODE_ENV == 'development'))
+        app.run(host='0.0.0.0', port=PORT, debug=debug)
 
     except Exception as error:
-        print(f'Failed to start server: {error}')
+        logger.critical('Failed to start server: %s', error)
         sys.exit(1)
 
 
@@ -0,0 +1,88 @@
+"""Synthetic audio and shared settings for the fake yt-dlp/ffmpeg executables.
+
+Every knob is an environment variable so the benchmark harness can shape
+latency, throughput and failures without touching the fakes themselves.
+"""
+import math
+import os
+import random
+import re
+import struct
+import sys
+import time
+
+PROBE_LATENCY = float(os.getenv('FAKE_PROBE_LATENCY', 0.05))  # seconds
+DOWNLOAD_THROUGHPUT = float(os.getenv('FAKE_DOWNLOAD_THROUGHPUT', 4 * 1024 * 1024))  # bytes/s
+ENCODE_SPEED = float(os.getenv('FAKE_ENCODE_SPEED', 200))  # x realtime
+DEFAULT_DURATION = int(os.getenv('FAKE_DURATION', 180))  # seconds of audio
+FAILURE_RATE = float(os.getenv('FAKE_FAILURE_RATE', 0))
+ENCODE_FAILURE_RATE = float(os.getenv('FAKE_ENCODE_FAILURE_RATE', 0))
+FAILURE_MESSAGE = os.getenv('FAKE_FAILURE_MESSAGE', 'ERROR: unable to download video data: HTTP Error 503')
+INFO_PADDING = int(os.getenv('FAKE_INFO_PADDING', 200))  # number of fake formats in --dump-json
+
+
+def video_id(url):
+    match = re.search(r'(?:v=|youtu\.be/)([\w-]+)', url)
+    return match.group(1) if match else 'fakevideo'
+
+
+def duration_for(url):
+    """Duration in seconds; a `fake_duration=N` query param overrides the default."""
+    match = re.search(r'fake_duration=(\d+)', url)
+    return int(match.group(1)) if match else DEFAULT_DURATION
+
+
+def should_fail():
+    return bool(FAILURE_RATE) and random.random() < FAILURE_RATE
+
+
+def fail():
+    sys.stderr.write(FAILURE_MESSAGE + '\n')
+    sys.exit(1)
+
+
+def maybe_fail():
+    if should_fail():
+        fail()
+
+
+def write_audio(path, seconds, kbps=128, throttle=0, fail_at=None):
+    """Write a sine-wave WAV whose size matches `seconds` of audio at `kbps`.
+
+    8-bit mono at kbps*125 samples/s gives the same bytes per second as a
+    compressed stream at that bitrate. With `throttle`, writing is paced to
+    that many bytes per second to simulate a network transfer. An existing
+    partial file is resumed rather than rewritten; with `fail_at` (a
+    fraction of the file) the write stops there and the process fails.
+    """
+    rate = max(int(kbps * 125), 8000)
+    one_second = bytes(
+        128 + int(100 * math.sin(2 * math.pi * 440 * i / rate)) for i in range(rate)
+    )
+    seconds = int(seconds)
+    data_size = rate * seconds
+    header = b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE'
+    header += b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, rate, rate, 1, 8)
+    header += b'data' + struct.pack('<I', data_size)
+
+    done = 0
+    if os.path.exists(path) and os.path.getsize(path) >= len(header):
+        done = (os.path.getsize(path) - len(header)) // rate
+
+    with open(path, 'r+b' if done else 'wb') as f:
+        if done:
+            f.truncate(len(header) + done * rate)
+            f.seek(0, os.SEEK_END)
+        else:
+            f.write(header)
+
+        for second in range(done, seconds):
+            if fail_at is not None and second >= seconds * fail_at:
+                f.close()
+                fail()
+            started = time.monotonic()
+            f.write(one_second)
+            if throttle:
+                remaining = len(one_second) / throttle - (time.monotonic() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
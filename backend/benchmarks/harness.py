@@ -0,0 +1,261 @@
+"""Shared plumbing for the benchmarks: a scratch API server running on fake binaries."""
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+FAKES_DIR = Path(__file__).resolve().parent / 'fakes'
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty sample."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    """p50/p99/mean of a list of seconds, reported in milliseconds."""
+    if not latencies:
+        return {'count': 0}
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+
+
+def process_memory(pid):
+    """Current and peak RSS of a process in MiB (Linux only)."""
+    memory = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    key = 'rss_mb' if line.startswith('VmRSS') else 'peak_rss_mb'
+                    memory[key] = round(int(line.split()[1]) / 1024, 2)
+    except OSError:
+        pass
+    return memory
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class BenchServer:
+    """Run the real Flask app in a subprocess against a scratch data dir.
+
+    yt-dlp and ffmpeg resolve to the fakes in benchmarks/fakes; `fake_env`
+    tunes their latency, throughput and failure rate.
+    """
+
+    def __init__(self, fake_env=None, app_env=None):
+        self.workdir = tempfile.mkdtemp(prefix='yt-bench-')
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.database_path = os.path.join(self.workdir, 'instance', 'bench.db')
+        self.upload_folder = os.path.join(self.workdir, 'uploads')
+        self.process = None
+        # Seconds from spawn until /api/health (live) and /api/ready answered 200
+        self.live_s = None
+        self.ready_s = None
+
+        self.env = dict(os.environ)
+        self.env.update({
+            'PATH': f'{FAKES_DIR}{os.pathsep}{self.env.get("PATH", "")}',
+            'UPLOAD_FOLDER': self.upload_folder,
+            'DATABASE_PATH': self.database_path,
+            'RATELIMIT_PER_MINUTE': '1000000000',
+            'LOG_LEVEL': 'warning',
+            'NODE_ENV': 'production',
+            'PYTHONDONTWRITEBYTECODE': '1',
+        })
+        self.env.update(fake_env or {})
+        self.env.update(app_env or {})
+
+    def start(self, timeout=30):
+        """Spawn the server and wait until it is ready (not just live)."""
+        started = time.monotonic()
+        self.live_s = self.ready_s = None
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.serve', '--port', str(self.port)],
+            cwd=BACKEND_DIR,
+            env=self.env,
+        )
+        deadline = started + timeout
+        while time.monotonic() < deadline:
+            try:
+                if self.live_s is None:
+                    self.request('GET', '/api/health')
+                    self.live_s = time.monotonic() - started
+                if self.request('GET', '/api/ready')[0] == 200:
+                    self.ready_s = time.monotonic() - started
+                    return self
+            except (urllib.error.URLError, ConnectionError):
+                if self.process.poll() is not None:
+                    raise RuntimeError('Benchmark server exited during startup')
+            time.sleep(0.01)
+        raise RuntimeError('Benchmark server did not become ready')
+
+    def restart(self, timeout=30):
+        """Stop the server gracefully and start it again on the same data."""
+        self._terminate()
+        return self.start(timeout)
+
+    def stop(self):
+        self._terminate()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _terminate(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request and return (status, parsed JSON or raw bytes, seconds)."""
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        req.add_header('Content-Type', 'application/json')
+        for key, value in (headers or {}).items():
+            req.add_header(key, value)
+
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=60) as resp:
+                status, raw = resp.status, resp.read()
+        except urllib.error.HTTPError as error:
+            status, raw = error.code, error.read()
+        elapsed = time.perf_counter() - started
+
+        try:
+            payload = json.loads(raw) if raw else None
+        except ValueError:
+            payload = raw
+        return status, payload, elapsed
+
+    def memory(self):
+        return process_memory(self.process.pid) if self.process else {}
+
+
+def seed_history(database_path, rows, batch=20000):
+    """Bulk-insert synthetic history rows straight into the database."""
+    statuses = ['completed'] * 8 + ['failed']
+    now = datetime.now()
+    conn = sqlite3.connect(database_path)
+    try:
+        for start in range(0, rows, batch):
+            records = []
+            for i in range(start, min(rows, start + batch)):
+                created = now - timedelta(seconds=rows - i)
+                status = random.choice(statuses)
+                records.append((
+                    f'https://www.youtube.com/watch?v=seed{i:08d}',
+                    f'Seeded track {i} by artist {i % 997}',
+                    f'Seed Channel {i % 997}',
+                    random.choice(['128', '192', '256', '320']),
+                    f'/nonexistent/seed{i}.mp3' if status == 'completed' else None,
+                    random.randint(1_000_000, 10_000_000) if status == 'completed' else None,
+                    status,
+                    created.isoformat(),
+                    (created + timedelta(seconds=30)).isoformat() if status == 'completed' else None,
+                    'ERROR: seeded failure' if status == 'failed' else None,
+                ))
+            conn.executemany(
+                '''INSERT INTO downloads (youtube_url, title, uploader, quality, file_path, file_size,
+                    status, created_at, completed_at, error_message)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                records
+            )
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def seed_files(folder, count):
+    """Create `count` small files in `folder`, like finished downloads on a busy volume."""
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(folder, f'seed-{i:08d}.mp3'), 'wb') as f:
+            f.write(b'\0' * 64)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def save_results(label, params, metrics):
+    """Write results/<label>.json and return its path."""
+    RESULTS_DIR.mkdir(exist_ok=True)
+    path = RESULTS_DIR / f'{label}.json'
+    with open(path, 'w') as f:
+        json.dump({
+            'label': label,
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'params': params,
+            'metrics': metrics,
+        }, f, indent=2)
+    return path
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, inner in value.items():
+            _flatten(f'{prefix}.{key}' if prefix else key, inner, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare_results(old_path, new_path):
+    """Print every numeric metric side by side with its relative change."""
+    with open(old_path) as f:
+        old = _flatten('', json.load(f)['metrics'], {})
+    with open(new_path) as f:
+        new = _flatten('', json.load(f)['metrics'], {})
+
+    width = max((len(k) for k in new), default=10)
+    print(f'{"metric":<{width}}  {"old":>12}  {"new":>12}  {"change":>8}')
+    for key in sorted(set(old) | set(new)):
+        before, after = old.get(key), new.get(key)
+        change = ''
+        if before and after is not None:
+            change = f'{(after - before) / before * 100:+.1f}%'
+        print(f'{key:<{width}}  {_fmt(before):>12}  {_fmt(after):>12}  {change:>8}')
+
+
+def _fmt(value):
+    return '-' if value is None else f'{value:.3f}' if isinstance(value, float) else str(value)
@@ -0,0 +1,319 @@
+"""End-to-end API benchmark on stubbed yt-dlp/ffmpeg.
+
+Run from the backend directory:
+
+    python -m benchmarks.run --label baseline
+    python -m benchmarks.run --label after --compare benchmarks/results/baseline.json
+
+Results are written to benchmarks/results/<label>.json.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.harness import (
+    BACKEND_DIR, FAKES_DIR, BenchServer, compare_results, save_results, seed_files, seed_history, summarize,
+)
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+def bench_submit(server, jobs, concurrency, duration):
+    """Submit `jobs` downloads concurrently; returns (latencies, submit times by id)."""
+    def submit(i):
+        url = f'https://www.youtube.com/watch?v=bench{i:05d}&fake_duration={duration}'
+        status, body, elapsed = server.request('POST', '/api/download', {'url': url})
+        return status, body, elapsed, time.monotonic() - elapsed
+
+    latencies, submitted, errors = [], {}, 0
+    with ThreadPoolExecutor(concurrency) as pool:
+        for status, body, elapsed, started in pool.map(submit, range(jobs)):
+            latencies.append(elapsed)
+            if status == 202:
+                submitted[body['download_id']] = started
+            else:
+                errors += 1
+
+    result = summarize(latencies)
+    result['errors'] = errors
+    return result, submitted
+
+
+def bench_end_to_end(server, submitted, timeout):
+    """Poll every job until it finishes; job latency is submit -> observed terminal state."""
+    pending = dict(submitted)
+    latencies, failed = [], 0
+    deadline = time.monotonic() + timeout
+
+    while pending and time.monotonic() < deadline:
+        for download_id, started in list(pending.items()):
+            status, body, _ = server.request('GET', f'/api/download/{download_id}')
+            if status == 200 and body['status'] in TERMINAL_STATUSES:
+                latencies.append(time.monotonic() - started)
+                failed += body['status'] != 'completed'
+                del pending[download_id]
+        time.sleep(0.05)
+
+    result = summarize(latencies)
+    result.update({'failed': failed, 'timed_out': len(pending)})
+    if latencies:
+        result['throughput_jobs_per_s'] = round(len(latencies) / max(latencies), 3)
+    return result
+
+
+def bench_status_polls(server, ids, requests, concurrency):
+    """Hammer GET /api/download/<id> and report requests per second."""
+    ids = list(ids) or [1]
+
+    def poll(i):
+        return server.request('GET', f'/api/download/{ids[i % len(ids)]}')[2]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(poll, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    result = summarize(latencies)
+    result['requests_per_s'] = round(requests / elapsed, 1)
+    return result
+
+
+def bench_mixed(server, long_jobs, short_jobs, long_duration, short_duration, timeout):
+    """Submit long and short jobs in a fixed shuffled order; report completion times per class."""
+    kinds = ['long'] * long_jobs + ['short'] * short_jobs
+    random.Random(42).shuffle(kinds)
+
+    submitted, kind_of = {}, {}
+    for i, kind in enumerate(kinds):
+        duration = long_duration if kind == 'long' else short_duration
+        url = f'https://www.youtube.com/watch?v=mixed{i:04d}&fake_duration={duration}'
+        status, body, elapsed = server.request('POST', '/api/download', {'url': url})
+        if status == 202:
+            submitted[body['download_id']] = time.monotonic() - elapsed
+            kind_of[body['download_id']] = kind
+
+    pending = dict(submitted)
+    completion = {'long': [], 'short': []}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for download_id, started in list(pending.items()):
+            status, body, _ = server.request('GET', f'/api/download/{download_id}')
+            if status == 200 and body['status'] in TERMINAL_STATUSES:
+                completion[kind_of[download_id]].append(time.monotonic() - started)
+                del pending[download_id]
+        time.sleep(0.05)
+
+    result = {
+        'all': summarize(completion['long'] + completion['short']),
+        'long': summarize(completion['long']),
+        'short': summarize(completion['short']),
+        'timed_out': len(pending),
+    }
+    return result
+
+
+def bench_history(server, samples):
+    """Latency of the history, stats and search endpoints at the current table size."""
+    paths = {
+        'history_first_page': '/api/history?limit=50',
+        'history_deep_page': '/api/history?limit=50&offset=50000',
+        'history_status_filter': '/api/history?status=failed&limit=50',
+        'recent': '/api/history/recent',
+        'stats': '/api/history/stats',
+        'search_rare': '/api/history/search?q=track%2012345',
+        'search_prefix': '/api/history/search?q=artist%2099',
+        'search_url': '/api/history/search?q=seed0004',
+    }
+    results = {}
+    for name, path in paths.items():
+        latencies = [server.request('GET', path)[2] for _ in range(samples)]
+        results[name] = summarize(latencies)
+    return results
+
+
+def timed_python(code, env):
+    """Run `code` in a fresh interpreter from the backend dir; returns what it prints as a float."""
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(fake_env, files, rows, restarts):
+    """Restart the server on a seeded volume; time until live (/api/health) and ready (/api/ready)."""
+    with BenchServer(fake_env) as server:
+        seed_history(server.database_path, rows)
+        seed_files(server.upload_folder, files)
+
+        live, ready = [], []
+        for _ in range(restarts):
+            server.restart()
+            live.append(server.live_s)
+            ready.append(server.ready_s)
+
+        # Work kept off the startup path, measured on its own for comparison
+        import_s = timed_python(
+            'import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)', server.env
+        )
+        sweep_s = timed_python(
+            'import time; from services.cleanup import CleanupService; t = time.perf_counter(); '
+            'CleanupService().cleanup_old_files(); print(time.perf_counter() - t)', server.env
+        )
+
+    return {
+        'live': summarize(live),
+        'ready': summarize(ready),
+        'import_app_ms': round(import_s * 1000, 3),
+        'cleanup_sweep_ms': round(sweep_s * 1000, 3),
+    }
+
+
+def bench_probe(fake_env, samples, formats):
+    """Metadata probe cost in this process: the old full --dump-json capture against the field-selective one.
+
+    Both run the fake yt-dlp with `formats` padding formats in its info JSON;
+    reports wall and parse time and the peak Python memory of each probe.
+    """
+    from services.jobs import run_bounded
+    from services.youtube import YouTubeService
+
+    os.environ.update(fake_env)
+    os.environ['FAKE_INFO_PADDING'] = str(formats)
+    os.environ['FAKE_PROBE_LATENCY'] = '0'
+    os.environ['PATH'] = f'{FAKES_DIR}{os.pathsep}{os.environ.get("PATH", "")}'
+    url = 'https://www.youtube.com/watch?v=probe000001'
+
+    def dump_json():
+        result = subprocess.run(['yt-dlp', '--dump-json', '--no-warnings', '-q', url],
+                                capture_output=True, text=True, timeout=60)
+        return result.stdout
+
+    def field_print():
+        return run_bounded(YouTubeService.probe_command(url), timeout=60).stdout
+
+    results = {}
+    for name, probe in (('dump_json', dump_json), ('field_print', field_print)):
+        wall, parse, peaks = [], [], []
+        for _ in range(samples):
+            tracemalloc.start()
+            started = time.perf_counter()
+            stdout = probe()
+            parse_started = time.perf_counter()
+            json.loads(stdout)
+            finished = time.perf_counter()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            wall.append(finished - started)
+            parse.append(finished - parse_started)
+        results[name] = {
+            'wall': summarize(wall),
+            'parse': summarize(parse),
+            'stdout_bytes': len(stdout),
+            'peak_kb': round(max(peaks) / 1024, 1),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the download API on fake binaries.')
+    parser.add_argument('--label', default='latest', help='results file name')
+    parser.add_argument('--jobs', type=int, default=50, help='downloads to submit')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--duration', type=int, default=180, help='seconds of audio per fake video')
+    parser.add_argument('--polls', type=int, default=2000, help='status requests to send')
+    parser.add_argument('--rows', type=int, nargs='*', default=[100000, 1000000],
+                        help='history table sizes to measure')
+    parser.add_argument('--samples', type=int, default=20, help='requests per history endpoint')
+    parser.add_argument('--throughput', type=float, default=4 * 1024 * 1024,
+                        help='fake download throughput in bytes/s')
+    parser.add_argument('--encode-speed', type=float, default=200, help='fake encode speed (x realtime)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of fake calls that fail')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for jobs')
+    parser.add_argument('--policy', default='sjf', choices=['fifo', 'sjf', 'fair'],
+                        help='scheduler policy for the mixed workload')
+    parser.add_argument('--mixed-long', type=int, default=4, help='long jobs in the mixed workload')
+    parser.add_argument('--mixed-short', type=int, default=40, help='short jobs in the mixed workload')
+    parser.add_argument('--mixed-workers', type=int, default=2, help='download workers for the mixed workload')
+    parser.add_argument('--startup-files', type=int, default=100000,
+                        help='files in the upload folder for the startup benchmark')
+    parser.add_argument('--startup-rows', type=int, default=100000,
+                        help='history rows for the startup benchmark')
+    parser.add_argument('--startup-restarts', type=int, default=5, help='restarts to time')
+    parser.add_argument('--probe-samples', type=int, default=20, help='metadata probes per variant')
+    parser.add_argument('--probe-formats', type=int, default=5000,
+                        help='formats in the fake info JSON for the probe benchmark (5000 is about 2MB)')
+    parser.add_argument('--compare', help='previous results file to diff against')
+    args = parser.parse_args(argv)
+
+    fake_env = {
+        'FAKE_DURATION': str(args.duration),
+        'FAKE_DOWNLOAD_THROUGHPUT': str(args.throughput),
+        'FAKE_ENCODE_SPEED': str(args.encode_speed),
+        'FAKE_FAILURE_RATE': str(args.failure_rate),
+    }
+
+    metrics = {}
+    with BenchServer(fake_env) as server:
+        metrics['memory_idle'] = server.memory()
+
+        print(f'Submitting {args.jobs} jobs with {args.concurrency} clients...', file=sys.stderr)
+        metrics['submit'], submitted = bench_submit(server, args.jobs, args.concurrency, args.duration)
+        metrics['end_to_end'] = bench_end_to_end(server, submitted, args.timeout)
+
+        memory = server.memory()
+        metrics['memory_after_jobs'] = memory
+        if 'peak_rss_mb' in memory and 'rss_mb' in metrics['memory_idle'] and submitted:
+            growth = memory['peak_rss_mb'] - metrics['memory_idle']['rss_mb']
+            metrics['memory_after_jobs']['per_concurrent_job_mb'] = round(
+                growth / min(len(submitted), args.concurrency), 3
+            )
+
+        print(f'Polling status {args.polls} times...', file=sys.stderr)
+        metrics['status_poll'] = bench_status_polls(server, submitted, args.polls, args.concurrency)
+
+        seeded = len(submitted)
+        for rows in sorted(args.rows):
+            print(f'Seeding history to {rows} rows...', file=sys.stderr)
+            seed_history(server.database_path, rows - seeded)
+            seeded = rows
+            metrics[f'history_{rows}'] = bench_history(server, args.samples)
+
+        metrics['memory_final'] = server.memory()
+
+    # Mixed workload on a fixed-size download pool, so jobs queue and the
+    # scheduler policy decides their order
+    mixed_env = {
+        'SCHEDULER_POLICY': args.policy,
+        'DOWNLOAD_WORKERS_INITIAL': str(args.mixed_workers),
+        'DOWNLOAD_WORKERS_MIN': str(args.mixed_workers),
+        'DOWNLOAD_WORKERS_MAX': str(args.mixed_workers),
+    }
+    if args.mixed_long or args.mixed_short:
+        print(f'Running mixed workload with the {args.policy} policy...', file=sys.stderr)
+        with BenchServer(fake_env, mixed_env) as server:
+            metrics['mixed'] = bench_mixed(
+                server, args.mixed_long, args.mixed_short, 20 * args.duration, args.duration, args.timeout
+            )
+
+    if args.startup_restarts:
+        print(f'Timing startup with {args.startup_files} files and {args.startup_rows} rows...', file=sys.stderr)
+        metrics['startup'] = bench_startup(fake_env, args.startup_files, args.startup_rows, args.startup_restarts)
+
+    if args.probe_samples:
+        print(f'Timing metadata probes with {args.probe_formats} formats...', file=sys.stderr)
+        metrics['probe'] = bench_probe(fake_env, args.probe_samples, args.probe_formats)
+
+    path = save_results(args.label, vars(args), metrics)
+    print(f'Results written to {path}', file=sys.stderr)
+
+    if args.compare:
+        compare_results(args.compare, path)
+
+
+if __name__ == '__main__':
+    main()
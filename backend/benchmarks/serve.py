@@ -0,0 +1,32 @@
+"""Run the API for benchmarks on a threaded WSGI server.
+
+Used by harness.BenchServer; configuration comes from the environment.
+"""
+import argparse
+import signal
+import sys
+from werkzeug.serving import make_server
+import app as api
+import database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, required=True)
+    args = parser.parse_args()
+
+    # Same startup path as app.start_server: serve first, warm up in the background
+    api.start_warm_up()
+
+    def stop(sig, frame):
+        api.stop_downloads()
+        database.close_db()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    make_server('127.0.0.1', args.port, api.app, threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,22 +13,60 @@ NODE_ENV = os.getenv('NODE_ENV', 'development')
 SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 
 # File Upload Configuration
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', os.path.join(BASE_DIR, 'uploads'))
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
 
+# Artifact storage: 'local' keeps converted files in UPLOAD_FOLDER, 's3'
+# stores them in an S3-compatible bucket (AWS S3, MinIO, ...) so any number
+# of API replicas can serve them; needs the boto3 package
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local').lower()
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+S3_PREFIX = os.getenv('S3_PREFIX', '')  # key prefix inside the bucket, e.g. 'artifacts/'
+S3_REGION = os.getenv('S3_REGION', '')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', '')  # e.g. http://minio:9000; empty for AWS
+S3_PUBLIC_ENDPOINT_URL = os.getenv('S3_PUBLIC_ENDPOINT_URL', '')  # host browsers reach; defaults to S3_ENDPOINT_URL
+S3_ACCESS_KEY_ID = os.getenv('S3_ACCESS_KEY_ID', '')  # empty: boto3's default credential chain
+S3_SECRET_ACCESS_KEY = os.getenv('S3_SECRET_ACCESS_KEY', '')
+S3_PRESIGN_EXPIRES = int(os.getenv('S3_PRESIGN_EXPIRES', 900))  # seconds a download link stays valid
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024))  # bytes
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024))  # bytes
+S3_UPLOAD_CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', 4))  # parts uploaded in parallel
+
 # Database Configuration
-DATABASE_PATH = os.path.join(BASE_DIR, 'instance', 'yt_converter.db')
+DATABASE_PATH = os.getenv('DATABASE_PATH', os.path.join(BASE_DIR, 'instance', 'yt_converter.db'))
 
 # File Cleanup Configuration
 FILE_CLEANUP_DAYS = 7
 FILE_CLEANUP_INTERVAL = 24 * 60 * 60  # 24 hours in seconds
+# First sweep after startup, in seconds; it runs in the background
+CLEANUP_STARTUP_DELAY = float(os.getenv('CLEANUP_STARTUP_DELAY', 300))
+# Hourly history rollups older than this are pruned by cleanup; daily ones are kept
+ROLLUP_HOURLY_RETENTION_DAYS = int(os.getenv('ROLLUP_HOURLY_RETENTION_DAYS', 90))
 
 # Download Configuration
 ALLOWED_QUALITIES = ['128', '192', '256', '320']
 DEFAULT_QUALITY = '192'
+# 'native' keeps YouTube's own audio stream (remux only, no re-encode)
+ALLOWED_FORMATS = ['mp3', 'm4a', 'opus', 'ogg', 'native']
+DEFAULT_FORMAT = 'mp3'
+
+# Most download ids one bulk status request may ask for
+STATUS_BATCH_MAX = int(os.getenv('STATUS_BATCH_MAX', 500))
 
 # Rate Limiting
-RATELIMIT_PER_MINUTE = 5
+RATELIMIT_PER_MINUTE = int(os.getenv('RATELIMIT_PER_MINUTE', 5))
+
+# Admission control: POST /api/download answers 503 with Retry-After while
+# any threshold is exceeded (0 disables a check)
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 200))  # pending downloads
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', 0))  # processing downloads
+ADMISSION_MIN_FREE_MB = int(os.getenv('ADMISSION_MIN_FREE_MB', 1024))  # free disk in UPLOAD_FOLDER
+ADMISSION_MAX_LOAD = float(os.getenv('ADMISSION_MAX_LOAD', 4))  # 1-minute load average per CPU
+ADMISSION_RATE_WINDOW = int(os.getenv('ADMISSION_RATE_WINDOW', 600))  # seconds of completions for wait estimates
+ADMISSION_RETRY_AFTER_DEFAULT = 30  # seconds, when there is no completion rate to estimate from
+ADMISSION_RETRY_AFTER_MAX = 600  # seconds
+ADMISSION_DISK_RETRY_AFTER = 600  # seconds; space comes back with cleanup or deletes
+ADMISSION_LOAD_RETRY_AFTER = 15  # seconds at the load limit, scaled by how far over it
 
 # CORS Configuration
 CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',')
@@ -36,5 +74,98 @@ CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',')
 # FFmpeg Configuration
 FFMPEG_TIMEOUT = 300  # 5 minutes
 
+# Loudness normalization (EBU R128) targets, used when a download asks for it
+NORMALIZE_DEFAULT = os.getenv('NORMALIZE_DEFAULT', 'false').lower() == 'true'
+LOUDNORM_TARGET_I = float(os.getenv('LOUDNORM_TARGET_I', -16))  # integrated LUFS
+LOUDNORM_TARGET_TP = float(os.getenv('LOUDNORM_TARGET_TP', -1.5))  # true peak dBTP
+LOUDNORM_TARGET_LRA = float(os.getenv('LOUDNORM_TARGET_LRA', 11))  # loudness range LU
+
+# Thumbnail cache (resized WebP copies of video thumbnails)
+THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', 320))
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 75))
+THUMBNAIL_TIMEOUT = 30  # seconds
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60  # Cache-Control max-age in seconds
+
+# Download pipeline: network-bound downloads adapt between MIN and MAX workers,
+# CPU-bound encodes are capped at one per core by default
+DOWNLOAD_TIMEOUT = 600  # 10 minutes
+DOWNLOAD_WORKERS_INITIAL = int(os.getenv('DOWNLOAD_WORKERS_INITIAL', 2))
+DOWNLOAD_WORKERS_MIN = int(os.getenv('DOWNLOAD_WORKERS_MIN', 1))
+DOWNLOAD_WORKERS_MAX = int(os.getenv('DOWNLOAD_WORKERS_MAX', 8))
+DOWNLOAD_ADAPT_WINDOW = float(os.getenv('DOWNLOAD_ADAPT_WINDOW', 30))  # seconds
+ENCODE_WORKERS = int(os.getenv('ENCODE_WORKERS', 0)) or os.cpu_count() or 1
+
+# Download queue scheduling: 'fifo', 'sjf' (shortest job first, with aging)
+# or 'fair' (per-IP fair share)
+SCHEDULER_POLICY = os.getenv('SCHEDULER_POLICY', 'sjf').lower()
+SCHEDULER_AGING = float(os.getenv('SCHEDULER_AGING', 10))  # priority seconds gained per second queued
+SCHEDULER_DEFAULT_DURATION = 300  # seconds assumed when a video's duration is unknown
+
+# Retries for transient download failures (jittered exponential backoff)
+DOWNLOAD_MAX_RETRIES = int(os.getenv('DOWNLOAD_MAX_RETRIES', 3))
+RETRY_BACKOFF_BASE = float(os.getenv('RETRY_BACKOFF_BASE', 5))  # seconds
+RETRY_BACKOFF_MAX = float(os.getenv('RETRY_BACKOFF_MAX', 300))  # seconds
+
+# Seconds to let running downloads finish on shutdown before checkpointing them
+# (keep below the container stop timeout, 10s by default in Docker)
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 8))
+
+# Process roles: 'all' serves the API and runs downloads in one process,
+# 'api' only enqueues and serves, 'worker' (python worker.py) only runs
+# downloads. Every process shares the queue through the database.
+PROCESS_ROLE = os.getenv('PROCESS_ROLE', 'all').lower()
+WORKER_ID = os.getenv('WORKER_ID', '')  # defaults to hostname:pid
+WORKER_LEASE_SECONDS = float(os.getenv('WORKER_LEASE_SECONDS', 30))  # claimed jobs return to the queue after this
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv('WORKER_HEARTBEAT_INTERVAL', 2))  # also how fast remote cancels land
+WORKER_POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', 1))  # seconds between checks of an empty queue
+
+# Egress shaping for GET /api/download/<id>/file (0 disables each limit):
+# bandwidth for all transfers together and per client IP in bytes/second,
+# parallel transfers per IP, and the file size up to which a transfer counts
+# as small and goes first (Range requests count by the whole file's size). EGRESS_ACCEL_REDIRECT hands local files to nginx
+# (X-Accel-Redirect to that internal location, X-Accel-Limit-Rate per client).
+EGRESS_GLOBAL_RATE = int(os.getenv('EGRESS_GLOBAL_RATE', 0))
+EGRESS_CLIENT_RATE = int(os.getenv('EGRESS_CLIENT_RATE', 0))
+EGRESS_BURST = int(os.getenv('EGRESS_BURST', 1024 * 1024))  # bytes a bucket can send at once after idling
+EGRESS_MAX_TRANSFERS_PER_IP = int(os.getenv('EGRESS_MAX_TRANSFERS_PER_IP', 0))
+EGRESS_SMALL_FILE_SIZE = int(os.getenv('EGRESS_SMALL_FILE_SIZE', 1024 * 1024))
+EGRESS_CHUNK_SIZE = int(os.getenv('EGRESS_CHUNK_SIZE', 64 * 1024))
+EGRESS_ACCEL_REDIRECT = os.getenv('EGRESS_ACCEL_REDIRECT', '')  # e.g. /internal-files/
+
+# Completion webhooks (POST /api/download with callback_url). Deliveries are
+# signed with WEBHOOK_SECRET (HMAC-SHA256); callbacks are refused while it is
+# empty. WEBHOOK_ALLOWED_HOSTS (comma-separated) limits where they may go;
+# hosts resolving to loopback, private or link-local addresses are only
+# accepted when listed there.
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv('WEBHOOK_ALLOWED_HOSTS', '').split(',')
+                         if host.strip()]
+WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', 10))  # seconds per attempt
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 8))  # then the delivery is dead-lettered
+WEBHOOK_BACKOFF_BASE = float(os.getenv('WEBHOOK_BACKOFF_BASE', 10))  # seconds
+WEBHOOK_BACKOFF_MAX = float(os.getenv('WEBHOOK_BACKOFF_MAX', 3600))  # seconds
+WEBHOOK_CONCURRENCY = int(os.getenv('WEBHOOK_CONCURRENCY', 4))  # parallel deliveries per process
+WEBHOOK_POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', 1))  # seconds between checks of an empty queue
+
 # Logging
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'info').lower()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_WINDOW = float(os.getenv('LOG_SAMPLE_WINDOW', 60))  # seconds
+LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', 5))  # per message per window
+
+# Tracing (OTLP/JSON export of per-job spans; both disabled when empty)
+TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE', '')
+TRACE_EXPORT_URL = os.getenv('TRACE_EXPORT_URL', '')  # e.g. http://collector:4318/v1/traces
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'yt-converter-api')
+
+# Admin endpoints (/api/admin/*: profiling, thread dumps) need this token as
+# "Authorization: Bearer <token>"; they are disabled while it is empty
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 120))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.01))  # seconds between CPU samples
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', 25))  # stack depth kept per allocation
+
+# Response compression (brotli when the package is installed, else gzip)
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # bytes
+COMPRESS_LEVEL_GZIP = int(os.getenv('COMPRESS_LEVEL_GZIP', 6))
+COMPRESS_LEVEL_BROTLI = int(os.getenv('COMPRESS_LEVEL_BROTLI', 5))
@@ -1,23 +1,45 @@
 import sqlite3
 import os
-from datetime import datetime
+import threading
+from datetime import datetime, timezone
 from contextlib import contextmanager
 from pathlib import Path
 import config
+from logger import get_logger
 
 # Initialize database path
 DB_PATH = config.DATABASE_PATH
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
 db_connection = None
 
+# Whether downloads_fts exists (SQLite built with FTS5)
+fts_enabled = False
+
+# The connection is shared by request and pipeline threads; serialize transactions
+db_lock = threading.RLock()
+
+logger = get_logger(__name__)
+
+# Rollup bucket sizes, as the strftime format of a bucket's start (UTC)
+ROLLUP_GRANULARITIES = {
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d 00:00:00',
+}
+# Upper bounds (seconds) of the job duration histogram; longer jobs go in a last, open bucket
+ROLLUP_DURATION_BOUNDS = (5, 10, 15, 30, 45, 60, 90, 120, 180, 300, 600, 900, 1800, 3600, 7200)
+
 
 def init_db():
     """Initialize the database and create tables if they don't exist."""
     global db_connection
     try:
-        db_connection = sqlite3.connect(DB_PATH, check_same_thread=False)
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        # API and worker processes share the file: WAL lets readers run
+        # alongside a writer, and writers wait for each other's locks
+        db_connection = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
         db_connection.row_factory = sqlite3.Row
+        db_connection.execute('PRAGMA foreign_keys = ON')
+        db_connection.execute('PRAGMA journal_mode = WAL')
 
         cursor = db_connection.cursor()
 
@@ -33,17 +55,497 @@ def init_db():
                 status TEXT NOT NULL DEFAULT 'pending',
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 completed_at DATETIME,
-                error_message TEXT
+                error_message TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                uploader TEXT,
+                duration INTEGER,
+                thumbnail_source TEXT,
+                thumbnail_path TEXT,
+                client_ip TEXT,
+                clip_start REAL,
+                clip_end REAL,
+                normalize INTEGER NOT NULL DEFAULT 0,
+                format TEXT NOT NULL DEFAULT 'mp3',
+                request_id TEXT,
+                trace_id TEXT,
+                row_version INTEGER NOT NULL DEFAULT 0,
+                callback_url TEXT,
+                started_at DATETIME
+            )
+        ''')
+
+        # Columns added after the first release
+        ensure_columns(cursor, 'downloads', {
+            'attempts': 'INTEGER NOT NULL DEFAULT 0',
+            'uploader': 'TEXT',
+            'duration': 'INTEGER',
+            'thumbnail_source': 'TEXT',
+            'thumbnail_path': 'TEXT',
+            'client_ip': 'TEXT',
+            'clip_start': 'REAL',
+            'clip_end': 'REAL',
+            'normalize': 'INTEGER NOT NULL DEFAULT 0',
+            'format': "TEXT NOT NULL DEFAULT 'mp3'",
+            'request_id': 'TEXT',
+            'trace_id': 'TEXT',
+            'row_version': 'INTEGER NOT NULL DEFAULT 0',
+            'callback_url': 'TEXT',
+            'started_at': 'DATETIME',
+        })
+
+        # The job queue is the set of unfinished rows; keep finding them cheap
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_downloads_unfinished ON downloads(id)
+            WHERE status IN ('pending', 'processing')
+        ''')
+
+        # Incremental history sync reads rows changed since a version
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_downloads_row_version ON downloads(row_version)')
+
+        # Which worker process is running a queued download, until when (epoch
+        # seconds); kept out of downloads so heartbeats don't touch its version
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS download_leases (
+                download_id INTEGER PRIMARY KEY REFERENCES downloads(id) ON DELETE CASCADE,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+
+        # First-pass loudnorm results per source (video + clip range), so the
+        # analysis runs once per source however many encodes use it
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS loudness_measurements (
+                source_key TEXT PRIMARY KEY,
+                measurements TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Timed stages of each download (see tracing.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS download_spans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                download_id INTEGER NOT NULL REFERENCES downloads(id) ON DELETE CASCADE,
+                trace_id TEXT NOT NULL,
+                span_id TEXT NOT NULL,
+                parent_span_id TEXT,
+                name TEXT NOT NULL,
+                start_ns INTEGER NOT NULL,
+                end_ns INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'ok',
+                attributes TEXT
+            )
+        ''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_download_spans_download_id ON download_spans(download_id)'
+        )
+
+        ensure_search_index(cursor)
+
+        # Change counters per table, bumped by triggers; backs ETag/Last-Modified
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
             )
         ''')
+        ensure_version_triggers(cursor, 'downloads', row_versions=True)
+        ensure_rollups(cursor)
+        ensure_webhooks(cursor)
 
         db_connection.commit()
-        print('Database initialized successfully!')
+        logger.debug('Database initialized successfully')
         return True
     except sqlite3.Error as e:
-        print(f'Database initialization error: {e}')
+        logger.error('Database initialization error: %s', e)
+        return False
+
+
+def ensure_columns(cursor, table, columns):
+    """Add any missing columns to an existing table."""
+    existing = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+
+def ensure_search_index(cursor):
+    """Create the FTS5 index over downloads and the triggers that keep it in sync.
+
+    Returns False (and history search falls back to LIKE) if this SQLite
+    build has no FTS5.
+    """
+    global fts_enabled
+
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'downloads_fts'"
+    ).fetchone()
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS downloads_fts USING fts5(
+                title, uploader, youtube_url,
+                content='downloads', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3 4 5 6 7 8'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning('Full-text search unavailable: %s', e)
+        fts_enabled = False
         return False
 
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_fts_insert AFTER INSERT ON downloads
+        BEGIN
+            INSERT INTO downloads_fts (rowid, title, uploader, youtube_url)
+            VALUES (new.id, new.title, new.uploader, new.youtube_url);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_fts_delete AFTER DELETE ON downloads
+        BEGIN
+            INSERT INTO downloads_fts (downloads_fts, rowid, title, uploader, youtube_url)
+            VALUES ('delete', old.id, old.title, old.uploader, old.youtube_url);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_fts_update
+        AFTER UPDATE OF title, uploader, youtube_url ON downloads
+        BEGIN
+            INSERT INTO downloads_fts (downloads_fts, rowid, title, uploader, youtube_url)
+            VALUES ('delete', old.id, old.title, old.uploader, old.youtube_url);
+            INSERT INTO downloads_fts (rowid, title, uploader, youtube_url)
+            VALUES (new.id, new.title, new.uploader, new.youtube_url);
+        END
+    ''')
+
+    # Index rows that existed before the search index did
+    if not exists:
+        cursor.execute("INSERT INTO downloads_fts (downloads_fts) VALUES ('rebuild')")
+
+    fts_enabled = True
+    return True
+
+
+def ensure_version_triggers(cursor, table, row_versions=False):
+    """Keep table_versions[table] bumped on every insert, update and delete.
+
+    With `row_versions`, inserted and updated rows are also stamped with the
+    version their change produced (the table's `row_version` column), so
+    clients can ask for what changed since a version they saw.
+    """
+    cursor.execute('INSERT OR IGNORE INTO table_versions (name) VALUES (?)', [table])
+    bump = f'''
+        UPDATE table_versions
+        SET version = version + 1,
+            updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE name = '{table}';
+    '''
+    stamp = f'''
+        UPDATE {table}
+        SET row_version = (SELECT version FROM table_versions WHERE name = '{table}')
+        WHERE id = new.id;
+    '''
+
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        if row_versions and event != 'DELETE':
+            # Replaces the plain trigger; the stamp itself changes only
+            # row_version, which the WHEN clause lets through untouched
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_version_{event.lower()}')
+            when = 'WHEN new.row_version IS old.row_version' if event == 'UPDATE' else ''
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_row_version_{event.lower()}
+                AFTER {event} ON {table} {when}
+                BEGIN
+                    {bump}
+                    {stamp}
+                END
+            ''')
+            continue
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                {bump}
+            END
+        ''')
+
+
+def duration_bucket_sql(seconds):
+    """SQL expression mapping a duration in seconds to its histogram bucket's upper bound."""
+    cases = ' '.join(f'WHEN {seconds} <= {bound} THEN {bound}' for bound in ROLLUP_DURATION_BOUNDS)
+    return f'CASE {cases} ELSE 9e999 END'
+
+
+def ensure_rollups(cursor):
+    """Create the hourly/daily rollups of finished downloads and the trigger that feeds them.
+
+    Each time a download reaches a terminal status, its hour and day buckets
+    (UTC) count it by status with its output bytes; completed ones also add
+    their duration (last started to finished) to a histogram and count toward
+    their video's total. A failed or cancelled download that is retried is
+    taken back out of its buckets, so each download counts once, by its
+    final outcome. Rollups outlive the downloads rows cleanup deletes.
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'download_rollups'"
+    ).fetchone()
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS download_rollups (
+            granularity TEXT NOT NULL,
+            bucket_start TEXT NOT NULL,
+            status TEXT NOT NULL,
+            jobs INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            duration_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket_start, status)
+        )
+    ''')
+    # Completed jobs per duration bucket; `le` is the bucket's upper bound in seconds
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS download_rollup_durations (
+            granularity TEXT NOT NULL,
+            bucket_start TEXT NOT NULL,
+            le REAL NOT NULL,
+            jobs INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket_start, le)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS download_rollup_videos (
+            granularity TEXT NOT NULL,
+            bucket_start TEXT NOT NULL,
+            youtube_url TEXT NOT NULL,
+            title TEXT,
+            jobs INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket_start, youtube_url)
+        )
+    ''')
+
+    # Failed and cancelled outcomes still counted, with when they were; a retry reopens them
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS download_rollup_outcomes (
+            download_id INTEGER PRIMARY KEY REFERENCES downloads(id) ON DELETE CASCADE,
+            status TEXT NOT NULL,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            finished_at TEXT NOT NULL
+        )
+    ''')
+
+    duration = "(julianday('now') - julianday(COALESCE(new.started_at, new.created_at))) * 86400"
+    statements = []
+    reopen = []
+    for granularity, bucket in ROLLUP_GRANULARITIES.items():
+        start = f"strftime('{bucket}', 'now')"
+        statements.append(f'''
+            INSERT INTO download_rollups (granularity, bucket_start, status, jobs, bytes, duration_sum)
+            VALUES ('{granularity}', {start}, new.status, 1, COALESCE(new.file_size, 0),
+                CASE WHEN new.status = 'completed' THEN {duration} ELSE 0 END)
+            ON CONFLICT (granularity, bucket_start, status) DO UPDATE SET
+                jobs = jobs + 1,
+                bytes = bytes + excluded.bytes,
+                duration_sum = duration_sum + excluded.duration_sum;
+            INSERT INTO download_rollup_durations (granularity, bucket_start, le, jobs)
+            SELECT '{granularity}', {start}, {duration_bucket_sql(duration)}, 1
+            WHERE new.status = 'completed'
+            ON CONFLICT (granularity, bucket_start, le) DO UPDATE SET jobs = jobs + 1;
+            INSERT INTO download_rollup_videos (granularity, bucket_start, youtube_url, title, jobs, bytes)
+            SELECT '{granularity}', {start}, new.youtube_url, new.title, 1, COALESCE(new.file_size, 0)
+            WHERE new.status = 'completed'
+            ON CONFLICT (granularity, bucket_start, youtube_url) DO UPDATE SET
+                title = excluded.title,
+                jobs = jobs + 1,
+                bytes = bytes + excluded.bytes;
+        ''')
+        reopen.append(f'''
+            UPDATE download_rollups SET jobs = jobs - 1, bytes = download_rollups.bytes - outcome.bytes
+            FROM (SELECT * FROM download_rollup_outcomes WHERE download_id = new.id) AS outcome
+            WHERE granularity = '{granularity}'
+                AND bucket_start = strftime('{bucket}', outcome.finished_at)
+                AND download_rollups.status = outcome.status;
+        ''')
+    # Replaces the trigger of older versions, which timed jobs from created_at
+    cursor.execute('DROP TRIGGER IF EXISTS downloads_rollup')
+    cursor.execute(f'''
+        CREATE TRIGGER downloads_rollup
+        AFTER UPDATE OF status ON downloads
+        WHEN new.status IN ('completed', 'failed', 'cancelled') AND old.status IS NOT new.status
+        BEGIN
+            {''.join(statements)}
+            INSERT OR REPLACE INTO download_rollup_outcomes (download_id, status, bytes, finished_at)
+            SELECT new.id, new.status, COALESCE(new.file_size, 0), datetime('now')
+            WHERE new.status IN ('failed', 'cancelled');
+        END
+    ''')
+    # Only failed and cancelled downloads are retried; completed ones stay counted
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS downloads_rollup_reopen
+        AFTER UPDATE OF status ON downloads
+        WHEN old.status IN ('failed', 'cancelled') AND new.status NOT IN ('completed', 'failed', 'cancelled')
+        BEGIN
+            {''.join(reopen)}
+            DELETE FROM download_rollup_outcomes WHERE download_id = new.id;
+        END
+    ''')
+
+    # Roll up the history that existed before the rollups did
+    if not exists:
+        backfill_rollups(cursor)
+
+
+def backfill_rollups(cursor):
+    """Fill the rollups from finished downloads rows, bucketed by when they finished."""
+    # completed_at is local time and created_at UTC. Failed and cancelled rows
+    # don't record when they finished, so they fall in the bucket they were created in
+    completed = "datetime(completed_at, 'utc')"
+    finished = f'COALESCE({completed}, created_at)'
+    duration = f'(julianday({completed}) - julianday(COALESCE(started_at, created_at))) * 86400'
+    for granularity, bucket in ROLLUP_GRANULARITIES.items():
+        start = f"strftime('{bucket}', {finished})"
+        cursor.execute(f'''
+            INSERT INTO download_rollups (granularity, bucket_start, status, jobs, bytes, duration_sum)
+            SELECT '{granularity}', {start}, status, COUNT(*), COALESCE(SUM(file_size), 0),
+                COALESCE(SUM(CASE WHEN status = 'completed' THEN {duration} END), 0)
+            FROM downloads WHERE status IN ('completed', 'failed', 'cancelled')
+            GROUP BY 2, 3
+        ''')
+        cursor.execute(f'''
+            INSERT INTO download_rollup_durations (granularity, bucket_start, le, jobs)
+            SELECT '{granularity}', {start}, {duration_bucket_sql(duration)}, COUNT(*)
+            FROM downloads WHERE status = 'completed'
+            GROUP BY 2, 3
+        ''')
+        cursor.execute(f'''
+            INSERT INTO download_rollup_videos (granularity, bucket_start, youtube_url, title, jobs, bytes)
+            SELECT '{granularity}', {start}, youtube_url, MAX(title), COUNT(*), COALESCE(SUM(file_size), 0)
+            FROM downloads WHERE status = 'completed'
+            GROUP BY 2, 3
+        ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO download_rollup_outcomes (download_id, status, bytes, finished_at)
+        SELECT id, status, COALESCE(file_size, 0), created_at
+        FROM downloads WHERE status IN ('failed', 'cancelled')
+    ''')
+
+
+def prune_rollups(granularity, older_than_days):
+    """Delete `granularity` rollup buckets older than `older_than_days`; returns how many rows went."""
+    deleted = 0
+    with get_db_cursor() as cursor:
+        for table in ('download_rollups', 'download_rollup_durations', 'download_rollup_videos'):
+            cursor.execute(
+                f'''DELETE FROM {table} WHERE granularity = ?
+                AND bucket_start < strftime('%Y-%m-%d %H:%M:%S', 'now', ?)''',
+                [granularity, f'-{int(older_than_days)} days']
+            )
+            deleted += cursor.rowcount
+    return deleted
+
+
+def ensure_webhooks(cursor):
+    """Create the webhook delivery queue, its dead-letter table and the trigger that feeds it.
+
+    A download with a callback_url gets one delivery each time it turns
+    completed or failed, in the same transaction as the status change, so
+    no event is lost whichever process finished the job. The payload is
+    fixed when the event happens; services.webhooks sends it.
+    """
+    # next_attempt_at and lease_expires_at are epoch seconds
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_deliveries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            download_id INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            event TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            response_status INTEGER,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            delivered_at DATETIME
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_due ON webhook_deliveries(next_attempt_at)
+        WHERE status = 'pending'
+    ''')
+    # Deliveries that ran out of attempts or were refused by the receiver
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            delivery_id INTEGER NOT NULL,
+            download_id INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            event TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            response_status INTEGER,
+            last_error TEXT,
+            created_at DATETIME,
+            failed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS downloads_webhook
+        AFTER UPDATE OF status ON downloads
+        WHEN new.callback_url IS NOT NULL AND new.status IN ('completed', 'failed')
+            AND old.status IS NOT new.status
+        BEGIN
+            INSERT INTO webhook_deliveries (download_id, url, event, payload)
+            VALUES (new.id, new.callback_url, 'download.' || new.status, json_object(
+                'event', 'download.' || new.status,
+                'occurred_at', strftime('%Y-%m-%dT%H:%M:%fZ', 'now'),
+                'download', json_object(
+                    'id', new.id,
+                    'status', new.status,
+                    'youtube_url', new.youtube_url,
+                    'title', new.title,
+                    'uploader', new.uploader,
+                    'duration', new.duration,
+                    'quality', new.quality,
+                    'format', new.format,
+                    'clip_start', new.clip_start,
+                    'clip_end', new.clip_end,
+                    'file_size', new.file_size,
+                    'file_url', CASE WHEN new.status = 'completed' THEN '/api/download/' || new.id || '/file' END,
+                    'error_message', new.error_message,
+                    'created_at', new.created_at,
+                    'completed_at', new.completed_at
+                )
+            ));
+        END
+    ''')
+
+
+def get_table_version(table):
+    """Return (version, last change as an aware UTC datetime) for a table."""
+    row = get_query('SELECT version, updated_at FROM table_versions WHERE name = ?', [table])
+    if row is None:
+        return 0, None
+    updated_at = datetime.fromisoformat(row['updated_at']).replace(tzinfo=timezone.utc)
+    return row['version'], updated_at
+
+
+def file_shared(file_path, download_id):
+    """True if a download other than `download_id` also uses `file_path`.
+
+    Identical requests share one cached output file, which must only be
+    deleted with its last download.
+    """
+    row = get_query(
+        'SELECT 1 AS shared FROM downloads WHERE file_path = ? AND id != ? LIMIT 1',
+        [file_path, download_id]
+    )
+    return row is not None
+
 
 def get_db():
     """Get the database connection."""
@@ -56,16 +558,17 @@ def get_db():
 @contextmanager
 def get_db_cursor():
     """Context manager for database cursor."""
-    conn = get_db()
-    cursor = conn.cursor()
-    try:
-        yield cursor
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cursor.close()
+    with db_lock:
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cursor.close()
 
 
 def run_query(sql, params=None):
@@ -0,0 +1,206 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import config
+
+# Correlation ids, set per request (Flask) or per background job
+request_id_var = contextvars.ContextVar('request_id', default=None)
+job_id_var = contextvars.ContextVar('job_id', default=None)
+
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warn': logging.WARNING,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'critical': logging.CRITICAL,
+}
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime', 'request_id', 'job_id', 'suppressed',
+}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class ContextFilter(logging.Filter):
+    """Attach the current request/job correlation ids to each record."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.job_id = job_id_var.get()
+        return True
+
+
+class ErrorSampler(logging.Filter):
+    """Sample repeated WARNING+ records so a failure storm can't flood the log.
+
+    The first `burst` occurrences of a message template within `window`
+    seconds are emitted; the rest are dropped and counted, and the count is
+    reported on the next record that gets through.
+    """
+
+    def __init__(self, window=None, burst=None):
+        super().__init__()
+        self.window = config.LOG_SAMPLE_WINDOW if window is None else window
+        self.burst = config.LOG_SAMPLE_BURST if burst is None else burst
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.window <= 0:
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+
+        with self._lock:
+            window_start, count, suppressed = self._seen.get(key, (now, 0, 0))
+            if now - window_start > self.window:
+                window_start, count = now, 0
+
+            count += 1
+            if count > self.burst:
+                self._seen[key] = (window_start, count, suppressed + 1)
+                return False
+
+            self._seen[key] = (window_start, count, 0)
+            if len(self._seen) > 1000:
+                self._seen.clear()
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Render records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'job_id', None) is not None:
+            entry['job_id'] = record.job_id
+        if getattr(record, 'suppressed', None):
+            entry['suppressed'] = record.suppressed
+
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        elif record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps structured fields instead of pre-formatting."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block the caller on log I/O; drop instead
+            pass
+
+
+def setup_logging(level=None):
+    """Configure the root logger once.
+
+    Records are filtered and sampled on the calling thread, then handed to a
+    bounded queue; a listener thread does the formatting and stream I/O.
+    """
+    global _listener
+
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        if level is None:
+            level = config.LOG_LEVEL
+        if isinstance(level, str):
+            level = LEVELS.get(level.lower(), logging.INFO)
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter())
+
+        log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+        queue_handler = _QueueHandler(log_queue)
+        queue_handler.setLevel(level)
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(ErrorSampler())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+        # Werkzeug defaults its access log to INFO and adds its own stream handler otherwise
+        logging.getLogger('werkzeug').setLevel(level)
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, stream_handler, respect_handler_level=True
+        )
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush pending records and stop the listener thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name):
+    """Get a logger, configuring logging on first use."""
+    if _listener is None:
+        setup_logging()
+    return logging.getLogger(name)
+
+
+@contextmanager
+def log_context(request_id=None, job_id=None):
+    """Bind correlation ids for the duration of a block."""
+    tokens = []
+    if request_id is not None:
+        tokens.append((request_id_var, request_id_var.set(request_id)))
+    if job_id is not None:
+        tokens.append((job_id_var, job_id_var.set(job_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
@@ -0,0 +1,39 @@
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(int)
+_collectors = {}
+_lock = threading.Lock()
+
+
+def _key(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}={v}' for k, v in sorted(labels.items())) + '}'
+
+
+def increment(name, value=1, **labels):
+    """Add to a counter, e.g. increment('jobs_finished', status='completed')."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def register_collector(name, collect):
+    """Register a callable whose return value is included in every snapshot."""
+    with _lock:
+        _collectors[name] = collect
+
+
+def snapshot():
+    """Return all counters plus the current output of each collector."""
+    with _lock:
+        data = {'counters': dict(_counters)}
+        collectors = list(_collectors.items())
+
+    for name, collect in collectors:
+        try:
+            data[name] = collect()
+        except Exception as error:
+            data[name] = {'error': str(error)}
+    return data
@@ -0,0 +1,33 @@
+import hmac
+from functools import wraps
+from flask import request, jsonify
+import config
+
+
+def admin_token():
+    """Token sent as "Authorization: Bearer <token>" (or X-Admin-Token)."""
+    authorization = request.headers.get('Authorization', '')
+    if authorization.lower().startswith('bearer '):
+        return authorization[len('bearer '):].strip()
+    return request.headers.get('X-Admin-Token', '')
+
+
+def require_admin(f):
+    """Admin-only route: 404 while ADMIN_TOKEN is unset, 401 without the token."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not config.ADMIN_TOKEN:
+            return jsonify({
+                'success': False,
+                'message': 'Endpoint not found',
+            }), 404
+
+        if not hmac.compare_digest(admin_token().encode(), config.ADMIN_TOKEN.encode()):
+            return jsonify({
+                'success': False,
+                'message': 'Admin token required',
+            }), 401
+
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,146 @@
+import math
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import jsonify
+import config
+import database
+import metrics
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Completion rate is a scan of recent history; under overload every shed
+# request would run it, so it is reused for a few seconds
+RATE_CACHE_SECONDS = 10
+# Shortest span a completion rate is measured over, so a burst right after
+# an idle period doesn't read as a sustained rate
+MIN_RATE_SPAN = 60
+
+_rate_cache = {'at': None, 'rate': None}
+_rate_lock = threading.Lock()
+
+
+def queue_counts():
+    """(queued, active): pending and processing downloads across every process."""
+    counts = {
+        row['status']: row['count']
+        for row in database.all_query(
+            '''SELECT status, COUNT(*) AS count FROM downloads
+            WHERE status IN ('pending', 'processing') GROUP BY status'''
+        )
+    }
+    return counts.get('pending', 0), counts.get('processing', 0)
+
+
+def completion_rate():
+    """Downloads completed per second over the last ADMISSION_RATE_WINDOW, or None without any."""
+    now = time.monotonic()
+    with _rate_lock:
+        if _rate_cache['at'] is not None and now - _rate_cache['at'] < RATE_CACHE_SECONDS:
+            return _rate_cache['rate']
+
+    current = datetime.now()
+    row = database.get_query(
+        '''SELECT COUNT(*) AS count, MIN(completed_at) AS first FROM downloads
+        WHERE status = 'completed' AND completed_at >= ?''',
+        [(current - timedelta(seconds=config.ADMISSION_RATE_WINDOW)).isoformat()]
+    )
+    rate = None
+    if row and row['count']:
+        # Over the part of the window that saw completions (e.g. since startup)
+        span = (current - datetime.fromisoformat(row['first'])).total_seconds()
+        rate = row['count'] / max(span, MIN_RATE_SPAN)
+
+    with _rate_lock:
+        _rate_cache.update(at=now, rate=rate)
+    return rate
+
+
+def drain_seconds(jobs, rate):
+    """Seconds until `jobs` more downloads finish at the recent completion rate."""
+    if not rate:
+        return config.ADMISSION_RETRY_AFTER_DEFAULT
+    return math.ceil(jobs / rate)
+
+
+def retry_after(seconds):
+    return max(1, min(int(seconds), config.ADMISSION_RETRY_AFTER_MAX))
+
+
+def shed_decision():
+    """Why a new download should be turned away right now, or None to admit it.
+
+    Checks, in order: queued downloads, running downloads, free disk in
+    UPLOAD_FOLDER and load average per CPU against their ADMISSION_*
+    thresholds (0 disables a check). Queue-based decisions estimate when
+    there will be room from how fast downloads completed recently.
+    """
+    queued, active = queue_counts()
+
+    if config.ADMISSION_MAX_QUEUE and queued >= config.ADMISSION_MAX_QUEUE:
+        rate = completion_rate()
+        return {
+            'reason': 'queue_full',
+            'message': f'Too many downloads waiting ({queued}); try again later',
+            'retry_after': retry_after(drain_seconds(queued - config.ADMISSION_MAX_QUEUE + 1, rate)),
+            'queue_position': queued + 1,
+            'estimated_wait_seconds': drain_seconds(queued + 1, rate) if rate else None,
+        }
+
+    if config.ADMISSION_MAX_ACTIVE and active >= config.ADMISSION_MAX_ACTIVE:
+        rate = completion_rate()
+        return {
+            'reason': 'busy',
+            'message': f'Too many downloads running ({active}); try again later',
+            'retry_after': retry_after(drain_seconds(active - config.ADMISSION_MAX_ACTIVE + 1, rate)),
+        }
+
+    if config.ADMISSION_MIN_FREE_MB:
+        free_mb = shutil.disk_usage(config.UPLOAD_FOLDER).free / (1024 * 1024)
+        if free_mb < config.ADMISSION_MIN_FREE_MB:
+            return {
+                'reason': 'disk_full',
+                'message': 'Not enough free disk space for new downloads; try again later',
+                'retry_after': retry_after(config.ADMISSION_DISK_RETRY_AFTER),
+            }
+
+    if config.ADMISSION_MAX_LOAD and hasattr(os, 'getloadavg'):
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        if load > config.ADMISSION_MAX_LOAD:
+            # The further over the limit, the longer the 1-minute average takes to settle
+            return {
+                'reason': 'overloaded',
+                'message': 'Server is overloaded; try again later',
+                'retry_after': retry_after(config.ADMISSION_LOAD_RETRY_AFTER * load / config.ADMISSION_MAX_LOAD),
+            }
+
+    return None
+
+
+def admission_control(f):
+    """Shed new downloads with 503 + Retry-After while the service is saturated."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            decision = shed_decision()
+        except Exception as error:
+            # Admission control must not take download creation down with it
+            logger.error('Admission check failed, admitting: %s', error)
+            decision = None
+
+        if decision is None:
+            metrics.increment('admission', result='admitted')
+            return f(*args, **kwargs)
+
+        metrics.increment('admission', result='shed', reason=decision['reason'])
+        logger.warning('Download shed: %s', decision['reason'], extra={'retry_after': decision['retry_after']})
+        response = jsonify({'success': False, **decision})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(decision['retry_after'])
+        return response
+
+    return decorated_function
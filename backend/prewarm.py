@@ -0,0 +1,274 @@
+"""Prewarm the artifact cache from a list of YouTube URLs, without the HTTP API.
+
+Run from the backend directory:
+
+    python prewarm.py urls.txt --workers 4
+    python prewarm.py --playlist 'https://www.youtube.com/playlist?list=...' --format opus
+    python prewarm.py urls.txt --dry-run
+
+URL files hold one URL per line ('#' starts a comment; '-' reads stdin).
+Jobs go through the same DownloadPipeline as the API, bypassing only the
+HTTP layer and its rate limiter, and are recorded as downloads rows so the
+artifacts are registered like any other. The run leases its rows like a
+worker process, so it can share the queue with running workers.
+Interrupting the run (Ctrl+C) checkpoints running jobs; running it again
+with the same arguments skips what finished and resumes the rest from
+their partial data.
+"""
+import argparse
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+import database
+from services.pipeline import DownloadJob, get_pipeline
+from services.scheduler import estimated_size
+from services.worker import get_worker
+from services.youtube import YouTubeDownloadError, YouTubeService
+
+# Stands in for the client address on prewarm rows: identifies them on a
+# resumed run, and fair scheduling treats the whole run as one client
+PREWARM_CLIENT = 'prewarm'
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+def read_urls(paths, playlists, youtube_service):
+    """URLs from files and playlists, de-duplicated in order."""
+    urls = []
+    for path in paths:
+        lines = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        with lines:
+            for line in lines:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    urls.append(line)
+    for playlist in playlists:
+        urls.extend(youtube_service.playlist_urls(playlist))
+    return list(dict.fromkeys(urls))
+
+
+def existing_row(url, quality, output_format):
+    """The latest prewarm row for a URL and encode options, if any."""
+    return database.get_query(
+        '''SELECT id, title, duration, status FROM downloads
+        WHERE youtube_url = ? AND quality = ? AND format = ? AND client_ip = ?
+            AND clip_start IS NULL AND clip_end IS NULL
+        ORDER BY id DESC LIMIT 1''',
+        [url, quality, output_format, PREWARM_CLIENT]
+    )
+
+
+def probe_all(urls, workers, youtube_service):
+    """Probe URLs in parallel; returns {url: info or YouTubeDownloadError}."""
+    def probe(url):
+        try:
+            return url, youtube_service.get_video_info(url)
+        except YouTubeDownloadError as error:
+            return url, error
+
+    with ThreadPoolExecutor(workers) as pool:
+        return dict(pool.map(probe, urls))
+
+
+def stage_rates():
+    """Seconds of download and encode work per second of audio, from past jobs.
+
+    Returns None for a stage with no completed history to calibrate from.
+    """
+    rows = database.all_query(
+        '''SELECT s.name, SUM(s.end_ns - s.start_ns) / 1e9 AS busy,
+            SUM(COALESCE(d.clip_end, d.duration) - COALESCE(d.clip_start, 0)) AS audio
+        FROM download_spans s JOIN downloads d ON d.id = s.download_id
+        WHERE s.name IN ('download', 'encode') AND s.status = 'ok'
+            AND d.status = 'completed' AND d.duration > 0
+        GROUP BY s.name'''
+    )
+    rates = {row['name']: row['busy'] / row['audio'] for row in rows if row['audio']}
+    return rates.get('download'), rates.get('encode')
+
+
+def estimate(jobs, quality, workers, encode_workers):
+    """Dry-run report: output size and wall time for the jobs not yet cached."""
+    audio = sum(job.duration for job in jobs)
+    size = sum(estimated_size(job.duration, job.format, quality) for job in jobs)
+    download_rate, encode_rate = stage_rates()
+
+    # The stages overlap, so the slower one bounds the run
+    stage_times = []
+    if download_rate is not None:
+        stage_times.append(audio * download_rate / workers)
+    if encode_rate is not None:
+        stage_times.append(audio * encode_rate / encode_workers)
+
+    return {
+        'jobs': len(jobs),
+        'audio_seconds': round(audio),
+        'estimated_bytes': size,
+        'estimated_seconds': round(max(stage_times)) if stage_times else None,
+    }
+
+
+def plan(urls, args, pipeline, youtube_service):
+    """Sort URLs into jobs to run, URLs an earlier run finished, and probe failures.
+
+    Jobs for URLs seen by an earlier run keep that run's download id (and so
+    its partial data); new ones have none yet and their probe info in `probed`.
+    """
+    jobs, done, failed, probed, to_probe = [], [], {}, {}, []
+
+    for url in urls:
+        row = existing_row(url, args.quality, args.format)
+        if row is None:
+            to_probe.append(url)
+            continue
+        job = DownloadJob(
+            row['id'], url, args.quality, row['title'], duration=row['duration'],
+            client_ip=PREWARM_CLIENT, output_format=args.format,
+        )
+        if row['status'] == 'completed' and pipeline.find_artifact(job):
+            done.append(url)
+        else:
+            # Left unfinished (or cleaned up since) by an earlier run: resume it
+            jobs.append(job)
+
+    for url, info in probe_all(to_probe, args.workers, youtube_service).items():
+        if isinstance(info, YouTubeDownloadError):
+            failed[url] = info.message
+            continue
+        duration = info.get('duration') or 0
+        if estimated_size(duration, args.format, args.quality) > config.MAX_FILE_SIZE:
+            failed[url] = f'Video too long: output would exceed {config.MAX_FILE_SIZE // (1024 * 1024)}MB'
+            continue
+        probed[url] = info
+        jobs.append(DownloadJob(
+            None, url, args.quality, info['title'], duration=duration,
+            client_ip=PREWARM_CLIENT, output_format=args.format,
+        ))
+
+    return jobs, done, failed, probed
+
+
+def register(job, info):
+    """Insert the downloads row for a newly probed job."""
+    result = database.run_query(
+        '''INSERT INTO downloads (youtube_url, title, uploader, duration, thumbnail_source,
+            quality, format, client_ip, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, "pending")''',
+        [job.url, job.title, info.get('uploader'), job.duration,
+         info.get('thumbnail'), job.quality, job.format, PREWARM_CLIENT]
+    )
+    job.download_id = result['id']
+
+
+def run(jobs, probed, pipeline, worker):
+    """Queue jobs, run them here, and wait for them; returns counts by final status.
+
+    Jobs are leased to this process like any worker's, so workers sharing the
+    queue leave them alone. One already running elsewhere is awaited, and
+    taken over here if that process dies and its lease expires.
+    """
+    for job in jobs:
+        if job.download_id is None:
+            register(job, probed[job.url])
+        else:
+            database.run_query(
+                '''UPDATE downloads SET status = "pending", error_message = NULL
+                WHERE id = ? AND status NOT IN ("pending", "processing")''',
+                [job.download_id]
+            )
+    ids = [job.download_id for job in jobs]
+    pending = set(ids)
+    counts = {}
+    while pending:
+        # Leases this run holds stay live; expired ones of other processes are taken over
+        worker.claim(len(pending), ids=list(pending))
+        time.sleep(1)
+        for download_id in list(pending):
+            # Still tracked means queued, running or backing off before a retry
+            if pipeline.registry.get(download_id) is not None:
+                continue
+            row = database.get_query('SELECT status FROM downloads WHERE id = ?', [download_id])
+            if row and row['status'] in TERMINAL_STATUSES:
+                counts[row['status']] = counts.get(row['status'], 0) + 1
+                pending.discard(download_id)
+        print(f'{len(jobs) - len(pending)}/{len(jobs)} done', file=sys.stderr)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert a list of YouTube URLs into the artifact cache.')
+    parser.add_argument('files', nargs='*', help="files with one URL per line ('-' for stdin)")
+    parser.add_argument('--playlist', action='append', default=[], help='playlist URL to expand (repeatable)')
+    parser.add_argument('--quality', default=config.DEFAULT_QUALITY, choices=config.ALLOWED_QUALITIES)
+    parser.add_argument('--format', default=config.DEFAULT_FORMAT, choices=config.ALLOWED_FORMATS)
+    parser.add_argument('--workers', type=int, default=config.DOWNLOAD_WORKERS_MAX,
+                        help='parallel probes and maximum parallel downloads')
+    parser.add_argument('--encode-workers', type=int, default=config.ENCODE_WORKERS,
+                        help='parallel encodes')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='probe and estimate output size and time without converting anything')
+    args = parser.parse_args(argv)
+
+    if not args.files and not args.playlist:
+        parser.error('give at least one URL file or --playlist')
+    args.workers = max(1, args.workers)
+    args.encode_workers = max(1, args.encode_workers)
+
+    # The pipeline reads its pool sizes from config when first created
+    config.DOWNLOAD_WORKERS_MAX = args.workers
+    config.DOWNLOAD_WORKERS_INITIAL = min(config.DOWNLOAD_WORKERS_INITIAL, args.workers)
+    config.ENCODE_WORKERS = args.encode_workers
+
+    os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(os.path.dirname(config.DATABASE_PATH), exist_ok=True)
+    database.init_db()
+    youtube_service = YouTubeService()
+    pipeline = get_pipeline()
+    worker = get_worker()
+
+    urls = read_urls(args.files, args.playlist, youtube_service)
+    invalid = [url for url in urls if not youtube_service.validate_url(url)]
+    urls = [url for url in urls if youtube_service.validate_url(url)]
+    for url in invalid:
+        print(f'skipped (not a YouTube URL): {url}', file=sys.stderr)
+
+    jobs, done, failed, probed = plan(urls, args, pipeline, youtube_service)
+    # Jobs whose artifact another download already produced only need a row
+    uncached = [job for job in jobs if not pipeline.find_artifact(job)]
+    for url, message in failed.items():
+        print(f'skipped ({message.splitlines()[0]}): {url}', file=sys.stderr)
+    print(f'{len(urls)} URLs: {len(uncached)} to convert, {len(jobs) - len(uncached)} cached by other '
+          f'downloads, {len(done)} done by an earlier run, {len(failed)} unavailable', file=sys.stderr)
+
+    if args.dry_run:
+        report = estimate(uncached, args.quality, args.workers, args.encode_workers)
+        print(f'Audio: {report["audio_seconds"]}s, estimated output: '
+              f'{report["estimated_bytes"] / (1024 * 1024):.1f}MB')
+        if report['estimated_seconds'] is None:
+            print('Estimated time: unknown (no completed downloads to calibrate from)')
+        else:
+            print(f'Estimated time: {report["estimated_seconds"]}s '
+                  f'with {args.workers} download / {args.encode_workers} encode workers')
+        return 0
+
+    def stop(sig, frame):
+        print('Interrupted; checkpointing running jobs (run again to resume)', file=sys.stderr)
+        worker.stop()
+        database.close_db()
+        sys.exit(130)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    worker.start(claim=False)
+    counts = run(jobs, probed, pipeline, worker)
+    print(', '.join(f'{count} {status}' for status, count in sorted(counts.items())) or 'nothing to do')
+    database.close_db()
+    return 1 if counts.get('failed') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""On-demand profiling of the running process.
+
+Nothing here runs until an admin asks for it: the CPU sampler is a thread
+that exists only while a profile is being recorded, and tracemalloc is
+started and stopped explicitly. Stacks are written in the folded format
+("root;caller;callee count" per line) read by flamegraph.pl, speedscope
+and inferno.
+"""
+import faulthandler
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+import config
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Finished CPU profiles kept for download
+MAX_PROFILES = 5
+
+_STDLIB = os.path.dirname(os.__file__) + os.sep
+
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+_memory = {'baseline': None, 'frames': None}
+_memory_lock = threading.Lock()
+
+
+class ProfilingError(Exception):
+    """Custom exception for profiling errors; `conflict` when the profiler is in the wrong state."""
+    def __init__(self, message, conflict=False):
+        self.message = message
+        self.conflict = conflict
+        super().__init__(self.message)
+
+
+def _short_path(filename):
+    """Source path relative to the backend, site-packages or the stdlib, so frames stay readable."""
+    base = str(config.BASE_DIR) + os.sep
+    if filename.startswith(base):
+        return filename[len(base):]
+    marker = f'{os.sep}site-packages{os.sep}'
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    if filename.startswith(_STDLIB):
+        return filename[len(_STDLIB):]
+    return filename
+
+
+def _location(filename, lineno):
+    return f'{_short_path(filename)}:{lineno}'
+
+
+def _frame_label(function, filename, lineno):
+    return f'{function} ({_location(filename, lineno)})'
+
+
+def thread_names():
+    """Thread name per thread ident."""
+    return {thread.ident: thread.name for thread in threading.enumerate()}
+
+
+def _thread_root(name):
+    # Per-request and per-job threads differ only by number; merge them in the graph
+    return 'thread ' + re.sub(r'\d+', 'N', name)
+
+
+class CpuProfile:
+    """Samples the stacks of every thread at a fixed interval for a fixed time."""
+
+    def __init__(self, profile_id, seconds, interval):
+        self.id = profile_id
+        self.seconds = seconds
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self._thread = threading.Thread(target=self._run, name=f'profiler-{profile_id}', daemon=True)
+
+    @property
+    def running(self):
+        return self.finished_at is None
+
+    @property
+    def remaining_seconds(self):
+        if not self.running:
+            return 0
+        return max(0.0, self.started_at + self.seconds - time.time())
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        try:
+            while time.monotonic() < deadline:
+                names = thread_names()
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(_frame_label(code.co_name, code.co_filename, frame.f_lineno))
+                        frame = frame.f_back
+                    stack.append(_thread_root(names.get(ident, str(ident))))
+                    self.samples[';'.join(reversed(stack))] += 1
+                self.sample_count += 1
+                time.sleep(self.interval)
+        except Exception as error:
+            logger.error('CPU profile %s failed: %s', self.id, error)
+        finally:
+            self.finished_at = time.time()
+            logger.info('CPU profile finished', extra={'profile_id': self.id, 'samples': self.sample_count})
+
+    def folded(self):
+        """Sample counts per stack, in the folded format."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def status(self):
+        return {
+            'id': self.id,
+            'status': 'running' if self.running else 'finished',
+            'seconds': self.seconds,
+            'interval': self.interval,
+            'samples': self.sample_count,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+def start_cpu_profile(seconds, interval=None):
+    """Start sampling all threads for `seconds`; one profile runs at a time."""
+    interval = interval or config.PROFILE_SAMPLE_INTERVAL
+    if not 0 < seconds <= config.PROFILE_MAX_SECONDS:
+        raise ProfilingError(f'seconds must be between 0 and {config.PROFILE_MAX_SECONDS}')
+    if not 0.001 <= interval <= 1:
+        raise ProfilingError('interval must be between 0.001 and 1 seconds')
+
+    with _profiles_lock:
+        if any(profile.running for profile in _profiles.values()):
+            raise ProfilingError('A CPU profile is already running', conflict=True)
+        profile = CpuProfile(os.urandom(6).hex(), seconds, interval)
+        _profiles[profile.id] = profile
+        while len(_profiles) > MAX_PROFILES:
+            _profiles.popitem(last=False)
+
+    logger.info('CPU profile started', extra={'profile_id': profile.id, 'seconds': seconds})
+    return profile.start()
+
+
+def get_cpu_profile(profile_id):
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+def cpu_profiles():
+    with _profiles_lock:
+        return [profile.status() for profile in _profiles.values()]
+
+
+def _take_snapshot():
+    # Leave out tracemalloc's own bookkeeping
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def start_memory_tracing(frames=None):
+    """Start tracemalloc and take the baseline snapshot later ones are compared to."""
+    frames = frames or config.PROFILE_TRACEMALLOC_FRAMES
+    with _memory_lock:
+        if tracemalloc.is_tracing():
+            raise ProfilingError('Memory tracing is already on', conflict=True)
+        tracemalloc.start(frames)
+        _memory.update(baseline=_take_snapshot(), frames=frames)
+    logger.info('Memory tracing started', extra={'frames': frames})
+
+
+def stop_memory_tracing():
+    """Stop tracemalloc, freeing its traces; returns False if it was off."""
+    with _memory_lock:
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        _memory.update(baseline=None, frames=None)
+    logger.info('Memory tracing stopped')
+    return True
+
+
+def memory_snapshot(rebase=False):
+    """(snapshot, baseline) of traced allocations; with `rebase` the snapshot becomes the new baseline."""
+    with _memory_lock:
+        if not tracemalloc.is_tracing():
+            raise ProfilingError('Memory tracing is off', conflict=True)
+        snapshot = _take_snapshot()
+        baseline = _memory['baseline']
+        if rebase:
+            _memory['baseline'] = snapshot
+    return snapshot, baseline
+
+
+def memory_status():
+    traced, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {
+        'tracing': tracemalloc.is_tracing(),
+        'frames': _memory['frames'],
+        'traced_bytes': traced,
+        'peak_bytes': peak,
+    }
+
+
+def memory_top(snapshot, baseline=None, limit=50):
+    """Largest allocation sites by line (or largest growth since `baseline`)."""
+    if baseline is None:
+        return [{
+            'location': _location(stat.traceback[-1].filename, stat.traceback[-1].lineno),
+            'size': stat.size,
+            'count': stat.count,
+        } for stat in snapshot.statistics('lineno')[:limit]]
+    return [{
+        'location': _location(stat.traceback[-1].filename, stat.traceback[-1].lineno),
+        'size': stat.size,
+        'size_diff': stat.size_diff,
+        'count': stat.count,
+        'count_diff': stat.count_diff,
+    } for stat in snapshot.compare_to(baseline, 'lineno')[:limit]]
+
+
+def memory_folded(snapshot, baseline=None):
+    """Live bytes (or bytes grown since `baseline`) per allocation stack, in the folded format."""
+    if baseline is None:
+        stats = [(stat.traceback, stat.size) for stat in snapshot.statistics('traceback')]
+    else:
+        stats = [(stat.traceback, stat.size_diff) for stat in snapshot.compare_to(baseline, 'traceback')]
+
+    lines = []
+    for traceback, size in stats:
+        if size <= 0:
+            continue
+        # Traceback frames run from the oldest call to the allocation
+        stack = ';'.join(_location(frame.filename, frame.lineno) for frame in traceback)
+        lines.append(f'{stack} {size}\n')
+    return ''.join(lines)
+
+
+def register_stack_dump():
+    """`kill -USR1 <pid>` prints every thread's stack to stderr, even when the process is stuck."""
+    if hasattr(signal, 'SIGUSR1'):
+        faulthandler.register(signal.SIGUSR1, all_threads=True)
+
+
+def thread_dump():
+    """Current stack of every thread, most recent call last, as text."""
+    names = thread_names()
+    daemons = {thread.ident: thread.daemon for thread in threading.enumerate()}
+    sections = []
+    for ident, frame in sys._current_frames().items():
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'  File "{_short_path(code.co_filename)}", line {frame.f_lineno}, in {code.co_name}')
+            frame = frame.f_back
+        kind = ' (daemon)' if daemons.get(ident) else ''
+        header = f'Thread {names.get(ident, "?")} [{ident}]{kind}:'
+        sections.append('\n'.join([header] + list(reversed(stack))))
+    return '\n\n'.join(sections) + '\n'
@@ -0,0 +1,98 @@
+import gzip
+import json
+from email.utils import format_datetime, parsedate_to_datetime
+from flask import Response, request
+import config
+
+# Optional fast paths; fall back to the standard library when not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def dumps(payload):
+    """Serialize a payload to JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=str)
+    return json.dumps(payload, default=str, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(payload, status=200, version=None, last_modified=None):
+    """Build a JSON response, optionally tagged for conditional GET.
+
+    `version` becomes a weak ETag and `last_modified` (an aware datetime)
+    the Last-Modified header; clients are told to revalidate every time.
+    """
+    response = Response(dumps(payload), status=status, mimetype='application/json')
+    if version is not None:
+        _add_validators(response, version, last_modified)
+    return response
+
+
+def not_modified(version, last_modified=None):
+    """Return a 304 response if the request's validators still match, else None."""
+    etag = _etag(version)
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if etag not in tags and '*' not in tags:
+            return None
+    else:
+        if_modified_since = request.headers.get('If-Modified-Since')
+        if not if_modified_since or last_modified is None:
+            return None
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return None
+        if last_modified.replace(microsecond=0) > since:
+            return None
+
+    response = Response(status=304)
+    _add_validators(response, version, last_modified)
+    return response
+
+
+def compress_response(response):
+    """after_request hook: brotli/gzip-encode large JSON bodies."""
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.direct_passthrough
+        or 'Content-Encoding' in response.headers
+        or response.mimetype != 'application/json'
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    data = response.get_data()
+    if len(data) < config.COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(data, quality=config.COMPRESS_LEVEL_BROTLI))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=config.COMPRESS_LEVEL_GZIP))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _etag(version):
+    return f'W/"{version}"'
+
+
+def _add_validators(response, version, last_modified):
+    response.headers['ETag'] = _etag(version)
+    if last_modified is not None:
+        response.headers['Last-Modified'] = format_datetime(last_modified, usegmt=True)
+    response.headers['Cache-Control'] = 'no-cache'
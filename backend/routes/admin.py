@@ -0,0 +1,190 @@
+from flask import Blueprint, Response, request, jsonify
+import profiling
+from services import webhooks
+from logger import get_logger
+from middleware.admin import require_admin
+
+admin_bp = Blueprint('admin', __name__)
+logger = get_logger(__name__)
+
+
+def folded_file(text, filename):
+    """Folded stacks as a download, ready for flamegraph.pl / speedscope."""
+    return Response(text, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-store',
+    })
+
+
+@admin_bp.route('/admin/profile/cpu', methods=['POST'])
+@require_admin
+def start_cpu_profile():
+    """POST /api/admin/profile/cpu?seconds=&interval= - Sample every thread's stack for a while."""
+    try:
+        seconds = request.args.get('seconds', 10, type=float)
+        interval = request.args.get('interval', type=float)
+        profile = profiling.start_cpu_profile(seconds, interval)
+        return jsonify({
+            'success': True,
+            'profile': profile.status(),
+            'download': f'/api/admin/profile/cpu/{profile.id}',
+        }), 202
+
+    except profiling.ProfilingError as error:
+        return jsonify({
+            'success': False,
+            'message': error.message,
+        }), 409 if error.conflict else 400
+
+    except Exception as error:
+        logger.exception('Error starting CPU profile: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error starting CPU profile: {str(error)}',
+        }), 500
+
+
+@admin_bp.route('/admin/profile/cpu', methods=['GET'])
+@require_admin
+def list_cpu_profiles():
+    """GET /api/admin/profile/cpu - Recent CPU profiles."""
+    return jsonify({
+        'success': True,
+        'profiles': profiling.cpu_profiles(),
+    }), 200
+
+
+@admin_bp.route('/admin/profile/cpu/<profile_id>', methods=['GET'])
+@require_admin
+def get_cpu_profile(profile_id):
+    """GET /api/admin/profile/cpu/:id - Folded stacks of a finished CPU profile."""
+    profile = profiling.get_cpu_profile(profile_id)
+    if profile is None:
+        return jsonify({
+            'success': False,
+            'message': 'Profile not found',
+        }), 404
+
+    if profile.running:
+        response = jsonify({
+            'success': True,
+            'profile': profile.status(),
+        })
+        response.status_code = 202
+        response.headers['Retry-After'] = str(max(1, round(profile.remaining_seconds)))
+        return response
+
+    return folded_file(profile.folded(), f'cpu-{profile.id}.folded')
+
+
+@admin_bp.route('/admin/profile/memory', methods=['POST'])
+@require_admin
+def start_memory_tracing():
+    """POST /api/admin/profile/memory?frames= - Start tracemalloc with a baseline snapshot."""
+    try:
+        profiling.start_memory_tracing(request.args.get('frames', type=int))
+        return jsonify({
+            'success': True,
+            'memory': profiling.memory_status(),
+        }), 200
+
+    except profiling.ProfilingError as error:
+        return jsonify({
+            'success': False,
+            'message': error.message,
+        }), 409
+
+
+@admin_bp.route('/admin/profile/memory', methods=['GET'])
+@require_admin
+def get_memory_snapshot():
+    """GET /api/admin/profile/memory?diff=&rebase=&format=json|folded - Snapshot traced allocations.
+
+    By default compares against the baseline (growth per site); `diff=0`
+    reports everything live instead, and `rebase=1` makes this snapshot
+    the baseline for the next one.
+    """
+    try:
+        output_format = request.args.get('format', 'json')
+        if output_format not in ('json', 'folded'):
+            return jsonify({
+                'success': False,
+                'message': 'Invalid format. Allowed: json, folded',
+            }), 400
+
+        snapshot, baseline = profiling.memory_snapshot(rebase=request.args.get('rebase') == '1')
+        if request.args.get('diff') == '0':
+            baseline = None
+
+        if output_format == 'folded':
+            return folded_file(profiling.memory_folded(snapshot, baseline),
+                               'memory-diff.folded' if baseline is not None else 'memory.folded')
+
+        return jsonify({
+            'success': True,
+            'memory': profiling.memory_status(),
+            'diff': baseline is not None,
+            'top': profiling.memory_top(snapshot, baseline, limit=request.args.get('limit', 50, type=int)),
+        }), 200
+
+    except profiling.ProfilingError as error:
+        return jsonify({
+            'success': False,
+            'message': error.message,
+        }), 409
+
+    except Exception as error:
+        logger.exception('Error taking memory snapshot: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error taking memory snapshot: {str(error)}',
+        }), 500
+
+
+@admin_bp.route('/admin/profile/memory', methods=['DELETE'])
+@require_admin
+def stop_memory_tracing():
+    """DELETE /api/admin/profile/memory - Stop tracemalloc and drop its traces."""
+    stopped = profiling.stop_memory_tracing()
+    return jsonify({
+        'success': True,
+        'message': 'Memory tracing stopped' if stopped else 'Memory tracing was not on',
+    }), 200
+
+
+@admin_bp.route('/admin/threads', methods=['GET'])
+@require_admin
+def get_thread_dump():
+    """GET /api/admin/threads - Current stack of every thread, as text."""
+    return Response(profiling.thread_dump(), mimetype='text/plain', headers={'Cache-Control': 'no-store'})
+
+
+@admin_bp.route('/admin/webhooks/dead-letters', methods=['GET'])
+@require_admin
+def list_dead_letters():
+    """GET /api/admin/webhooks/dead-letters?limit=&offset= - Webhooks that could not be delivered."""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    return jsonify({
+        'success': True,
+        'data': webhooks.dead_letters(limit, offset),
+        'limit': limit,
+        'offset': offset,
+    }), 200
+
+
+@admin_bp.route('/admin/webhooks/dead-letters/<int:dead_letter_id>/replay', methods=['POST'])
+@require_admin
+def replay_dead_letter(dead_letter_id):
+    """POST /api/admin/webhooks/dead-letters/:id/replay - Queue a dead-lettered webhook again."""
+    delivery_id = webhooks.replay(dead_letter_id)
+    if delivery_id is None:
+        return jsonify({
+            'success': False,
+            'message': 'Dead letter not found',
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'delivery_id': delivery_id,
+    }), 202
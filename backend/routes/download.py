@@ -1,126 +1,182 @@
 from flask import Blueprint, request, jsonify, send_file
 import os
-import threading
-import uuid
-from datetime import datetime
+import shutil
+import time
 import database
-from services.youtube import YouTubeService, YouTubeDownloadError
+from services.youtube import YouTubeService, YouTubeDownloadError, display_timestamp, parse_timestamp
+from services.pipeline import get_pipeline
+from services.scheduler import estimated_size
+from services.egress import get_shaper
+from services.storage import storage_for
+from services.webhooks import WebhookError, validate_callback_url
+from services import worker
+from middleware.admission import admission_control
 from middleware.rate_limit import rate_limit
 import config
+from logger import get_logger, request_id_var
+import tracing
+from responses import json_response
 
 download_bp = Blueprint('download', __name__)
 youtube_service = YouTubeService()
+pipeline = get_pipeline()
+logger = get_logger(__name__)
 
+UNFINISHED_STATUSES = ('pending', 'processing')
 
-def process_download(download_id, url, quality):
-    """Process download in background."""
-    try:
-        # Update status to processing
-        database.run_query(
-            'UPDATE downloads SET status = "processing" WHERE id = ?',
-            [download_id]
-        )
-
-        # Download audio
-        result = youtube_service.download_audio(url, quality)
-
-        # Update download record with success
-        now = datetime.now().isoformat()
-        database.run_query(
-            '''UPDATE downloads SET
-                file_path = ?,
-                file_size = ?,
-                status = "completed",
-                completed_at = ?
-            WHERE id = ?''',
-            [result['filePath'], result['fileSize'], now, download_id]
-        )
-    except Exception as error:
-        # Update download record with error
-        error_message = str(error) if str(error) else 'Unknown error occurred'
-        database.run_query(
-            'UPDATE downloads SET status = "failed", error_message = ? WHERE id = ?',
-            [error_message, download_id]
-        )
-
-        print(f'Error processing download {download_id}: {error}')
+# What status_payload reads, for queries that don't need SELECT *
+STATUS_COLUMNS = '''id, title, uploader, duration, clip_start, clip_end, normalize, thumbnail_path,
+    quality, format, status, error_message, attempts, file_size, created_at, completed_at, row_version'''
 
 
 @download_bp.route('/download', methods=['POST'])
+@admission_control
 @rate_limit
 def create_download():
     """POST /api/download - Create a new download."""
+    trace = tracing.Trace()
+
+    with trace.span('request', route='POST /api/download') as request_span:
+        response, status = _create_download(trace)
+        request_span.set_attribute('http.status_code', status)
+
+    if trace.download_id is not None:
+        trace.save(trace.download_id)
+
+    return response, status
+
+
+def _create_download(trace):
     try:
-        print('[DOWNLOAD] Request received')
         data = request.get_json()
-        print(f'[DOWNLOAD] Request data: {data}')
-        
+
         url = data.get('url', '').strip() if data else ''
         quality = data.get('quality', config.DEFAULT_QUALITY) if data else config.DEFAULT_QUALITY
-        
-        print(f'[DOWNLOAD] URL: {url}, Quality: {quality}')
+        output_format = data.get('format', config.DEFAULT_FORMAT) if data else config.DEFAULT_FORMAT
+
+        logger.debug('Download requested', extra={'url': url, 'quality': quality, 'format': output_format})
 
         # Validation
         if not url:
-            print('[DOWNLOAD] FAIL: URL is required')
             return jsonify({
                 'success': False,
                 'message': 'YouTube URL is required',
             }), 400
 
         if len(url) > 500:
-            print('[DOWNLOAD] FAIL: URL too long')
             return jsonify({
                 'success': False,
                 'message': 'URL is too long',
             }), 400
 
         # Validate quality
-        print(f'[DOWNLOAD] Allowed qualities: {config.ALLOWED_QUALITIES}')
         if quality not in config.ALLOWED_QUALITIES:
-            print(f'[DOWNLOAD] FAIL: Invalid quality {quality}')
             return jsonify({
                 'success': False,
                 'message': f'Invalid quality. Allowed: {", ".join(config.ALLOWED_QUALITIES)}',
             }), 400
 
+        # Validate format
+        if output_format not in config.ALLOWED_FORMATS:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid format. Allowed: {", ".join(config.ALLOWED_FORMATS)}',
+            }), 400
+
         # Validate YouTube URL
-        url_valid = youtube_service.validate_url(url)
-        print(f'[DOWNLOAD] URL valid: {url_valid}')
-        if not url_valid:
-            print('[DOWNLOAD] FAIL: Invalid YouTube URL')
+        if not youtube_service.validate_url(url):
             return jsonify({
                 'success': False,
                 'message': 'Invalid YouTube URL',
             }), 400
 
+        # Optional clip range, in seconds or [[hh:]mm:]ss
+        try:
+            clip_start = parse_timestamp(data['start']) if data.get('start') not in (None, '') else None
+            clip_end = parse_timestamp(data['end']) if data.get('end') not in (None, '') else None
+        except ValueError as error:
+            return jsonify({
+                'success': False,
+                'message': str(error),
+            }), 400
+
+        normalize = data.get('normalize', config.NORMALIZE_DEFAULT)
+        if not isinstance(normalize, bool):
+            return jsonify({
+                'success': False,
+                'message': 'normalize must be true or false',
+            }), 400
+        if normalize and output_format == 'native':
+            return jsonify({
+                'success': False,
+                'message': 'Native format copies the original stream and cannot be normalized',
+            }), 400
+
+        if clip_start is not None and clip_end is not None and clip_end <= clip_start:
+            return jsonify({
+                'success': False,
+                'message': 'End time must be after start time',
+            }), 400
+
+        # Optional webhook, POSTed when the download completes or fails
+        callback_url = data.get('callback_url') or None
+        if callback_url is not None:
+            try:
+                validate_callback_url(callback_url)
+            except WebhookError as error:
+                return jsonify({
+                    'success': False,
+                    'message': error.message,
+                }), 400
+
         # Get video info
         try:
-            print('[DOWNLOAD] Fetching video info...')
             video_info = youtube_service.get_video_info(url)
-            print(f'[DOWNLOAD] Video info: {video_info}')
         except YouTubeDownloadError as error:
-            print(f'[DOWNLOAD] FAIL: Video info error: {error}')
+            logger.warning('Video info error: %s', error)
             return jsonify({
                 'success': False,
                 'message': str(error),
             }), 400
 
+        duration = video_info.get('duration') or 0
+        if duration and ((clip_start or 0) >= duration or (clip_end or 0) > duration):
+            return jsonify({
+                'success': False,
+                'message': f'Clip range is outside the video ({duration}s long)',
+            }), 400
+        if clip_start == 0 and clip_end is None:
+            clip_start = None
+
+        # Reject jobs whose output would exceed the file size limit
+        length = (clip_end or duration) - (clip_start or 0)
+        if estimated_size(length, output_format, quality) > config.MAX_FILE_SIZE:
+            output = 'native' if output_format == 'native' else f'{quality} kbps {output_format}'
+            return jsonify({
+                'success': False,
+                'message': f'Video too long: the {output} output would exceed '
+                           f'{config.MAX_FILE_SIZE // (1024 * 1024)}MB',
+            }), 400
+
         # Create download record
+        client_ip = request.remote_addr
         result = database.run_query(
-            'INSERT INTO downloads (youtube_url, title, quality, status) VALUES (?, ?, ?, "pending")',
-            [url, video_info['title'], quality]
+            '''INSERT INTO downloads (youtube_url, title, uploader, duration, thumbnail_source,
+                quality, format, client_ip, clip_start, clip_end, normalize, request_id, trace_id,
+                callback_url, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "pending")''',
+            [url, video_info['title'], video_info.get('uploader'), duration,
+             video_info.get('thumbnail'), quality, output_format, client_ip, clip_start, clip_end,
+             int(normalize), request_id_var.get(), trace.trace_id, callback_url]
         )
 
         download_id = result['id']
+        trace.download_id = download_id
 
-        # Start background processing
-        thread = threading.Thread(
-            target=process_download,
-            args=(download_id, url, quality),
-            daemon=True
-        )
-        thread.start()
+        # The pending row is the queued job; a worker (maybe in this process) claims it
+        worker.notify()
+
+        logger.info('Download queued', extra={'download_id': download_id})
 
         return jsonify({
             'success': True,
@@ -130,13 +186,115 @@ def create_download():
         }), 202
 
     except Exception as error:
-        print(f'Error creating download: {error}')
+        logger.exception('Error creating download: %s', error)
         return jsonify({
             'success': False,
             'message': f'Error creating download: {str(error)}',
         }), 500
 
 
+def status_payload(download, owner=None):
+    """Status fields of a downloads row, as the status endpoints return them."""
+    # Calculate progress percentage
+    progress = 0
+    if download.get('status') == 'pending':
+        progress = 0
+    elif download.get('status') == 'processing':
+        progress = 50
+    elif download.get('status') == 'completed':
+        progress = 100
+    elif download.get('status') in ('failed', 'cancelled'):
+        progress = 0
+
+    return {
+        'download_id': download.get('id'),
+        'title': download.get('title'),
+        'uploader': download.get('uploader'),
+        'duration': download.get('duration'),
+        'clip_start': download.get('clip_start'),
+        'clip_end': download.get('clip_end'),
+        'normalize': bool(download.get('normalize')),
+        'thumbnail_url': f'/api/download/{download.get("id")}/thumbnail' if download.get('thumbnail_path') else None,
+        'quality': download.get('quality'),
+        'format': download.get('format'),
+        'status': download.get('status'),
+        'worker': owner,
+        'progress_percentage': progress,
+        'error_message': download.get('error_message'),
+        'attempts': download.get('attempts'),
+        'file_size': download.get('file_size'),
+        'created_at': download.get('created_at'),
+        'completed_at': download.get('completed_at'),
+        'version': download.get('row_version'),
+    }
+
+
+@download_bp.route('/download/status', methods=['GET', 'POST'])
+def get_download_statuses():
+    """GET /api/download/status?ids=1,2,3 or POST {ids: [...]} - Status of many downloads at once.
+
+    With `since` (the `version` of an earlier response) only downloads that
+    changed after it are returned; requested ids that no longer exist are
+    listed in `missing`.
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            ids, since = data.get('ids'), data.get('since')
+        else:
+            ids = [value for value in request.args.get('ids', '').split(',') if value.strip()]
+            since = request.args.get('since')
+
+        try:
+            if not isinstance(ids, list):
+                raise ValueError
+            ids = list(dict.fromkeys(int(value) for value in ids))
+            since = int(since) if since not in (None, '') else None
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'message': 'ids must be a list of download ids and since an integer version',
+            }), 400
+
+        if not ids:
+            return jsonify({
+                'success': False,
+                'message': 'ids is required',
+            }), 400
+        if len(ids) > config.STATUS_BATCH_MAX:
+            return jsonify({
+                'success': False,
+                'message': f'At most {config.STATUS_BATCH_MAX} ids per request',
+            }), 400
+
+        # Read the version first: a change landing during the query then shows
+        # up again next time rather than being skipped
+        version, _ = database.get_table_version('downloads')
+        rows = database.all_query(
+            f'SELECT {STATUS_COLUMNS} FROM downloads WHERE id IN ({", ".join("?" * len(ids))})',
+            ids
+        )
+
+        found = {row['id'] for row in rows}
+        if since is not None:
+            rows = [row for row in rows if row['row_version'] > since]
+        owners = worker.lease_owners([row['id'] for row in rows if row['status'] in UNFINISHED_STATUSES])
+
+        return json_response({
+            'success': True,
+            'version': version,
+            'downloads': [status_payload(row, owners.get(row['id'])) for row in rows],
+            'missing': [download_id for download_id in ids if download_id not in found],
+        })
+
+    except Exception as error:
+        logger.exception('Error fetching download statuses: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error fetching download statuses: {str(error)}',
+        }), 500
+
+
 @download_bp.route('/download/<int:download_id>', methods=['GET'])
 def get_download_status(download_id):
     """GET /api/download/<id> - Get download status."""
@@ -152,35 +310,193 @@ def get_download_status(download_id):
                 'message': 'Download not found',
             }), 404
 
-        # Calculate progress percentage
-        progress = 0
-        if download.get('status') == 'pending':
-            progress = 0
-        elif download.get('status') == 'processing':
-            progress = 50
-        elif download.get('status') == 'completed':
-            progress = 100
-        elif download.get('status') == 'failed':
-            progress = 0
+        owner = worker.lease_owner(download_id) if download.get('status') in UNFINISHED_STATUSES else None
+        return jsonify({'success': True, **status_payload(download, owner)}), 200
+
+    except Exception as error:
+        logger.exception('Error fetching download status: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error fetching download status: {str(error)}',
+        }), 500
+
+
+@download_bp.route('/download/<int:download_id>/cancel', methods=['POST'])
+def cancel_download(download_id):
+    """POST /api/download/<id>/cancel - Stop a queued or running download."""
+    try:
+        download = database.get_query(
+            'SELECT id, status FROM downloads WHERE id = ?',
+            [download_id]
+        )
+
+        if not download:
+            return jsonify({
+                'success': False,
+                'message': 'Download not found',
+            }), 404
+
+        if download.get('status') not in ('pending', 'processing'):
+            return jsonify({
+                'success': False,
+                'message': f'Cannot cancel. Status: {download.get("status")}',
+            }), 409
+
+        # Only a row that is still queued or running; a job that finished in
+        # the meantime keeps its result
+        cancelled = database.run_query(
+            '''UPDATE downloads SET status = "cancelled", error_message = ?
+            WHERE id = ? AND status IN ("pending", "processing")''',
+            ['Download cancelled', download_id]
+        )
+        if not cancelled['changes']:
+            download = database.get_query('SELECT status FROM downloads WHERE id = ?', [download_id])
+            return jsonify({
+                'success': False,
+                'message': f'Cannot cancel. Status: {download.get("status")}' if download else 'Download not found',
+            }), 409 if download else 404
+
+        # Kills the job's process tree; the pipeline then removes partial files.
+        # A job leased by another process is stopped by its worker's next
+        # heartbeat, once it sees the status above.
+        if not pipeline.cancel(download_id) and worker.lease_owner(download_id) is None:
+            shutil.rmtree(pipeline.work_dir(download_id), ignore_errors=True)
 
         return jsonify({
             'success': True,
-            'download_id': download.get('id'),
-            'title': download.get('title'),
-            'quality': download.get('quality'),
-            'status': download.get('status'),
-            'progress_percentage': progress,
-            'error_message': download.get('error_message'),
-            'file_size': download.get('file_size'),
-            'created_at': download.get('created_at'),
-            'completed_at': download.get('completed_at'),
+            'download_id': download_id,
+            'status': 'cancelled',
+            'message': 'Download cancelled',
         }), 200
 
     except Exception as error:
-        print(f'Error fetching download status: {error}')
+        logger.exception('Error cancelling download: %s', error)
         return jsonify({
             'success': False,
-            'message': f'Error fetching download status: {str(error)}',
+            'message': f'Error cancelling download: {str(error)}',
+        }), 500
+
+
+@download_bp.route('/download/<int:download_id>/retry', methods=['POST'])
+def retry_download(download_id):
+    """POST /api/download/<id>/retry - Retry a failed or cancelled download, resuming partial data."""
+    try:
+        download = database.get_query(
+            'SELECT id, status FROM downloads WHERE id = ?',
+            [download_id]
+        )
+
+        if not download:
+            return jsonify({
+                'success': False,
+                'message': 'Download not found',
+            }), 404
+
+        if download.get('status') not in ('failed', 'cancelled'):
+            return jsonify({
+                'success': False,
+                'message': f'Only failed or cancelled downloads can be retried. Status: {download.get("status")}',
+            }), 409
+
+        work_dir = pipeline.work_dir(download_id)
+        source_file = youtube_service.find_source(work_dir)
+        if source_file:
+            resumable_bytes = os.path.getsize(source_file)
+        else:
+            resumable_bytes = youtube_service.partial_bytes(work_dir)
+
+        now = time.time()
+        with database.get_db_cursor() as cursor:
+            # Only from a failed or cancelled row; a concurrent retry (or
+            # pipeline write) since the check above wins. A live lease means
+            # a worker is still running the job (a cancel reaches another
+            # process at its next heartbeat): requeueing now would start a
+            # second run on the same work dir.
+            cursor.execute(
+                '''UPDATE downloads SET status = "pending", error_message = NULL, request_id = ?
+                WHERE id = ? AND status IN ("failed", "cancelled")
+                    AND NOT EXISTS (
+                        SELECT 1 FROM download_leases WHERE download_id = downloads.id AND expires_at >= ?
+                    )''',
+                [request_id_var.get(), download_id, now]
+            )
+            requeued = cursor.rowcount
+            if requeued:
+                cursor.execute(
+                    'DELETE FROM download_leases WHERE download_id = ? AND expires_at < ?', [download_id, now]
+                )
+        if not requeued:
+            if worker.lease_owner(download_id) is not None:
+                response = jsonify({
+                    'success': False,
+                    'message': 'Download is still stopping; try again in a few seconds',
+                })
+                response.status_code = 409
+                response.headers['Retry-After'] = str(max(1, round(config.WORKER_HEARTBEAT_INTERVAL)))
+                return response
+            return jsonify({
+                'success': False,
+                'message': 'Download changed while retrying; it is no longer failed or cancelled',
+            }), 409
+        worker.notify()
+
+        return jsonify({
+            'success': True,
+            'download_id': download_id,
+            'status': 'pending',
+            'resumable_bytes': resumable_bytes,
+            'message': 'Download requeued',
+        }), 202
+
+    except Exception as error:
+        logger.exception('Error retrying download: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error retrying download: {str(error)}',
+        }), 500
+
+
+@download_bp.route('/download/<int:download_id>/timeline', methods=['GET'])
+def get_download_timeline(download_id):
+    """GET /api/download/<id>/timeline - Get the timed stages of a download."""
+    try:
+        download = database.get_query(
+            'SELECT id FROM downloads WHERE id = ?',
+            [download_id]
+        )
+
+        if not download:
+            return jsonify({
+                'success': False,
+                'message': 'Download not found',
+            }), 404
+
+        spans = tracing.get_timeline(download_id)
+
+        if request.args.get('format') == 'otlp':
+            return jsonify(tracing.to_otlp(download_id, spans)), 200
+
+        origin = spans[0]['start_ns'] if spans else 0
+        return jsonify({
+            'success': True,
+            'download_id': download_id,
+            'trace_id': spans[0]['trace_id'] if spans else None,
+            'spans': [{
+                'name': span['name'],
+                'span_id': span['span_id'],
+                'parent_span_id': span['parent_span_id'],
+                'offset_ms': round((span['start_ns'] - origin) / 1e6, 3),
+                'duration_ms': round((span['end_ns'] - span['start_ns']) / 1e6, 3),
+                'status': span['status'],
+                'attributes': span['attributes'],
+            } for span in spans],
+        }), 200
+
+    except Exception as error:
+        logger.exception('Error fetching download timeline: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error fetching download timeline: {str(error)}',
         }), 500
 
 
@@ -214,27 +530,79 @@ def download_file(download_id):
             }), 404
 
         # Check if file exists
-        if not os.path.isfile(file_path):
+        storage = storage_for(file_path)
+        if not storage.exists(file_path):
             return jsonify({
                 'success': False,
                 'message': 'File not found',
             }), 404
 
-        # Send file
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=f'{download.get("title")}.mp3'
-        )
+        # Send file (or redirect to it, for object storage)
+        name = download.get('title')
+        clip_start, clip_end = download.get('clip_start'), download.get('clip_end')
+        if clip_start is not None or clip_end is not None:
+            end = display_timestamp(clip_end) if clip_end is not None else 'end'
+            name += f' [{display_timestamp(clip_start or 0)}-{end}]'
+        response = storage.send(file_path, f'{name}{os.path.splitext(file_path)[1]}')
+        return get_shaper().shape(response, request.remote_addr, download.get('file_size'))
 
     except Exception as error:
-        print(f'Error downloading file: {error}')
+        logger.exception('Error downloading file: %s', error)
         return jsonify({
             'success': False,
             'message': f'Error downloading file: {str(error)}',
         }), 500
 
 
+@download_bp.route('/download/<int:download_id>/thumbnail', methods=['GET'])
+def download_thumbnail(download_id):
+    """GET /api/download/<id>/thumbnail - Get the cached WebP thumbnail."""
+    try:
+        download = database.get_query(
+            'SELECT thumbnail_source, thumbnail_path FROM downloads WHERE id = ?',
+            [download_id]
+        )
+
+        if not download:
+            return jsonify({
+                'success': False,
+                'message': 'Download not found',
+            }), 404
+
+        thumbnail_path = download.get('thumbnail_path')
+        if thumbnail_path and not os.path.isfile(thumbnail_path):
+            # Cached on another replica's disk, or cleaned up since: fetch it again
+            thumbnail_path = get_pipeline().thumbnails.fetch(download.get('thumbnail_source'))
+            if thumbnail_path and thumbnail_path != download['thumbnail_path']:
+                database.run_query(
+                    'UPDATE downloads SET thumbnail_path = ? WHERE id = ?', [thumbnail_path, download_id]
+                )
+
+        if not thumbnail_path or not os.path.isfile(thumbnail_path):
+            return jsonify({
+                'success': False,
+                'message': 'Thumbnail not found',
+            }), 404
+
+        # A download's thumbnail never changes once cached
+        response = send_file(
+            thumbnail_path,
+            mimetype='image/webp',
+            max_age=config.THUMBNAIL_MAX_AGE,
+            conditional=True,
+        )
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    except Exception as error:
+        logger.exception('Error fetching thumbnail: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error fetching thumbnail: {str(error)}',
+        }), 500
+
+
 @download_bp.route('/download/<int:download_id>', methods=['DELETE'])
 def delete_download(download_id):
     """DELETE /api/download/<id> - Delete a download."""
@@ -250,13 +618,22 @@ def delete_download(download_id):
                 'message': 'Download not found',
             }), 404
 
-        # Delete file if exists
+        # Stop the job if it is still queued or running; a job leased by
+        # another process stops at its worker's next heartbeat
+        leased_elsewhere = not pipeline.cancel(download_id) and worker.lease_owner(download_id) is not None
+
+        # Delete file if exists and no other download shares it
         if download.get('file_path'):
             try:
-                if os.path.isfile(download['file_path']):
-                    os.unlink(download['file_path'])
+                if not database.file_shared(download['file_path'], download_id):
+                    storage_for(download['file_path']).delete(download['file_path'])
             except Exception as error:
-                print(f'Error deleting file: {error}')
+                logger.warning('Error deleting file: %s', error)
+
+        # Delete partial downloads kept for resuming (the owning worker does it
+        # when the job is still running elsewhere)
+        if not leased_elsewhere:
+            shutil.rmtree(pipeline.work_dir(download_id), ignore_errors=True)
 
         # Delete database record
         database.run_query(
@@ -270,7 +647,7 @@ def delete_download(download_id):
         }), 200
 
     except Exception as error:
-        print(f'Error deleting download: {error}')
+        logger.exception('Error deleting download: %s', error)
         return jsonify({
             'success': False,
             'message': f'Error deleting download: {str(error)}',
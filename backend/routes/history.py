@@ -1,65 +1,287 @@
+import math
+import re
 from flask import Blueprint, request, jsonify
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import database
+from logger import get_logger
+from responses import json_response, not_modified
 
 history_bp = Blueprint('history', __name__)
+logger = get_logger(__name__)
+
+# Local thumbnail endpoint, once the job has cached one
+THUMBNAIL_URL = "CASE WHEN thumbnail_path IS NOT NULL THEN '/api/download/' || id || '/thumbnail' END AS thumbnail_url"
+
+# Columns a history client may request with `fields=`
+HISTORY_FIELDS = {
+    'id': 'id',
+    'youtube_url': 'youtube_url',
+    'title': 'title',
+    'quality': 'quality',
+    'file_path': 'file_path',
+    'file_size': 'file_size',
+    'status': 'status',
+    'created_at': 'created_at',
+    'completed_at': 'completed_at',
+    'error_message': 'error_message',
+    'attempts': 'attempts',
+    'uploader': 'uploader',
+    'duration': 'duration',
+    'thumbnail_url': THUMBNAIL_URL,
+    'clip_start': 'clip_start',
+    'clip_end': 'clip_end',
+    'normalize': 'normalize',
+    'format': 'format',
+    'version': 'row_version AS version',
+}
+
+# What the history list shows; error messages are cut to what fits on a card
+DEFAULT_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'uploader': 'uploader',
+    'duration': 'duration',
+    'thumbnail_url': THUMBNAIL_URL,
+    'clip_start': 'clip_start',
+    'clip_end': 'clip_end',
+    'quality': 'quality',
+    'format': 'format',
+    'file_size': 'file_size',
+    'status': 'status',
+    'created_at': 'created_at',
+    'completed_at': 'completed_at',
+    'error_message': 'substr(error_message, 1, 200) AS error_message',
+    'version': 'row_version AS version',
+}
+
+
+def select_columns():
+    """Build the SELECT list from the `fields` query parameter."""
+    fields = request.args.get('fields')
+    if not fields:
+        return ', '.join(DEFAULT_FIELDS.values())
+
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in HISTORY_FIELDS]
+    if unknown or not names:
+        raise ValueError(f'Invalid fields. Allowed: {", ".join(HISTORY_FIELDS)}')
+    return ', '.join(HISTORY_FIELDS[name] for name in dict.fromkeys(names))
+
+
+# Search ranks at most this many of the newest matches, which keeps every
+# query on the index's fast path no matter how common its terms are
+SEARCH_MAX_RESULTS = 1000
+MAX_SEARCH_TERMS = 10
+
+# Relevance weight of a term found in each column
+SEARCH_WEIGHTS = {'title': 10, 'uploader': 5, 'youtube_url': 1}
+
+
+def match_expression(terms):
+    """FTS5 query matching rows that contain every term as a word prefix.
+
+    One-letter terms are matched whole; downloads_fts has no prefix index for
+    them and expanding one would touch most of the index.
+    """
+    return ' '.join(f'"{term}"*' if len(term) > 1 else f'"{term}"' for term in terms)
+
+
+def score_expression(terms):
+    """SQL expression (and params) scoring a row by which columns contain each term."""
+    parts, params = [], []
+    for term in terms:
+        for column, weight in SEARCH_WEIGHTS.items():
+            parts.append(f'(instr(lower(coalesce(downloads.{column}, \'\')), ?) > 0) * {weight}')
+            params.append(term)
+    return ' + '.join(parts), params
 
 
 @history_bp.route('/history', methods=['GET'])
 def get_history():
-    """GET /api/history - Get download history."""
+    """GET /api/history - Get download history, newest first.
+
+    Pages with `limit` and `offset`, or with `before_id` (the last id of the
+    previous page), which stays fast however deep the page and doesn't
+    shift when new downloads arrive. With `updated_since` (the `version` of
+    an earlier response), returns only rows added or changed since, oldest
+    change first; `more` says another call with the new `version` has the
+    rest. Deleted rows are not reported.
+    """
     try:
+        version, last_modified = database.get_table_version('downloads')
+        cached = not_modified(version, last_modified)
+        if cached is not None:
+            return cached
+
         status = request.args.get('status')
-        limit = min(int(request.args.get('limit', 50)), 100)
-        offset = int(request.args.get('offset', 0))
+        try:
+            limit = min(int(request.args.get('limit', 50)), 100)
+            offset = int(request.args.get('offset', 0))
+            before_id = request.args.get('before_id', type=int)
+            updated_since = request.args.get('updated_since')
+            updated_since = int(updated_since) if updated_since not in (None, '') else None
+            columns = select_columns()
+        except ValueError as error:
+            return jsonify({
+                'success': False,
+                'message': str(error),
+            }), 400
 
         # Build query
-        query = 'SELECT * FROM downloads'
+        where = ''
         params = []
 
         # Filter by status if provided
         if status:
-            allowed_statuses = ['pending', 'processing', 'completed', 'failed']
+            allowed_statuses = ['pending', 'processing', 'completed', 'failed', 'cancelled']
             if status not in allowed_statuses:
                 return jsonify({
                     'success': False,
                     'message': f'Invalid status. Allowed: {", ".join(allowed_statuses)}',
                 }), 400
 
-            query += ' WHERE status = ?'
+            where = ' WHERE status = ?'
             params.append(status)
 
         # Get total count
-        count_query = query.replace('SELECT *', 'SELECT COUNT(*) as count')
-        count_result = database.all_query(count_query, params)
+        count_result = database.all_query(f'SELECT COUNT(*) as count FROM downloads{where}', params)
         total = count_result[0].get('count', 0) if count_result else 0
 
-        # Get paginated results
-        query += ' ORDER BY created_at DESC LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-
-        downloads = database.all_query(query, params)
+        if updated_since is not None:
+            # Changes in the order they happened, so a client can resume from the last one
+            changed_where = f'{where} AND row_version > ?' if where else ' WHERE row_version > ?'
+            if 'row_version AS version' not in columns:
+                columns += ', row_version AS version'
+            downloads = database.all_query(
+                f'SELECT {columns} FROM downloads{changed_where} ORDER BY row_version LIMIT ?',
+                params + [updated_since, limit],
+            )
+            more = len(downloads) == limit
+            return json_response({
+                'success': True,
+                'data': downloads,
+                'total': total,
+                'limit': limit,
+                'version': downloads[-1]['version'] if more else version,
+                'more': more,
+            }, version=version, last_modified=last_modified)
+
+        # Get paginated results; ids grow with creation time
+        if before_id is not None:
+            where = f'{where} AND id < ?' if where else ' WHERE id < ?'
+            params.append(before_id)
+            offset = 0
+        downloads = database.all_query(
+            f'SELECT {columns} FROM downloads{where} ORDER BY id DESC LIMIT ? OFFSET ?',
+            params + [limit, offset],
+        )
 
-        return jsonify({
+        return json_response({
             'success': True,
             'data': downloads,
             'total': total,
             'limit': limit,
             'offset': offset,
-        }), 200
+            'version': version,
+        }, version=version, last_modified=last_modified)
 
     except Exception as error:
-        print(f'Error fetching history: {error}')
+        logger.exception('Error fetching history: %s', error)
         return jsonify({
             'success': False,
             'message': f'Error fetching history: {str(error)}',
         }), 500
 
 
+@history_bp.route('/history/search', methods=['GET'])
+def search_history():
+    """GET /api/history/search?q= - Search history by title, uploader or URL."""
+    try:
+        terms = re.findall(r'\w+', request.args.get('q', '').lower())[:MAX_SEARCH_TERMS]
+        if not terms:
+            return jsonify({
+                'success': False,
+                'message': 'Search query is required',
+            }), 400
+
+        version, last_modified = database.get_table_version('downloads')
+        cached = not_modified(version, last_modified)
+        if cached is not None:
+            return cached
+
+        limit = min(int(request.args.get('limit', 50)), 100)
+        offset = int(request.args.get('offset', 0))
+
+        try:
+            columns = select_columns()
+        except ValueError as error:
+            return jsonify({
+                'success': False,
+                'message': str(error),
+            }), 400
+
+        if database.fts_enabled:
+            match = match_expression(terms)
+            count_result = database.all_query(
+                'SELECT COUNT(*) as count FROM (SELECT 1 FROM downloads_fts WHERE downloads_fts MATCH ? LIMIT ?)',
+                [match, SEARCH_MAX_RESULTS + 1],
+            )
+            score, score_params = score_expression(terms)
+            downloads = database.all_query(
+                f'''WITH matches AS (
+                        SELECT rowid AS match_id FROM downloads_fts
+                        WHERE downloads_fts MATCH ?
+                        ORDER BY rowid DESC LIMIT ?
+                    )
+                    SELECT {columns} FROM matches
+                    JOIN downloads ON downloads.id = matches.match_id
+                    ORDER BY {score} DESC, length(downloads.title), downloads.id DESC
+                    LIMIT ? OFFSET ?''',
+                [match, SEARCH_MAX_RESULTS] + score_params + [limit, offset],
+            )
+        else:
+            # No FTS5 in this SQLite build: scan instead, newest first
+            where = ' AND '.join(
+                '(title LIKE ? OR uploader LIKE ? OR youtube_url LIKE ?)' for _ in terms
+            )
+            params = [f'%{term}%' for term in terms for _ in range(3)]
+            count_result = database.all_query(
+                f'SELECT COUNT(*) as count FROM (SELECT 1 FROM downloads WHERE {where} LIMIT ?)',
+                params + [SEARCH_MAX_RESULTS + 1],
+            )
+            downloads = database.all_query(
+                f'SELECT {columns} FROM downloads WHERE {where} ORDER BY id DESC LIMIT ? OFFSET ?',
+                params + [limit, min(offset, SEARCH_MAX_RESULTS)],
+            )
+
+        total = count_result[0].get('count', 0) if count_result else 0
+
+        return json_response({
+            'success': True,
+            'data': downloads,
+            'total': min(total, SEARCH_MAX_RESULTS),
+            'truncated': total > SEARCH_MAX_RESULTS,
+            'limit': limit,
+            'offset': offset,
+        }, version=version, last_modified=last_modified)
+
+    except Exception as error:
+        logger.exception('Error searching history: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error searching history: {str(error)}',
+        }), 500
+
+
 @history_bp.route('/history/stats', methods=['GET'])
 def get_stats():
     """GET /api/history/stats - Get statistics."""
     try:
+        version, last_modified = database.get_table_version('downloads')
+        cached = not_modified(version, last_modified)
+        if cached is not None:
+            return cached
+
         stats = {}
 
         # Total downloads
@@ -96,34 +318,222 @@ def get_stats():
         )
         stats['total_data_processed'] = size_result[0].get('total_size', 0) if size_result else 0
 
-        return jsonify({
+        return json_response({
             'success': True,
             'stats': stats,
-        }), 200
+        }, version=version, last_modified=last_modified)
 
     except Exception as error:
-        print(f'Error fetching stats: {error}')
+        logger.exception('Error fetching stats: %s', error)
         return jsonify({
             'success': False,
             'message': f'Error fetching stats: {str(error)}',
         }), 500
 
 
+# Default range per bucket size, and the most buckets one request may span
+TIMESERIES_DEFAULT_RANGE = {'hour': timedelta(hours=24), 'day': timedelta(days=30)}
+TIMESERIES_BUCKET_SIZE = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+TIMESERIES_MAX_BUCKETS = 2000
+TOP_VIDEOS_DEFAULT = 10
+TOP_VIDEOS_MAX = 100
+
+
+def parse_time(value, name):
+    """ISO 8601 date or datetime as naive UTC; naive input is taken as UTC."""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name}: expected an ISO 8601 date or datetime')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def bucket_floor(moment, bucket):
+    """Start of the bucket containing `moment`."""
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if bucket == 'day' else moment
+
+
+def histogram_quantile(buckets, quantile):
+    """Estimate a quantile of job duration from (upper bound, count) buckets sorted by bound.
+
+    Empty buckets are not stored, so lower bounds come from
+    ROLLUP_DURATION_BOUNDS. Interpolates linearly inside the bucket the
+    quantile falls in; in the open last bucket the estimate is its lower bound.
+    """
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+    rank = quantile * total
+    seen = 0
+    for upper, count in buckets:
+        if seen + count >= rank:
+            lower = max((bound for bound in database.ROLLUP_DURATION_BOUNDS if bound < upper), default=0)
+            if math.isinf(upper):
+                return float(lower)
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return None
+
+
+def duration_stats(duration_sum, completed, buckets):
+    if not completed:
+        return {'mean': None, 'p95': None}
+    p95 = histogram_quantile(buckets, 0.95)
+    return {
+        'mean': round(duration_sum / completed, 1),
+        'p95': round(p95, 1) if p95 is not None else None,
+    }
+
+
+@history_bp.route('/history/stats/timeseries', methods=['GET'])
+def get_stats_timeseries():
+    """GET /api/history/stats/timeseries?from=&to=&bucket=hour|day - Finished jobs over time.
+
+    Served from the rollup tables only, so it stays cheap and covers
+    downloads cleanup has since deleted (hourly buckets are kept for
+    ROLLUP_HOURLY_RETENTION_DAYS, daily ones indefinitely). Buckets without
+    finished jobs are left out. Times are UTC.
+    """
+    try:
+        version, last_modified = database.get_table_version('downloads')
+        cached = not_modified(version, last_modified)
+        if cached is not None:
+            return cached
+
+        bucket = request.args.get('bucket', 'hour')
+        if bucket not in TIMESERIES_BUCKET_SIZE:
+            return jsonify({
+                'success': False,
+                'message': f'Invalid bucket. Allowed: {", ".join(TIMESERIES_BUCKET_SIZE)}',
+            }), 400
+
+        top = request.args.get('top', TOP_VIDEOS_DEFAULT, type=int)
+        try:
+            end = parse_time(request.args['to'], 'to') if request.args.get('to') else datetime.now(timezone.utc).replace(tzinfo=None)
+            start = (parse_time(request.args['from'], 'from') if request.args.get('from')
+                     else end - TIMESERIES_DEFAULT_RANGE[bucket])
+        except ValueError as error:
+            return jsonify({
+                'success': False,
+                'message': str(error),
+            }), 400
+
+        start = bucket_floor(start, bucket)
+        if start >= end:
+            return jsonify({
+                'success': False,
+                'message': '`from` must be before `to`',
+            }), 400
+        if (end - start) / TIMESERIES_BUCKET_SIZE[bucket] > TIMESERIES_MAX_BUCKETS:
+            return jsonify({
+                'success': False,
+                'message': f'Range too large: at most {TIMESERIES_MAX_BUCKETS} {bucket} buckets',
+            }), 400
+        top = max(0, min(top, TOP_VIDEOS_MAX))
+
+        params = [bucket, start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')]
+        in_range = 'granularity = ? AND bucket_start >= ? AND bucket_start < ?'
+
+        series = {}
+        totals = {'jobs': {}, 'bytes': 0, 'duration_sum': 0.0, 'histogram': {}}
+
+        def point(bucket_start):
+            if bucket_start not in series:
+                series[bucket_start] = {'bucket_start': bucket_start, 'jobs': {}, 'bytes': 0,
+                                        'duration_sum': 0.0, 'histogram': []}
+            return series[bucket_start]
+
+        for row in database.all_query(
+            f'SELECT bucket_start, status, jobs, bytes, duration_sum FROM download_rollups WHERE {in_range}',
+            params
+        ):
+            entry = point(row['bucket_start'])
+            entry['jobs'][row['status']] = row['jobs']
+            entry['bytes'] += row['bytes']
+            entry['duration_sum'] += row['duration_sum']
+            totals['jobs'][row['status']] = totals['jobs'].get(row['status'], 0) + row['jobs']
+            totals['bytes'] += row['bytes']
+            totals['duration_sum'] += row['duration_sum']
+
+        for row in database.all_query(
+            f'SELECT bucket_start, le, jobs FROM download_rollup_durations WHERE {in_range} ORDER BY le',
+            params
+        ):
+            point(row['bucket_start'])['histogram'].append((row['le'], row['jobs']))
+            totals['histogram'][row['le']] = totals['histogram'].get(row['le'], 0) + row['jobs']
+
+        points = []
+        for bucket_start in sorted(series):
+            entry = series[bucket_start]
+            points.append({
+                'bucket_start': bucket_start,
+                'jobs': entry['jobs'],
+                'bytes': entry['bytes'],
+                'duration': duration_stats(entry['duration_sum'], entry['jobs'].get('completed', 0),
+                                           entry['histogram']),
+            })
+
+        top_videos = database.all_query(
+            f'''SELECT youtube_url, MAX(title) AS title, SUM(jobs) AS jobs, SUM(bytes) AS bytes
+            FROM download_rollup_videos WHERE {in_range}
+            GROUP BY youtube_url ORDER BY jobs DESC, bytes DESC LIMIT ?''',
+            params + [top]
+        ) if top else []
+
+        return json_response({
+            'success': True,
+            'bucket': bucket,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'series': points,
+            'totals': {
+                'jobs': totals['jobs'],
+                'bytes': totals['bytes'],
+                'duration': duration_stats(totals['duration_sum'], totals['jobs'].get('completed', 0),
+                                           sorted(totals['histogram'].items())),
+            },
+            'top_videos': top_videos,
+        }, version=version, last_modified=last_modified)
+
+    except Exception as error:
+        logger.exception('Error fetching stats timeseries: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error fetching stats timeseries: {str(error)}',
+        }), 500
+
+
 @history_bp.route('/history/recent', methods=['GET'])
 def get_recent():
     """GET /api/history/recent - Get recent downloads."""
     try:
+        version, last_modified = database.get_table_version('downloads')
+        cached = not_modified(version, last_modified)
+        if cached is not None:
+            return cached
+
+        try:
+            columns = select_columns()
+        except ValueError as error:
+            return jsonify({
+                'success': False,
+                'message': str(error),
+            }), 400
+
         downloads = database.all_query(
-            'SELECT * FROM downloads WHERE status = "completed" ORDER BY completed_at DESC LIMIT 10'
+            f'SELECT {columns} FROM downloads WHERE status = "completed" ORDER BY completed_at DESC LIMIT 10'
         )
 
-        return jsonify({
+        return json_response({
             'success': True,
             'data': downloads,
-        }), 200
+        }, version=version, last_modified=last_modified)
 
     except Exception as error:
-        print(f'Error fetching recent downloads: {error}')
+        logger.exception('Error fetching recent downloads: %s', error)
         return jsonify({
             'success': False,
             'message': f'Error fetching recent downloads: {str(error)}',
@@ -153,7 +563,7 @@ def clear_history():
         }), 200
 
     except Exception as error:
-        print(f'Error clearing history: {error}')
+        logger.exception('Error clearing history: %s', error)
         return jsonify({
             'success': False,
             'message': f'Error clearing history: {str(error)}',
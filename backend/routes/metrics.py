@@ -0,0 +1,23 @@
+from flask import Blueprint, jsonify
+import metrics
+from logger import get_logger
+
+metrics_bp = Blueprint('metrics', __name__)
+logger = get_logger(__name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """GET /api/metrics - Get counters and worker pool state."""
+    try:
+        return jsonify({
+            'success': True,
+            'metrics': metrics.snapshot(),
+        }), 200
+
+    except Exception as error:
+        logger.exception('Error fetching metrics: %s', error)
+        return jsonify({
+            'success': False,
+            'message': f'Error fetching metrics: {str(error)}',
+        }), 500
@@ -1,9 +1,14 @@
 import os
+import shutil
 import time
 from pathlib import Path
 from datetime import datetime, timedelta
 import database
 import config
+from logger import get_logger
+from services.storage import LocalStorage, get_storage, storage_for
+
+logger = get_logger(__name__)
 
 
 class CleanupService:
@@ -18,36 +23,58 @@ class CleanupService:
         self.upload_folder = upload_folder
         self.cleanup_days = cleanup_days
 
+    def stores(self):
+        """Stores to sweep: the upload folder (scratch files, local artifacts) and the artifact store."""
+        stores = [LocalStorage(self.upload_folder)]
+        if get_storage().name != 'local':
+            stores.append(get_storage())
+        return stores
+
     def cleanup_old_files(self):
         """Delete old files and database records."""
         stats = {
             'filesDeleted': 0,
+            'workDirsDeleted': 0,
+            'thumbnailsDeleted': 0,
             'dbRecordsDeleted': 0,
+            'rollupsDeleted': 0,
+            'webhooksDeleted': 0,
             'errors': 0,
         }
 
         try:
             cutoff_time = time.time() - (self.cleanup_days * 24 * 60 * 60)
 
-            # Delete old files from filesystem
-            try:
-                if os.path.isdir(self.upload_folder):
-                    files = os.listdir(self.upload_folder)
+            # Delete old files from the upload folder and artifact storage
+            for store in self.stores():
+                try:
+                    for ref, size in store.stale(cutoff_time):
+                        try:
+                            if store.delete(ref):
+                                stats['filesDeleted'] += 1
+                        except Exception as e:
+                            logger.warning('Error processing file %s: %s', ref, e)
+                            stats['errors'] += 1
+                except Exception as e:
+                    logger.error('Error reading %s storage: %s', store.name, e)
+                    stats['errors'] += 1
 
-                    for filename in files:
-                        file_path = os.path.join(self.upload_folder, filename)
+            # Delete abandoned work dirs (partial downloads kept for resuming)
+            work_folder = os.path.join(self.upload_folder, 'work')
+            try:
+                if os.path.isdir(work_folder):
+                    for dirname in os.listdir(work_folder):
+                        dir_path = os.path.join(work_folder, dirname)
 
                         try:
-                            if os.path.isfile(file_path):
-                                stat = os.stat(file_path)
-                                if stat.st_mtime < cutoff_time:
-                                    os.unlink(file_path)
-                                    stats['filesDeleted'] += 1
+                            if os.stat(dir_path).st_mtime < cutoff_time:
+                                shutil.rmtree(dir_path)
+                                stats['workDirsDeleted'] += 1
                         except Exception as e:
-                            print(f'Error processing file {file_path}: {e}')
+                            logger.warning('Error processing work dir %s: %s', dir_path, e)
                             stats['errors'] += 1
             except Exception as e:
-                print(f'Error reading upload folder: {e}')
+                logger.error('Error reading work folder: %s', e)
                 stats['errors'] += 1
 
             # Delete old database records
@@ -64,11 +91,11 @@ class CleanupService:
                 for record in old_records:
                     if record.get('file_path'):
                         try:
-                            if os.path.isfile(record['file_path']):
-                                os.unlink(record['file_path'])
+                            if (not database.file_shared(record['file_path'], record['id'])
+                                    and storage_for(record['file_path']).delete(record['file_path'])):
                                 stats['filesDeleted'] += 1
                         except Exception as e:
-                            print(f'Error deleting file {record["file_path"]}: {e}')
+                            logger.warning('Error deleting file %s: %s', record['file_path'], e)
                             stats['errors'] += 1
 
                 # Delete database records
@@ -80,11 +107,54 @@ class CleanupService:
                     stats['dbRecordsDeleted'] = len(old_records)
 
             except Exception as e:
-                print(f'Error cleaning database: {e}')
+                logger.error('Error cleaning database: %s', e)
+                stats['errors'] += 1
+
+            # Prune hourly rollups; the daily ones keep the long-term history
+            try:
+                stats['rollupsDeleted'] = database.prune_rollups('hour', config.ROLLUP_HOURLY_RETENTION_DAYS)
+            except Exception as e:
+                logger.error('Error pruning rollups: %s', e)
+                stats['errors'] += 1
+
+            # Delivered webhooks are only kept as a recent log
+            try:
+                result = database.run_query(
+                    '''DELETE FROM webhook_deliveries WHERE status = 'delivered'
+                    AND delivered_at < datetime('now', ?)''',
+                    [f'-{int(self.cleanup_days)} days']
+                )
+                stats['webhooksDeleted'] = result['changes']
+            except Exception as e:
+                logger.error('Error pruning webhook deliveries: %s', e)
+                stats['errors'] += 1
+
+            # Delete cached thumbnails no remaining download refers to
+            thumbnail_folder = os.path.join(self.upload_folder, 'thumbnails')
+            try:
+                if os.path.isdir(thumbnail_folder):
+                    referenced = {
+                        os.path.basename(row['thumbnail_path'])
+                        for row in database.all_query(
+                            'SELECT DISTINCT thumbnail_path FROM downloads WHERE thumbnail_path IS NOT NULL'
+                        )
+                    }
+                    for filename in os.listdir(thumbnail_folder):
+                        file_path = os.path.join(thumbnail_folder, filename)
+
+                        try:
+                            if filename not in referenced and os.stat(file_path).st_mtime < cutoff_time:
+                                os.unlink(file_path)
+                                stats['thumbnailsDeleted'] += 1
+                        except Exception as e:
+                            logger.warning('Error processing thumbnail %s: %s', file_path, e)
+                            stats['errors'] += 1
+            except Exception as e:
+                logger.error('Error reading thumbnail folder: %s', e)
                 stats['errors'] += 1
 
         except Exception as e:
-            print(f'Error in cleanup_old_files: {e}')
+            logger.error('Error in cleanup_old_files: %s', e)
             stats['errors'] += 1
 
         return stats
@@ -105,11 +175,11 @@ class CleanupService:
             for record in failed_records:
                 if record.get('file_path'):
                     try:
-                        if os.path.isfile(record['file_path']):
-                            os.unlink(record['file_path'])
+                        if (not database.file_shared(record['file_path'], record['id'])
+                                and storage_for(record['file_path']).delete(record['file_path'])):
                             stats['filesDeleted'] += 1
                     except Exception as e:
-                        print(f'Error deleting file {record["file_path"]}: {e}')
+                        logger.warning('Error deleting file %s: %s', record['file_path'], e)
                         stats['errors'] += 1
 
                 # Delete failed records after 24 hours
@@ -121,11 +191,11 @@ class CleanupService:
                         database.run_query('DELETE FROM downloads WHERE id = ?', [record['id']])
                         stats['dbRecordsDeleted'] += 1
                     except Exception as e:
-                        print(f'Error deleting record {record["id"]}: {e}')
+                        logger.warning('Error deleting record %s: %s', record['id'], e)
                         stats['errors'] += 1
 
         except Exception as e:
-            print(f'Error in cleanup_failed_downloads: {e}')
+            logger.error('Error in cleanup_failed_downloads: %s', e)
             stats['errors'] += 1
 
         return stats
@@ -142,23 +212,13 @@ class CleanupService:
             cutoff_time = time.time() - (self.cleanup_days * 24 * 60 * 60)
 
             # Count old files
-            try:
-                if os.path.isdir(self.upload_folder):
-                    files = os.listdir(self.upload_folder)
-
-                    for filename in files:
-                        file_path = os.path.join(self.upload_folder, filename)
-
-                        try:
-                            if os.path.isfile(file_path):
-                                stat = os.stat(file_path)
-                                if stat.st_mtime < cutoff_time:
-                                    status['oldFilesCount'] += 1
-                                    status['oldFilesSize'] += stat.st_size
-                        except Exception:
-                            pass
-            except Exception:
-                pass
+            for store in self.stores():
+                try:
+                    for ref, size in store.stale(cutoff_time):
+                        status['oldFilesCount'] += 1
+                        status['oldFilesSize'] += size
+                except Exception:
+                    pass
 
             # Count failed records
             failed_result = database.all_query(
@@ -167,6 +227,6 @@ class CleanupService:
             status['failedRecordsCount'] = failed_result[0].get('count', 0) if failed_result else 0
 
         except Exception as e:
-            print(f'Error in get_cleanup_status: {e}')
+            logger.error('Error in get_cleanup_status: %s', e)
 
         return status
@@ -1,6 +1,13 @@
+import json
 import subprocess
 import os
+import re
 import config
+from logger import get_logger
+import tracing
+from services.jobs import JobCancelled, run_process
+
+logger = get_logger(__name__)
 
 
 class ConversionError(Exception):
@@ -11,7 +18,7 @@ class ConversionError(Exception):
 
 
 class AudioConverter:
-    """Service for converting audio to MP3 format."""
+    """Service for converting audio to MP3 and other formats."""
 
     QUALITY_BITRATE_MAP = {
         '128': '128k',
@@ -20,6 +27,29 @@ class AudioConverter:
         '320': '320k',
     }
 
+    # Encoded output formats: encoder, file extension and extra encoder options
+    FORMATS = {
+        'mp3': {'codec': 'libmp3lame', 'extension': 'mp3', 'options': ['-ar', '44100', '-q:a', '0']},
+        'm4a': {'codec': 'aac', 'extension': 'm4a', 'options': ['-ar', '44100', '-movflags', '+faststart']},
+        'opus': {'codec': 'libopus', 'extension': 'opus', 'options': ['-ar', '48000']},
+        'ogg': {'codec': 'libvorbis', 'extension': 'ogg', 'options': ['-ar', '44100']},
+    }
+
+    # Container for a remuxed ('native') stream, by the extension yt-dlp gave
+    # the source; YouTube's WebM audio is Opus, which belongs in an Ogg .opus
+    NATIVE_EXTENSIONS = {
+        'webm': 'opus',
+        'opus': 'opus',
+        'ogg': 'ogg',
+        'm4a': 'm4a',
+        'mp4': 'm4a',
+        'aac': 'm4a',
+        'mp3': 'mp3',
+    }
+
+    # Containers that can carry embedded cover art
+    COVER_EXTENSIONS = ('mp3', 'm4a')
+
     @staticmethod
     def check_ffmpeg():
         """Check if FFmpeg is available."""
@@ -30,43 +60,130 @@ class AudioConverter:
             return False
 
     @staticmethod
-    def convert_to_mp3(input_file, output_file, quality='192', title=''):
-        """Convert audio to MP3 format using FFmpeg."""
+    def loudnorm_filter(measured=None):
+        """EBU R128 loudnorm filter; with `measured` (from measure_loudness) it runs linear, in one pass."""
+        target = f'I={config.LOUDNORM_TARGET_I}:TP={config.LOUDNORM_TARGET_TP}:LRA={config.LOUDNORM_TARGET_LRA}'
+        if not measured:
+            return f'loudnorm={target}'
+        return (
+            f'loudnorm={target}'
+            f':measured_I={measured["input_i"]}:measured_TP={measured["input_tp"]}'
+            f':measured_LRA={measured["input_lra"]}:measured_thresh={measured["input_thresh"]}'
+            f':offset={measured["target_offset"]}:linear=true'
+        )
+
+    @staticmethod
+    def measure_loudness(input_file):
+        """First loudnorm pass: decode only, returning the measured loudness values."""
+        cmd = [
+            'ffmpeg', '-hide_banner', '-nostats',
+            '-i', input_file,
+            '-af', AudioConverter.loudnorm_filter() + ':print_format=json',
+            '-f', 'null', '-',
+        ]
+
+        try:
+            with tracing.span('loudness_analysis'):
+                result = run_process(cmd, timeout=config.FFMPEG_TIMEOUT)
+
+            if result.returncode != 0:
+                raise ConversionError(f'FFmpeg loudness analysis error: {result.stderr}')
+
+            # loudnorm prints its JSON block last on stderr
+            match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', result.stderr)
+            if not match:
+                raise ConversionError('FFmpeg loudness analysis produced no measurements')
+            measured = json.loads(match.group(0))
+            return {key: measured[key] for key in
+                    ('input_i', 'input_tp', 'input_lra', 'input_thresh', 'target_offset')}
+
+        except (ConversionError, JobCancelled):
+            raise
+        except subprocess.TimeoutExpired:
+            raise ConversionError(f'FFmpeg loudness analysis timed out after {config.FFMPEG_TIMEOUT} seconds')
+        except Exception as e:
+            raise ConversionError(f'Loudness analysis error: {str(e)}')
+
+    @staticmethod
+    def output_extension(output_format, input_file):
+        """File extension of the output for a format; 'native' keeps the source's codec."""
+        if output_format != 'native':
+            return AudioConverter.FORMATS[output_format]['extension']
+        source_extension = os.path.splitext(input_file)[1].lstrip('.').lower()
+        return AudioConverter.NATIVE_EXTENSIONS.get(source_extension, 'mka')
+
+    @staticmethod
+    def convert(input_file, output_file, output_format='mp3', quality='192', title='',
+                tags=None, cover_file=None, loudness=None):
+        """Encode (or, for 'native', remux) audio into `output_format` using FFmpeg.
+
+        Optional `tags` (e.g. artist), embedded `cover_file` artwork (MP3 and
+        M4A only) and loudness normalization (`loudness` measurements from
+        measure_loudness) are applied in the same ffmpeg run as the encode.
+        Native output copies the stream, so it cannot be normalized.
+        """
+        if output_format not in AudioConverter.FORMATS and output_format != 'native':
+            raise ConversionError(f'Invalid format: {output_format}')
         if quality not in AudioConverter.QUALITY_BITRATE_MAP:
             raise ConversionError(f'Invalid quality: {quality}')
+        if output_format == 'native' and loudness:
+            raise ConversionError('Native output cannot be normalized')
 
         bitrate = AudioConverter.QUALITY_BITRATE_MAP[quality]
+        extension = os.path.splitext(output_file)[1].lstrip('.').lower()
+        has_cover = (bool(cover_file) and os.path.isfile(cover_file)
+                     and extension in AudioConverter.COVER_EXTENSIONS)
 
         # Build ffmpeg command
-        cmd = [
-            'ffmpeg',
-            '-i', input_file,
-            '-codec:a', 'libmp3lame',
-            '-b:a', bitrate,
-            '-ac', '2',
-            '-ar', '44100',
-            '-q:a', '0',
-        ]
+        cmd = ['ffmpeg', '-i', input_file]
+        if has_cover:
+            cmd.extend(['-i', cover_file, '-map', '0:a:0', '-map', '1:v:0'])
+        else:
+            cmd.extend(['-map', '0:a:0'])
+
+        if output_format == 'native':
+            codec = 'copy'
+            cmd.extend(['-codec:a', 'copy'])
+        else:
+            codec = AudioConverter.FORMATS[output_format]['codec']
+            if loudness:
+                cmd.extend(['-af', AudioConverter.loudnorm_filter(loudness)])
+            cmd.extend(['-codec:a', codec, '-b:a', bitrate, '-ac', '2'])
+            cmd.extend(AudioConverter.FORMATS[output_format]['options'])
+
+        if has_cover:
+            # Cover frames are widely supported only as JPEG/PNG
+            cmd.extend([
+                '-codec:v', 'mjpeg',
+                '-disposition:v', 'attached_pic',
+                '-metadata:s:v', 'title=Album cover',
+                '-metadata:s:v', 'comment=Cover (front)',
+            ])
 
         # Add metadata if title is provided
         if title:
             cmd.extend(['-metadata', f'title={title}'])
+        for key, value in (tags or {}).items():
+            if value:
+                cmd.extend(['-metadata', f'{key}={value}'])
+        if extension == 'mp3':
+            cmd.extend(['-id3v2_version', '3'])
 
         cmd.extend(['-y', output_file])  # -y to overwrite output file
 
         try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=config.FFMPEG_TIMEOUT
-            )
+            with tracing.span('encode', codec=codec, format=output_format,
+                              bitrate=None if codec == 'copy' else bitrate,
+                              normalized=bool(loudness), cover=has_cover):
+                result = run_process(cmd, timeout=config.FFMPEG_TIMEOUT)
 
             if result.returncode != 0:
                 raise ConversionError(f'FFmpeg error: {result.stderr}')
 
             return output_file
 
+        except (ConversionError, JobCancelled):
+            raise
         except subprocess.TimeoutExpired:
             raise ConversionError(f'FFmpeg conversion timed out after {config.FFMPEG_TIMEOUT} seconds')
         except Exception as e:
@@ -81,5 +198,5 @@ class AudioConverter:
                 return True
             return False
         except Exception as e:
-            print(f'Error deleting file {file_path}: {e}')
+            logger.warning('Error deleting file %s: %s', file_path, e)
             return False
@@ -0,0 +1,237 @@
+import threading
+import time
+from flask import jsonify
+import config
+import metrics
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_shaper = None
+_shaper_lock = threading.Lock()
+
+# How long before an over-limit client should try again, in seconds
+TRANSFER_RETRY_AFTER = 5
+# Idle per-client buckets are forgotten after this many seconds
+CLIENT_IDLE_SECONDS = 300
+
+
+def _full_size(response):
+    """Size of the whole file behind a 200 or 206 response, if it says."""
+    if response.status_code == 206:
+        # Content-Range: bytes <first>-<last>/<total>
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    return response.content_length
+
+
+class TokenBucket:
+    """Byte budget refilled at `rate` per second, holding at most `burst`.
+
+    take() never blocks: it books the bytes and returns how long the caller
+    should wait before sending them. The balance may go negative, so later
+    callers queue up behind earlier ones in arrival order.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount, priority=False):
+        """Book `amount` bytes; returns seconds to wait (always 0 with `priority`)."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            if priority or self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def idle(self):
+        """Full again and unused for a while."""
+        return time.monotonic() - self.updated > max(CLIENT_IDLE_SECONDS, self.burst / self.rate)
+
+
+class ShapedBody:
+    """Response body that paces an inner iterable through the shaper's buckets.
+
+    Wraps what werkzeug built for the request (a whole file or the byte
+    range asked for), so Range/If-Range handling is unchanged. close()
+    releases the client's transfer slot even if the body was never read.
+    """
+
+    def __init__(self, shaper, body, client_ip, small):
+        self.shaper = shaper
+        self.body = body
+        self.client_ip = client_ip
+        self.small = small
+        self._iterator = None
+        self._pending = b''
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = iter(self.body)
+        chunk_size = config.EGRESS_CHUNK_SIZE
+        while len(self._pending) < chunk_size:
+            try:
+                self._pending += next(self._iterator)
+            except StopIteration:
+                break
+        if not self._pending:
+            raise StopIteration
+
+        chunk, self._pending = self._pending[:chunk_size], self._pending[chunk_size:]
+        delay = self.shaper.reserve(self.client_ip, len(chunk), self.small)
+        if delay > 0:
+            time.sleep(delay)
+        metrics.increment('egress_bytes', len(chunk))
+        return chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.shaper.release(self.client_ip, self.small)
+
+
+class EgressShaper:
+    """Bandwidth shaping and transfer limits for files served by this process.
+
+    - EGRESS_GLOBAL_RATE caps all file transfers together (bytes/second).
+    - EGRESS_CLIENT_RATE caps each client IP, with its own token bucket.
+    - EGRESS_MAX_TRANSFERS_PER_IP caps parallel transfers per IP (429 beyond).
+    - Files of at most EGRESS_SMALL_FILE_SIZE bytes go first: they skip the
+      per-client bucket and the transfer limit, and take from the global
+      bucket without waiting, so large transfers absorb the slowdown. What
+      counts is the whole file's size, so a large file fetched as small
+      Range slices is shaped, slice by slice, like the large transfer it is.
+
+    A value of 0 disables each limit; with none set, responses pass through
+    untouched. Pacing sleeps between chunks in the thread serving the
+    response; with EGRESS_ACCEL_REDIRECT, nginx streams (and paces) local
+    files instead and no Python thread is held at all.
+    """
+
+    def __init__(self):
+        burst = max(config.EGRESS_BURST, config.EGRESS_CHUNK_SIZE)
+        self.global_bucket = TokenBucket(config.EGRESS_GLOBAL_RATE, burst) if config.EGRESS_GLOBAL_RATE else None
+        self.client_buckets = {}
+        self.transfers = {}
+        self._lock = threading.Lock()
+        self._swept = time.monotonic()
+
+    @property
+    def enabled(self):
+        return bool(config.EGRESS_GLOBAL_RATE or config.EGRESS_CLIENT_RATE or config.EGRESS_MAX_TRANSFERS_PER_IP)
+
+    def _client_bucket(self, client_ip):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._swept > CLIENT_IDLE_SECONDS:
+                self._swept = now
+                for ip in [ip for ip, bucket in self.client_buckets.items()
+                           if bucket.idle() and not self.transfers.get(ip)]:
+                    del self.client_buckets[ip]
+            bucket = self.client_buckets.get(client_ip)
+            if bucket is None:
+                burst = max(config.EGRESS_BURST, config.EGRESS_CHUNK_SIZE)
+                bucket = self.client_buckets[client_ip] = TokenBucket(config.EGRESS_CLIENT_RATE, burst)
+            return bucket
+
+    def reserve(self, client_ip, amount, small=False):
+        """Seconds to wait before sending `amount` more bytes to `client_ip`."""
+        delay = 0.0
+        if config.EGRESS_CLIENT_RATE and not small:
+            delay = self._client_bucket(client_ip).take(amount)
+        if self.global_bucket is not None:
+            delay = max(delay, self.global_bucket.take(amount, priority=small))
+        return delay
+
+    def acquire(self, client_ip, small=False):
+        """Take a transfer slot for `client_ip`; False if it has too many running."""
+        if small:
+            return True
+        with self._lock:
+            running = self.transfers.get(client_ip, 0)
+            if config.EGRESS_MAX_TRANSFERS_PER_IP and running >= config.EGRESS_MAX_TRANSFERS_PER_IP:
+                return False
+            self.transfers[client_ip] = running + 1
+            return True
+
+    def release(self, client_ip, small=False):
+        if small:
+            return
+        with self._lock:
+            running = self.transfers.get(client_ip, 0) - 1
+            if running > 0:
+                self.transfers[client_ip] = running
+            else:
+                self.transfers.pop(client_ip, None)
+
+    def shape(self, response, client_ip, file_size=None):
+        """Apply shaping to a file response, or answer 429 when the client is at its transfer limit.
+
+        `file_size` is the size of the whole file, whether the response
+        sends all of it or a Range (206) of it; without it, the size is
+        taken from the response itself.
+        """
+        accel = 'X-Accel-Redirect' in response.headers
+        if not self.enabled or response.status_code not in (200, 206) or (
+                not accel and not response.direct_passthrough):
+            # Redirects to object storage, 304s, 416s: no bytes of ours to shape
+            return response
+
+        if file_size is None and not accel:
+            file_size = _full_size(response)
+        small = file_size is not None and file_size <= config.EGRESS_SMALL_FILE_SIZE
+
+        if accel:
+            # nginx paces the transfer itself; concurrency is its limit_conn's job
+            if config.EGRESS_CLIENT_RATE and not small:
+                response.headers['X-Accel-Limit-Rate'] = str(int(config.EGRESS_CLIENT_RATE))
+            return response
+
+        if not self.acquire(client_ip, small):
+            response.close()
+            metrics.increment('egress', result='rejected')
+            logger.info('Too many parallel transfers', extra={'client_ip': client_ip})
+            rejected = jsonify({
+                'success': False,
+                'message': f'Too many parallel downloads (max {config.EGRESS_MAX_TRANSFERS_PER_IP}); try again later',
+            })
+            rejected.status_code = 429
+            rejected.headers['Retry-After'] = str(TRANSFER_RETRY_AFTER)
+            return rejected
+
+        metrics.increment('egress', result='small' if small else 'shaped')
+        response.response = ShapedBody(self, response.response, client_ip, small)
+        return response
+
+    def status(self):
+        with self._lock:
+            return {
+                'transfers': sum(self.transfers.values()),
+                'clients': len(self.client_buckets),
+            }
+
+
+def get_shaper():
+    """Return this process's egress shaper, creating it on first use."""
+    global _shaper
+    with _shaper_lock:
+        if _shaper is None:
+            _shaper = EgressShaper()
+            metrics.register_collector('egress', _shaper.status)
+        return _shaper
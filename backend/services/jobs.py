@@ -0,0 +1,242 @@
+import contextvars
+import os
+import signal
+import subprocess
+import threading
+from collections import deque
+
+# The job whose work is running on this thread, if any
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled."""
+    def __init__(self, message='Download cancelled', checkpoint=False):
+        self.message = message
+        self.checkpoint = checkpoint
+        super().__init__(self.message)
+
+
+class JobHandle:
+    """Cancellation state and live child processes of one download job."""
+
+    def __init__(self, download_id):
+        self.download_id = download_id
+        self.running = False
+        self._cancelled = threading.Event()
+        self._checkpoint = False
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self, checkpoint=False):
+        """Stop the job and kill every process it started.
+
+        With `checkpoint`, the job keeps its partial data and goes back to
+        pending so it can resume later (used on shutdown).
+        """
+        with self._lock:
+            self._checkpoint = checkpoint
+            self._cancelled.set()
+            processes = list(self._processes)
+        for process in processes:
+            kill_process_tree(process)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(
+                'Interrupted by shutdown' if self._checkpoint else 'Download cancelled',
+                checkpoint=self._checkpoint,
+            )
+
+    def attach(self, process):
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self.cancelled
+        if cancelled:
+            kill_process_tree(process)
+
+    def detach(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+
+class JobRegistry:
+    """Tracks every queued or running job so it can be cancelled by id."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def register(self, download_id):
+        with self._lock:
+            handle = self._jobs.get(download_id)
+            if handle is None or handle.cancelled:
+                handle = JobHandle(download_id)
+                self._jobs[download_id] = handle
+            return handle
+
+    def unregister(self, handle, keep=False):
+        """Mark a job as no longer running; `keep` leaves it cancellable (e.g. during a retry backoff)."""
+        with self._lock:
+            handle.running = False
+            if not keep and self._jobs.get(handle.download_id) is handle:
+                del self._jobs[handle.download_id]
+            self._idle.notify_all()
+
+    def get(self, download_id):
+        with self._lock:
+            return self._jobs.get(download_id)
+
+    def cancel(self, download_id, checkpoint=False):
+        """Cancel a job; returns False if it is not known to this process."""
+        handle = self.get(download_id)
+        if handle is None:
+            return False
+        handle.cancel(checkpoint)
+        return True
+
+    def running(self):
+        with self._lock:
+            return [h for h in self._jobs.values() if h.running]
+
+    def wait_idle(self, timeout):
+        """Wait until no job is running; returns True if that happened in time."""
+        with self._idle:
+            return self._idle.wait_for(
+                lambda: not any(h.running for h in self._jobs.values()), timeout
+            )
+
+    def status(self):
+        with self._lock:
+            return {
+                'tracked': len(self._jobs),
+                'running': sum(h.running for h in self._jobs.values()),
+            }
+
+
+def kill_process_tree(process):
+    """Kill a process started by run_process together with its children."""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def run_process(cmd, timeout=None):
+    """subprocess.run(cmd, capture_output=True, text=True) for job work.
+
+    The child gets its own process group, which is attached to the current
+    job so cancelling the job (or a timeout) kills the whole tree, e.g.
+    yt-dlp and the ffmpeg it spawns.
+    """
+    handle = current_job.get()
+    if handle is not None:
+        handle.raise_if_cancelled()
+
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+    )
+    if handle is not None:
+        handle.attach(process)
+
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_tree(process)
+        process.communicate()
+        raise
+    except BaseException:
+        kill_process_tree(process)
+        process.wait()
+        raise
+    finally:
+        if handle is not None:
+            handle.detach(process)
+
+    if handle is not None:
+        handle.raise_if_cancelled()
+
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def run_bounded(cmd, timeout=None, stdout_limit=64 * 1024, stderr_lines=50):
+    """run_process for commands whose output size isn't ours to control.
+
+    Keeps at most the first `stdout_limit` bytes of stdout and the last
+    `stderr_lines` lines of stderr (each cut at 4KB), discarding the rest
+    as it arrives, so memory stays bounded whatever the child prints.
+    Returns text like run_process.
+    """
+    handle = current_job.get()
+    if handle is not None:
+        handle.raise_if_cancelled()
+
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    if handle is not None:
+        handle.attach(process)
+
+    stderr_tail = deque(maxlen=stderr_lines)
+
+    def read_stderr():
+        for line in iter(lambda: process.stderr.readline(4096), b''):
+            stderr_tail.append(line)
+
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        kill_process_tree(process)
+
+    reader = threading.Thread(target=read_stderr, daemon=True)
+    reader.start()
+    timer = threading.Timer(timeout, expire) if timeout else None
+    if timer is not None:
+        timer.daemon = True
+        timer.start()
+
+    try:
+        stdout = process.stdout.read(stdout_limit)
+        while process.stdout.read(64 * 1024):
+            pass
+        process.wait()
+        reader.join()
+    except BaseException:
+        kill_process_tree(process)
+        process.wait()
+        reader.join(1)
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+        process.stdout.close()
+        process.stderr.close()
+        if handle is not None:
+            handle.detach(process)
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    if handle is not None:
+        handle.raise_if_cancelled()
+
+    return subprocess.CompletedProcess(
+        cmd, process.returncode,
+        stdout.decode('utf-8', 'replace'),
+        b''.join(stderr_tail).decode('utf-8', 'replace'),
+    )
@@ -0,0 +1,641 @@
+import atexit
+import hashlib
+import json
+import heapq
+import itertools
+import os
+import random
+import shutil
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import config
+import database
+import metrics
+import tracing
+from logger import get_logger, log_context
+from services.converter import AudioConverter
+from services.jobs import JobCancelled, JobRegistry, current_job
+from services.scheduler import JobQueue
+from services.storage import get_storage
+from services.thumbnails import ThumbnailCache
+from services.youtube import YouTubeService, YouTubeDownloadError
+
+logger = get_logger(__name__)
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+class ConcurrencyLimiter:
+    """Counting semaphore whose limit can be changed while in use."""
+
+    def __init__(self, limit):
+        self._limit = max(1, int(limit))
+        self._active = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def active(self):
+        return self._active
+
+    def acquire(self):
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self._active >= self._limit:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._active += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def set_limit(self, limit):
+        with self._cond:
+            self._limit = max(1, int(limit))
+            self._cond.notify_all()
+
+    def status(self):
+        return {
+            'limit': self._limit,
+            'active': self._active,
+            'waiting': self._waiting,
+        }
+
+
+class PriorityLimiter(ConcurrencyLimiter):
+    """ConcurrencyLimiter that hands free slots to the lowest `priority` waiter first."""
+
+    def __init__(self, limit):
+        super().__init__(limit)
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def acquire(self, priority=0):
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            self._waiting += 1
+            try:
+                while self._active >= self._limit or self._waiters[0] != entry:
+                    self._cond.wait()
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._waiting -= 1
+            self._active += 1
+            # More than one slot may be free; let the next waiter check
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+
+class AdaptiveLimiter(ConcurrencyLimiter):
+    """Concurrency limit for network-bound work, tuned from observed results.
+
+    Every `window` seconds the aggregate throughput of finished transfers is
+    compared with the previous window. The limit grows by one while the pool
+    is saturated and throughput keeps improving, steps back when a previous
+    increase made things worse or errors pile up, and halves immediately when
+    the remote side throttles us (HTTP 429).
+    """
+
+    GAIN_THRESHOLD = 0.05
+    ERROR_THRESHOLD = 0.2
+
+    def __init__(self, initial, minimum, maximum, window):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        super().__init__(min(max(initial, self.minimum), self.maximum))
+        self.window = window
+        self.changes = deque(maxlen=50)
+        self._last_throughput = None
+        self._last_direction = 0
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_jobs = 0
+        self._window_failed = 0
+        self._window_throttled = 0
+        self._window_peak_active = self._active
+
+    def acquire(self):
+        super().acquire()
+        with self._cond:
+            self._window_peak_active = max(self._window_peak_active, self._active)
+
+    def record(self, num_bytes, failed=False, throttled=False):
+        """Report one finished transfer and adapt the limit if a window closed."""
+        with self._cond:
+            self._window_bytes += num_bytes
+            self._window_jobs += 1
+            self._window_failed += bool(failed)
+            self._window_throttled += bool(throttled)
+
+            now = time.monotonic()
+            if throttled or now - self._window_start >= self.window:
+                self._adapt(now)
+
+    def _adapt(self, now):
+        elapsed = max(now - self._window_start, 1e-6)
+        throughput = self._window_bytes / elapsed
+        error_rate = self._window_failed / self._window_jobs if self._window_jobs else 0
+        saturated = self._window_peak_active >= self._limit
+        limit = self._limit
+
+        if self._window_throttled:
+            new_limit, reason = limit // 2, 'throttled'
+        elif error_rate > self.ERROR_THRESHOLD:
+            new_limit, reason = limit - 1, 'errors'
+        elif self._last_throughput is None or throughput > self._last_throughput * (1 + self.GAIN_THRESHOLD):
+            new_limit, reason = (limit + 1, 'throughput improving') if saturated else (limit, None)
+        elif throughput < self._last_throughput * (1 - self.GAIN_THRESHOLD) and self._last_direction > 0:
+            new_limit, reason = limit - 1, 'throughput regressed'
+        else:
+            new_limit, reason = limit, None
+
+        new_limit = min(max(new_limit, self.minimum), self.maximum)
+        self._last_throughput = throughput
+        self._last_direction = (new_limit > limit) - (new_limit < limit)
+
+        if new_limit != limit:
+            self._limit = new_limit
+            self._cond.notify_all()
+            change = {
+                'at': datetime.now().isoformat(),
+                'from': limit,
+                'to': new_limit,
+                'reason': reason,
+                'throughput_bps': round(throughput),
+            }
+            self.changes.append(change)
+            metrics.increment('download_pool_resizes', reason=reason)
+            logger.info('Download pool resized', extra=change)
+
+        self._reset_window(now)
+
+    def status(self):
+        status = super().status()
+        status.update({
+            'min': self.minimum,
+            'max': self.maximum,
+            'last_throughput_bps': round(self._last_throughput or 0),
+            'recent_changes': list(self.changes)[-10:],
+        })
+        return status
+
+
+class DownloadJob:
+    """A queued download and the tracing context it carries between threads."""
+
+    def __init__(self, download_id, url, quality, title, request_id=None, trace=None,
+                 duration=None, client_ip=None, clip_start=None, clip_end=None, normalize=False,
+                 output_format=None):
+        self.download_id = download_id
+        self.url = url
+        self.quality = quality
+        self.format = output_format or config.DEFAULT_FORMAT
+        self.title = title
+        self.duration = duration
+        self.client_ip = client_ip
+        self.clip_start = clip_start
+        self.clip_end = clip_end
+        self.normalize = bool(normalize)
+        self.request_id = request_id
+        self.trace = trace or tracing.Trace()
+        self.queue_span = None
+        self.handle = None
+        self.retries = 0
+        self.backing_off = False
+
+    @classmethod
+    def from_row(cls, row):
+        """Job for a downloads row, continuing the trace its request started."""
+        return cls(
+            row['id'], row['youtube_url'], row['quality'], row['title'],
+            request_id=row['request_id'], trace=tracing.Trace(row['trace_id']),
+            duration=row['duration'], client_ip=row['client_ip'],
+            clip_start=row['clip_start'], clip_end=row['clip_end'],
+            normalize=row['normalize'], output_format=row['format'],
+        )
+
+
+def retry_delay(retries, kind):
+    """Exponential backoff with jitter; throttling backs off four times harder."""
+    base = config.RETRY_BACKOFF_BASE * (4 if kind == 'throttled' else 1)
+    delay = min(config.RETRY_BACKOFF_MAX, base * 2 ** retries)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class DownloadPipeline:
+    """Runs jobs through a download stage and an encode stage.
+
+    Downloads (network-bound) are limited by an AdaptiveLimiter; encodes
+    (CPU-bound) by a fixed limit of ENCODE_WORKERS. A job holds a download
+    slot only while transferring, so a slow encode never blocks the network.
+    Queued jobs take free download and encode slots in the order chosen by
+    SCHEDULER_POLICY (see scheduler.JobQueue).
+    Every queued or running job is tracked in `registry` so it can be
+    cancelled, and its child processes killed, by download id. Jobs come
+    from a QueueWorker (services.worker), which claims them from the
+    database queue shared by every worker process.
+    """
+
+    def __init__(self, youtube_service=None, upload_folder=None, storage=None):
+        self.youtube_service = youtube_service or YouTubeService()
+        self.upload_folder = upload_folder or config.UPLOAD_FOLDER
+        self.storage = storage or get_storage()
+        self.thumbnails = ThumbnailCache(os.path.join(self.upload_folder, 'thumbnails'))
+        self.download_limiter = AdaptiveLimiter(
+            config.DOWNLOAD_WORKERS_INITIAL,
+            config.DOWNLOAD_WORKERS_MIN,
+            config.DOWNLOAD_WORKERS_MAX,
+            config.DOWNLOAD_ADAPT_WINDOW,
+        )
+        self.encode_limiter = PriorityLimiter(config.ENCODE_WORKERS)
+        self.registry = JobRegistry()
+        self._queue = JobQueue()
+        self._dispatcher = None
+        self._accepting = True
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        """Queue a job; the dispatcher starts it when a download slot frees up."""
+        with self._lock:
+            if not self._accepting:
+                # Shutting down: the row stays pending for another worker to claim
+                return
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name='dispatcher', daemon=True)
+                self._dispatcher.start()
+        job.handle = self.registry.register(job.download_id)
+        job.queue_span = job.trace.start_span(
+            'queue', tracing.current_span(), retries=job.retries, policy=self._queue.policy
+        )
+        self._queue.put(job)
+        metrics.increment('jobs_submitted')
+
+    def cancel(self, download_id):
+        """Cancel a queued or running job, killing its processes.
+
+        Returns False if the job is not tracked by this process.
+        """
+        return self.registry.cancel(download_id)
+
+    @property
+    def scheduler_policy(self):
+        return self._queue.policy
+
+    def capacity(self):
+        """How many more jobs to take on: one per download or encode slot not yet spoken for."""
+        if not self._accepting:
+            return 0
+        return (self.download_limiter.limit + self.encode_limiter.limit
+                - self.registry.status()['tracked'])
+
+    def shutdown(self, timeout=None):
+        """Stop taking jobs, let running ones drain, then checkpoint the rest.
+
+        Jobs still running after `timeout` seconds have their processes
+        killed and go back to pending with their partial data kept, so a
+        worker resumes them once their lease is released.
+        """
+        if timeout is None:
+            timeout = config.SHUTDOWN_TIMEOUT
+
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+
+        running = self.registry.running()
+        if not running:
+            return
+
+        logger.info('Waiting up to %ss for %s running downloads', timeout, len(running))
+        if self.registry.wait_idle(timeout):
+            return
+
+        for handle in self.registry.running():
+            handle.cancel(checkpoint=True)
+        self.registry.wait_idle(5)
+
+    def source_key(self, job):
+        """Identifies the audio a job starts from: the video and clip range."""
+        video = self.youtube_service.video_id(job.url) or job.url
+        return f'{video}|{job.clip_start}|{job.clip_end}'
+
+    def artifact_base(self, job):
+        """Local output path without extension, shared by every job with the same source and encode options.
+
+        Its file name (with the extension) is the artifact's storage key.
+        """
+        if job.format == 'native':
+            # A remux is the same whatever bitrate was asked for
+            options = 'native'
+        else:
+            options = job.quality if job.format == 'mp3' else f'{job.format}|{job.quality}'
+            if job.normalize:
+                options += '|norm'
+        key = hashlib.sha1(f'{self.source_key(job)}|{options}'.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(
+            self.upload_folder, f'{self.youtube_service.sanitize_filename(job.title)}-{key}'
+        )
+
+    def find_artifact(self, job):
+        """Storage ref of an already converted output for a job, or None."""
+        name = os.path.basename(self.artifact_base(job))
+        if job.format == 'native':
+            # The container depends on the source, which isn't known before downloading
+            extensions = sorted(set(AudioConverter.NATIVE_EXTENSIONS.values())) + ['mka']
+        else:
+            extensions = [AudioConverter.FORMATS[job.format]['extension']]
+        return self.storage.find([f'{name}.{extension}' for extension in extensions])
+
+    def work_dir(self, download_id):
+        """Per-job scratch dir; kept across attempts so downloads can resume."""
+        return os.path.join(self.upload_folder, 'work', str(download_id))
+
+    def status(self):
+        return {
+            'accepting': self._accepting,
+            'queue': self._queue.status(),
+            'jobs': self.registry.status(),
+            'download': self.download_limiter.status(),
+            'encode': self.encode_limiter.status(),
+        }
+
+    def _dispatch(self):
+        while True:
+            # Pick the job only once a slot is free, so the policy sees every
+            # job submitted in the meantime
+            self._queue.wait()
+            self.download_limiter.acquire()
+            job = self._queue.pop()
+            if job.handle.cancelled or not self._accepting:
+                self.download_limiter.release()
+                job.queue_span.end('cancelled')
+                self.registry.unregister(job.handle)
+                continue
+            job.handle.running = True
+            threading.Thread(target=self._run, args=(job,), name=f'job-{job.download_id}', daemon=True).start()
+
+    def _run(self, job):
+        job.queue_span.end()
+        token = current_job.set(job.handle)
+        with log_context(request_id=job.request_id, job_id=job.download_id):
+            try:
+                with job.trace.span('job', download_id=job.download_id):
+                    self._process(job)
+            finally:
+                current_job.reset(token)
+                self.registry.unregister(job.handle, keep=job.backing_off)
+                job.trace.save(job.download_id)
+
+    def _process(self, job):
+        work_dir = self.work_dir(job.download_id)
+        holding_download_slot = True
+        keep_work_dir = False
+
+        try:
+            started = database.run_query(
+                '''UPDATE downloads SET status = "processing", attempts = attempts + 1, started_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ("pending", "processing")''',
+                [job.download_id]
+            )
+            if not started['changes']:
+                # Cancelled or deleted while it was queued
+                raise JobCancelled()
+
+            output_file = self.find_artifact(job)
+            cache_hit = bool(output_file)
+            if cache_hit:
+                # Same video, range, format and quality already converted: reuse it
+                self.download_limiter.release()
+                holding_download_slot = False
+                metrics.increment('artifact_cache', result='hit')
+                with tracing.span('artifact_cache', hit=True):
+                    # Keep the shared artifact from aging out of storage
+                    self.storage.touch(output_file)
+                self._cache_thumbnail(job)
+            else:
+                metrics.increment('artifact_cache', result='miss')
+                # _download_and_encode releases the slot itself
+                holding_download_slot = False
+                local_file = self._download_and_encode(job, work_dir)
+                with tracing.span('store', backend=self.storage.name,
+                                  file_size=os.path.getsize(local_file)):
+                    output_file = self.storage.save(local_file, os.path.basename(local_file))
+
+            # Publish
+            job.handle.raise_if_cancelled()
+            file_size = self.storage.size(output_file)
+            with tracing.span('publish', file_size=file_size):
+                now = datetime.now().isoformat()
+                published = database.run_query(
+                    '''UPDATE downloads SET
+                        file_path = ?,
+                        file_size = ?,
+                        status = "completed",
+                        completed_at = ?,
+                        error_message = NULL
+                    WHERE id = ? AND status = "processing"''',
+                    [output_file, file_size, now, job.download_id]
+                )
+            if not published['changes']:
+                # Cancelled (e.g. through another process) or deleted after the last check
+                if not cache_hit and not database.file_shared(output_file, job.download_id):
+                    self.storage.delete(output_file)
+                raise JobCancelled()
+
+            metrics.increment('jobs_finished', status='completed')
+            logger.info('Download completed', extra={'file_size': file_size})
+
+        except JobCancelled as cancelled:
+            if holding_download_slot:
+                self.download_limiter.release()
+
+            if cancelled.checkpoint:
+                # Shutdown: keep partial data and leave the row for the next worker
+                keep_work_dir = True
+                database.run_query(
+                    '''UPDATE downloads SET status = "pending", error_message = ?
+                    WHERE id = ? AND status = "processing"''',
+                    ['Interrupted by shutdown; will resume', job.download_id]
+                )
+            else:
+                database.run_query(
+                    '''UPDATE downloads SET status = "cancelled", error_message = ?
+                    WHERE id = ? AND status IN ("pending", "processing")''',
+                    [cancelled.message, job.download_id]
+                )
+            metrics.increment('jobs_finished', status='interrupted' if cancelled.checkpoint else 'cancelled')
+            logger.info('Download stopped: %s', cancelled.message)
+
+        except Exception as error:
+            if holding_download_slot:
+                self.download_limiter.release()
+
+            error_message = getattr(error, 'message', None) or str(error) or 'Unknown error occurred'
+            retryable = isinstance(error, YouTubeDownloadError) and error.retryable
+
+            if retryable and job.retries < config.DOWNLOAD_MAX_RETRIES:
+                keep_work_dir = self._schedule_retry(job, error, error_message)
+                return
+
+            # Keep partial data after transient failures so a manual retry resumes
+            keep_work_dir = retryable
+            database.run_query(
+                '''UPDATE downloads SET status = "failed", error_message = ?
+                WHERE id = ? AND status = "processing"''',
+                [error_message, job.download_id]
+            )
+            metrics.increment('jobs_finished', status='failed')
+            logger.error('Error processing download: %s', error_message)
+
+        finally:
+            if not keep_work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _download_and_encode(self, job, work_dir):
+        """Run the download and encode stages and return the local output path.
+
+        Releases the caller's download slot.
+        """
+        # Download stage
+        try:
+            source = self.youtube_service.download_source(
+                job.url, work_dir, job.clip_start, job.clip_end
+            )
+        except YouTubeDownloadError as error:
+            self.download_limiter.record(0, failed=True, throttled=error.kind == 'throttled')
+            raise
+        finally:
+            self.download_limiter.release()
+
+        self.download_limiter.record(source['fileSize'] - source['resumedFrom'])
+        metrics.increment('download_bytes', source['fileSize'] - source['resumedFrom'])
+        if source['resumedFrom']:
+            metrics.increment('download_bytes_resumed', source['resumedFrom'])
+
+        self._cache_thumbnail(job)
+
+        # Encode stage, into a temporary file so a cached output is always complete
+        extension = AudioConverter.output_extension(job.format, source['filePath'])
+        output_file = f'{self.artifact_base(job)}.{extension}'
+        encoding_file = f'{output_file[:-len(extension) - 1]}.{job.download_id}.tmp.{extension}'
+
+        with tracing.span('encode_queue'):
+            self.encode_limiter.acquire(self._queue.priority(job))
+        try:
+            job.handle.raise_if_cancelled()
+            row = database.get_query(
+                'SELECT uploader, thumbnail_path FROM downloads WHERE id = ?', [job.download_id]
+            ) or {}
+            loudness = self._loudness(job, source['filePath']) if job.normalize else None
+            AudioConverter.convert(
+                source['filePath'], encoding_file, job.format, job.quality, job.title,
+                tags={'artist': row.get('uploader'), 'comment': job.url},
+                cover_file=row.get('thumbnail_path'),
+                loudness=loudness,
+            )
+            job.handle.raise_if_cancelled()
+            os.replace(encoding_file, output_file)
+        finally:
+            self.encode_limiter.release()
+            AudioConverter.cleanup_file(encoding_file)
+
+        return output_file
+
+    def _loudness(self, job, source_file):
+        """Loudness measurements for a job's source, analysing it only on a cache miss."""
+        key = self.source_key(job)
+        row = database.get_query(
+            'SELECT measurements FROM loudness_measurements WHERE source_key = ?', [key]
+        )
+        if row:
+            metrics.increment('loudness_cache', result='hit')
+            return json.loads(row['measurements'])
+
+        metrics.increment('loudness_cache', result='miss')
+        measured = AudioConverter.measure_loudness(source_file)
+        database.run_query(
+            'INSERT OR REPLACE INTO loudness_measurements (source_key, measurements) VALUES (?, ?)',
+            [key, json.dumps(measured)]
+        )
+        return measured
+
+    def _cache_thumbnail(self, job):
+        row = database.get_query(
+            'SELECT thumbnail_source, thumbnail_path FROM downloads WHERE id = ?', [job.download_id]
+        )
+        if not row or (row['thumbnail_path'] and os.path.isfile(row['thumbnail_path'])):
+            return
+
+        thumbnail_path = self.thumbnails.fetch(row['thumbnail_source'])
+        if thumbnail_path:
+            database.run_query(
+                'UPDATE downloads SET thumbnail_path = ? WHERE id = ?', [thumbnail_path, job.download_id]
+            )
+
+    def _schedule_retry(self, job, error, error_message):
+        """Put the job back in the queue after a backoff; False if its row was cancelled or deleted meanwhile."""
+        delay = retry_delay(job.retries, error.kind)
+
+        scheduled = database.run_query(
+            '''UPDATE downloads SET status = "pending", error_message = ?
+            WHERE id = ? AND status = "processing"''',
+            [f'Retrying in {delay:.0f}s after: {error_message}', job.download_id]
+        )
+        if not scheduled['changes']:
+            return False
+        job.retries += 1
+        metrics.increment('job_retries', kind=error.kind)
+        logger.warning('Download failed (%s), retrying', error.kind, extra={
+            'retry': job.retries, 'delay_s': round(delay, 1), 'error': error_message[-500:],
+        })
+
+        backoff_span = job.trace.start_span('backoff', delay_s=round(delay, 3), kind=error.kind)
+        # Stay registered during the backoff so the job can still be cancelled
+        job.backing_off = True
+
+        def resubmit():
+            backoff_span.end()
+            job.backing_off = False
+            if job.handle.cancelled:
+                self.registry.unregister(job.handle)
+                shutil.rmtree(self.work_dir(job.download_id), ignore_errors=True)
+                return
+            self.submit(job)
+
+        timer = threading.Timer(delay, resubmit)
+        timer.daemon = True
+        timer.start()
+        return True
+
+
+def get_pipeline():
+    """Return the process-wide pipeline, creating it on first use."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = DownloadPipeline()
+            metrics.register_collector('pipeline', _pipeline.status)
+            # Runs on SIGTERM-triggered exits too (sys.exit), e.g. gunicorn workers
+            atexit.register(_pipeline.shutdown)
+        return _pipeline
@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict
+import config
+
+POLICIES = ('fifo', 'sjf', 'fair')
+
+
+def job_cost(job):
+    """Estimated work for a job in seconds of audio (unknown durations get a default)."""
+    duration = job.duration if job.duration and job.duration > 0 else config.SCHEDULER_DEFAULT_DURATION
+    if job.clip_start is None and job.clip_end is None:
+        return duration
+    end = job.clip_end if job.clip_end is not None else duration
+    return max(end - (job.clip_start or 0), 1)
+
+
+# Encoded bitrate relative to the requested one: the Opus and Vorbis
+# encoders treat it as an average target and may overshoot it
+BITRATE_HEADROOM = {'mp3': 1.0, 'm4a': 1.0, 'opus': 1.1, 'ogg': 1.1}
+# A native (remuxed) output keeps the source's bitrate, whatever quality was
+# asked for; YouTube's audio-only streams stay below this (in kbps)
+NATIVE_MAX_BITRATE = 256
+
+
+def estimated_bitrate(output_format, quality):
+    """Upper estimate in kbps of the audio a job in `output_format` will produce."""
+    if output_format == 'native':
+        return NATIVE_MAX_BITRATE
+    return int(quality) * BITRATE_HEADROOM.get(output_format, 1.0)
+
+
+def estimated_size(duration, output_format, quality):
+    """Upper estimate in bytes of the file a job will produce."""
+    return int(duration * estimated_bitrate(output_format, quality) * 1000 / 8)
+
+
+def claim_order(policy):
+    """SQL ORDER BY over `downloads d` that picks the next jobs to claim from the shared queue.
+
+    Mirrors JobQueue's keys: fifo by submission, sjf by estimated cost less
+    `SCHEDULER_AGING` seconds per second waited. Fair share needs per-client
+    history, so it claims in submission order and each worker orders its
+    claimed jobs fairly.
+    """
+    if policy != 'sjf':
+        return 'd.id'
+    cost = (f'COALESCE(d.clip_end, NULLIF(d.duration, 0), {float(config.SCHEDULER_DEFAULT_DURATION)})'
+            ' - COALESCE(d.clip_start, 0)')
+    waited = "(julianday('now') - julianday(d.created_at)) * 86400"
+    return f'{cost} - {float(config.SCHEDULER_AGING)} * {waited}, d.id'
+
+
+class JobQueue:
+    """Queue of jobs waiting for a download slot, ordered by a scheduling policy.
+
+    - fifo: submission order.
+    - sjf: shortest job first by probed duration, with aging: a job's
+      effective cost drops by `aging` seconds for every second it waits, so
+      long jobs are delayed but never starved.
+    - fair: per-client (IP) fair share. The next job comes from the client
+      that has been given the least work so far; each client's own jobs
+      are ordered as in sjf.
+    """
+
+    def __init__(self, policy=None, aging=None):
+        self.policy = (policy or config.SCHEDULER_POLICY).lower()
+        if self.policy not in POLICIES:
+            raise ValueError(f'Unknown scheduler policy {self.policy!r}. Allowed: {", ".join(POLICIES)}')
+        self.aging = config.SCHEDULER_AGING if aging is None else aging
+
+        self._heaps = defaultdict(list)
+        self._served = {}
+        self._size = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _key(self, job):
+        if self.policy == 'fifo':
+            return time.monotonic()
+        # cost - aging * (now - enqueued) sorts the same at every `now`, so the
+        # aged priority can be fixed at enqueue time
+        return job_cost(job) + self.aging * time.monotonic()
+
+    def priority(self, job):
+        """Sort key for a job waiting on a later stage (lower runs first)."""
+        return self._key(job)
+
+    def put(self, job):
+        client = job.client_ip if self.policy == 'fair' else None
+        with self._cond:
+            if client not in self._served:
+                # A new client starts level with the least-served active one
+                active = [self._served[c] for c, heap in self._heaps.items() if heap]
+                self._served[client] = min(active, default=0)
+            heapq.heappush(self._heaps[client], (self._key(job), next(self._seq), job))
+            self._size += 1
+            self._cond.notify()
+
+    def wait(self):
+        """Block until at least one job is queued."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._size > 0)
+
+    def pop(self):
+        """Remove and return the next job to run, or None if the queue is empty."""
+        with self._cond:
+            candidates = [c for c, heap in self._heaps.items() if heap]
+            if not candidates:
+                return None
+
+            client = min(candidates, key=lambda c: (self._served[c], self._heaps[c][0][:2]))
+            _, _, job = heapq.heappop(self._heaps[client])
+            self._size -= 1
+            self._served[client] += job_cost(job)
+
+            if not self._heaps[client]:
+                del self._heaps[client]
+                # Forget idle clients' history so it can't be banked for later
+                if not any(self._heaps.values()):
+                    self._served.clear()
+                else:
+                    del self._served[client]
+            return job
+
+    def qsize(self):
+        return self._size
+
+    def status(self):
+        with self._cond:
+            status = {
+                'policy': self.policy,
+                'queued': self._size,
+            }
+            if self.policy == 'fair':
+                status['clients'] = {str(c): len(heap) for c, heap in self._heaps.items()}
+            return status
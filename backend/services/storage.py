@@ -0,0 +1,277 @@
+import mimetypes
+import os
+import threading
+from urllib.parse import quote
+from flask import Response, redirect, send_file
+import config
+from logger import get_logger
+
+# Only needed for STORAGE_BACKEND=s3
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+logger = get_logger(__name__)
+
+_storage = None
+_storage_lock = threading.Lock()
+
+S3_SCHEME = 's3://'
+
+
+class StorageError(Exception):
+    """Custom exception for artifact storage errors."""
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def content_disposition(download_name):
+    """Attachment header value for a file name, with a UTF-8 fallback for non-ASCII names."""
+    ascii_name = download_name.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'download'
+    return f'attachment; filename="{ascii_name}"; filename*=UTF-8\'\'{quote(download_name)}'
+
+
+class LocalStorage:
+    """Artifacts as files in the upload folder; a file's ref is its path."""
+
+    name = 'local'
+
+    def __init__(self, folder=None):
+        self.folder = folder or config.UPLOAD_FOLDER
+
+    def owns(self, ref):
+        return not ref.startswith(S3_SCHEME)
+
+    def ref(self, key):
+        return os.path.join(self.folder, key)
+
+    def find(self, keys):
+        """Ref of the first of `keys` that is stored, or None."""
+        for key in keys:
+            if os.path.isfile(self.ref(key)):
+                return self.ref(key)
+        return None
+
+    def exists(self, ref):
+        return os.path.isfile(ref)
+
+    def size(self, ref):
+        return os.path.getsize(ref)
+
+    def touch(self, ref):
+        """Keep a reused artifact from aging out (see stale)."""
+        os.utime(ref)
+
+    def save(self, local_file, key):
+        """Move a finished local file into the store under `key`; returns its ref."""
+        path = self.ref(key)
+        if os.path.abspath(local_file) != os.path.abspath(path):
+            os.replace(local_file, path)
+        return path
+
+    def delete(self, ref):
+        """Delete an artifact; returns False if it was already gone."""
+        try:
+            os.unlink(ref)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def send(self, ref, download_name):
+        """Response that delivers an artifact to the client.
+
+        With EGRESS_ACCEL_REDIRECT set, nginx serves the file from that
+        internal location instead (X-Accel-Redirect), Range requests included.
+        """
+        if config.EGRESS_ACCEL_REDIRECT:
+            return Response(headers={
+                'X-Accel-Redirect': config.EGRESS_ACCEL_REDIRECT.rstrip('/') + '/' + quote(os.path.basename(ref)),
+                'Content-Type': mimetypes.guess_type(ref)[0] or 'application/octet-stream',
+                'Content-Disposition': content_disposition(download_name),
+            })
+        return send_file(ref, as_attachment=True, download_name=download_name)
+
+    def stale(self, cutoff_time):
+        """Yield (ref, size) for files not modified since `cutoff_time`."""
+        if not os.path.isdir(self.folder):
+            return
+        # scandir gets the file type from the directory listing, so only
+        # regular files cost a stat call
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if stat.st_mtime < cutoff_time:
+                    yield entry.path, stat.st_size
+
+
+class S3Storage:
+    """Artifacts as objects in an S3-compatible bucket (AWS S3, MinIO, ...).
+
+    Refs look like s3://bucket/key. Uploads switch to multipart above
+    S3_MULTIPART_THRESHOLD, and downloads are redirects to presigned URLs,
+    so artifact bytes never pass through this process once stored. The
+    bucket (under S3_PREFIX) is assumed to hold only artifacts: stale()
+    lists everything there.
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket=None, prefix=None):
+        if boto3 is None:
+            raise StorageError('STORAGE_BACKEND=s3 requires the boto3 package')
+        self.bucket = bucket or config.S3_BUCKET
+        if not self.bucket:
+            raise StorageError('STORAGE_BACKEND=s3 requires S3_BUCKET')
+        self.prefix = config.S3_PREFIX if prefix is None else prefix
+
+        self.client = self._client(config.S3_ENDPOINT_URL)
+        # Presigned URLs are signed for the host the browser will use, which
+        # differs from the internal one when e.g. MinIO runs next to the API
+        public_endpoint = config.S3_PUBLIC_ENDPOINT_URL or config.S3_ENDPOINT_URL
+        self.presigner = (self.client if public_endpoint == config.S3_ENDPOINT_URL
+                          else self._client(public_endpoint))
+        self.transfer = TransferConfig(
+            multipart_threshold=config.S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=config.S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=config.S3_UPLOAD_CONCURRENCY,
+        )
+
+    @staticmethod
+    def _client(endpoint_url):
+        return boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            region_name=config.S3_REGION or None,
+            aws_access_key_id=config.S3_ACCESS_KEY_ID or None,
+            aws_secret_access_key=config.S3_SECRET_ACCESS_KEY or None,
+            config=Config(
+                signature_version='s3v4',
+                # Self-hosted endpoints rarely have per-bucket DNS names
+                s3={'addressing_style': 'path' if endpoint_url else 'auto'},
+            ),
+        )
+
+    def owns(self, ref):
+        return ref.startswith(f'{S3_SCHEME}{self.bucket}/')
+
+    def ref(self, key):
+        return f'{S3_SCHEME}{self.bucket}/{self.prefix}{key}'
+
+    def _object_key(self, ref):
+        return ref[len(f'{S3_SCHEME}{self.bucket}/'):]
+
+    def find(self, keys):
+        """Ref of the first of `keys` that is stored, or None, in one LIST request."""
+        listing = self.client.list_objects_v2(
+            Bucket=self.bucket, Prefix=self.prefix + os.path.commonprefix(keys)
+        )
+        stored = {item['Key'] for item in listing.get('Contents', [])}
+        for key in keys:
+            if self.prefix + key in stored:
+                return self.ref(key)
+        return None
+
+    def _head(self, ref):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(ref))
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, ref):
+        return self._head(ref) is not None
+
+    def size(self, ref):
+        head = self._head(ref)
+        if head is None:
+            raise StorageError(f'Artifact not found: {ref}')
+        return head['ContentLength']
+
+    def touch(self, ref):
+        """Refresh LastModified with a server-side self-copy, keeping the object's headers."""
+        head = self._head(ref)
+        if head is None:
+            return
+        key = self._object_key(ref)
+        self.client.copy_object(
+            Bucket=self.bucket, Key=key,
+            CopySource={'Bucket': self.bucket, 'Key': key},
+            ContentType=head.get('ContentType', 'application/octet-stream'),
+            Metadata=head.get('Metadata', {}),
+            MetadataDirective='REPLACE',
+        )
+
+    def save(self, local_file, key):
+        """Upload a finished local file (multipart when large), then delete it; returns its ref."""
+        content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        try:
+            self.client.upload_file(
+                local_file, self.bucket, self.prefix + key,
+                ExtraArgs={'ContentType': content_type}, Config=self.transfer,
+            )
+        except Exception as error:
+            raise StorageError(f'Error uploading {key}: {error}')
+        finally:
+            os.unlink(local_file)
+        return self.ref(key)
+
+    def delete(self, ref):
+        """Delete an artifact (S3 does not report whether it existed)."""
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(ref))
+        return True
+
+    def send(self, ref, download_name):
+        """Redirect to a short-lived presigned GET that names the file for the browser."""
+        url = self.presigner.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': self._object_key(ref),
+                'ResponseContentDisposition': content_disposition(download_name),
+            },
+            ExpiresIn=config.S3_PRESIGN_EXPIRES,
+        )
+        return redirect(url, 302)
+
+    def stale(self, cutoff_time):
+        """Yield (ref, size) for objects not modified since `cutoff_time`."""
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                if item['LastModified'].timestamp() < cutoff_time:
+                    yield f'{S3_SCHEME}{self.bucket}/{item["Key"]}', item['Size']
+
+
+def get_storage():
+    """Return the configured artifact store (STORAGE_BACKEND), creating it on first use."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if config.STORAGE_BACKEND == 's3':
+                _storage = S3Storage()
+            else:
+                _storage = LocalStorage()
+            logger.info('Artifact storage: %s', _storage.name)
+        return _storage
+
+
+def storage_for(ref):
+    """The store holding `ref`, so artifacts stored before a backend switch stay reachable."""
+    storage = get_storage()
+    if storage.owns(ref):
+        return storage
+    if ref.startswith(S3_SCHEME):
+        bucket = ref[len(S3_SCHEME):].split('/', 1)[0]
+        return S3Storage(bucket=bucket, prefix='')
+    return LocalStorage()
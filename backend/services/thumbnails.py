@@ -0,0 +1,77 @@
+import hashlib
+import os
+import subprocess
+import threading
+from urllib.parse import urlparse
+import config
+from logger import get_logger
+import tracing
+from services.jobs import JobCancelled, run_process
+
+logger = get_logger(__name__)
+
+
+class ThumbnailCache:
+    """Local cache of resized WebP thumbnails, keyed by source URL."""
+
+    def __init__(self, cache_folder=None):
+        if cache_folder is None:
+            cache_folder = os.path.join(config.UPLOAD_FOLDER, 'thumbnails')
+        self.cache_folder = cache_folder
+
+    def path_for(self, url):
+        """Cache path for a thumbnail URL (the same video always maps to one file)."""
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.cache_folder, f'{digest}.webp')
+
+    def fetch(self, url):
+        """Download, resize and re-encode a thumbnail; returns its path or None.
+
+        Thumbnails are cosmetic, so failures are logged and swallowed; only
+        cancellation propagates.
+        """
+        if not url or urlparse(url).scheme not in ('http', 'https'):
+            return None
+
+        path = self.path_for(url)
+        if os.path.isfile(path):
+            return path
+
+        os.makedirs(self.cache_folder, exist_ok=True)
+        # Per thread, so concurrent fetches of the same thumbnail don't share a file
+        partial = f'{path}.{os.getpid()}-{threading.get_ident()}.part.webp'
+
+        # ffmpeg fetches the image itself; only network protocols are allowed
+        cmd = [
+            'ffmpeg',
+            '-protocol_whitelist', 'http,https,tls,tcp',
+            '-i', url,
+            '-vf', f"scale='min({config.THUMBNAIL_WIDTH},iw)':-2",
+            '-frames:v', '1',
+            '-c:v', 'libwebp',
+            '-quality', str(config.THUMBNAIL_QUALITY),
+            '-y', partial,
+        ]
+
+        try:
+            with tracing.span('thumbnail'):
+                result = run_process(cmd, timeout=config.THUMBNAIL_TIMEOUT)
+
+            if result.returncode != 0 or not os.path.isfile(partial):
+                logger.warning('Thumbnail conversion failed', extra={'stderr': result.stderr[-500:]})
+                return None
+
+            os.replace(partial, path)
+            return path
+
+        except JobCancelled:
+            raise
+        except subprocess.TimeoutExpired:
+            logger.warning('Thumbnail download timed out after %s seconds', config.THUMBNAIL_TIMEOUT)
+            return None
+        except Exception as e:
+            logger.warning('Error caching thumbnail: %s', e)
+            return None
+        finally:
+            if os.path.isfile(partial):
+                os.unlink(partial)
@@ -0,0 +1,336 @@
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import os
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import config
+import database
+import metrics
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+# Receiver answers that retrying cannot fix; anything else non-2xx is retried
+RETRYABLE_CLIENT_ERRORS = (408, 409, 425, 429)
+
+
+class WebhookError(Exception):
+    """Custom exception for webhook errors."""
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def _internal_address(address):
+    """True for loopback, private, link-local, multicast, reserved and unspecified addresses."""
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if getattr(ip, 'ipv4_mapped', None):
+        ip = ip.ipv4_mapped
+    return (ip.is_loopback or ip.is_private or ip.is_link_local or ip.is_multicast
+            or ip.is_reserved or ip.is_unspecified)
+
+
+def resolve_host(host, port):
+    """Addresses to deliver to `host` at, refusing internal ones; raises WebhookError.
+
+    Hosts listed in WEBHOOK_ALLOWED_HOSTS may resolve to anything, so an
+    internal receiver has to be allowed explicitly.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise WebhookError(f'callback_url host {host} does not resolve')
+
+    addresses = [info[4][0] for info in infos]
+    if host.lower() not in config.WEBHOOK_ALLOWED_HOSTS:
+        for address in addresses:
+            if _internal_address(address):
+                raise WebhookError(f'callback_url host {host} resolves to an internal address')
+    return addresses
+
+
+def validate_callback_url(url):
+    """Check a callback_url given with a download; raises WebhookError."""
+    if not config.WEBHOOK_SECRET:
+        raise WebhookError('Webhooks are not enabled on this server')
+    if not isinstance(url, str) or len(url) > 2048:
+        raise WebhookError('callback_url must be a URL of at most 2048 characters')
+
+    parsed = urlparse(url)
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    except ValueError:
+        raise WebhookError('callback_url has an invalid port')
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise WebhookError('callback_url must be an http(s) URL')
+    if config.WEBHOOK_ALLOWED_HOSTS and parsed.hostname.lower() not in config.WEBHOOK_ALLOWED_HOSTS:
+        raise WebhookError('callback_url host is not allowed')
+    resolve_host(parsed.hostname, port)
+
+
+def sign(body, timestamp, secret=None):
+    """HMAC-SHA256 of "<timestamp>.<body>", hex-encoded.
+
+    Receivers recompute it with the shared WEBHOOK_SECRET from the
+    X-Webhook-Timestamp header and the raw body, and should reject old
+    timestamps to stop replays.
+    """
+    key = (secret or config.WEBHOOK_SECRET).encode('utf-8')
+    return hmac.new(key, f'{timestamp}.'.encode('ascii') + body, hashlib.sha256).hexdigest()
+
+
+def delivery_delay(attempts):
+    """Exponential backoff with jitter before the next attempt."""
+    delay = min(config.WEBHOOK_BACKOFF_MAX, config.WEBHOOK_BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirected POST would be replayed as a GET without the payload
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+# The host is resolved again when connecting, and the connection goes to the
+# address that was checked, so DNS changed after validation (rebinding)
+# cannot point a delivery at an internal service
+class _CheckedHTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        address = resolve_host(self.host, self.port)[0]
+        self.sock = socket.create_connection((address, self.port), self.timeout, self.source_address)
+
+
+class _CheckedHTTPSConnection(http.client.HTTPSConnection):
+    def connect(self):
+        address = resolve_host(self.host, self.port)[0]
+        sock = socket.create_connection((address, self.port), self.timeout, self.source_address)
+        # Certificate and SNI still use the host name
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class _CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_CheckedHTTPConnection, req)
+
+
+class _CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_CheckedHTTPSConnection, req, context=self._context)
+
+
+# No proxies: the address check must apply to the receiver itself
+_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), _CheckedHTTPHandler, _CheckedHTTPSHandler, _NoRedirect,
+)
+
+
+class WebhookDispatcher:
+    """Sends queued webhook deliveries from a small thread pool of its own.
+
+    Deliveries are leased like queued downloads, so dispatchers in several
+    processes share one queue and a delivery whose process died is picked
+    up again once its lease expires (receivers may see a delivery twice and
+    should dedupe on X-Webhook-Id). Failures are retried with backoff up to
+    WEBHOOK_MAX_ATTEMPTS, then moved to webhook_dead_letters.
+    """
+
+    def __init__(self, owner=None):
+        self.owner = owner or config.WORKER_ID or f'{socket.gethostname()}:{os.getpid()}'
+        self.delivered = 0
+        self.failed = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._pool = ThreadPoolExecutor(config.WEBHOOK_CONCURRENCY, thread_name_prefix='webhook')
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='webhook-dispatcher', daemon=True)
+                self._thread.start()
+                logger.info('Webhook dispatcher started', extra={'owner': self.owner})
+        return self
+
+    def stop(self):
+        """Stop claiming; deliveries in flight finish, unclaimed ones wait for the next process."""
+        self._stopping.set()
+        self._wake.set()
+        self._pool.shutdown(wait=False)
+
+    def notify(self):
+        self._wake.set()
+
+    def status(self):
+        return {
+            'in_flight': self._in_flight,
+            'delivered': self.delivered,
+            'failed': self.failed,
+        }
+
+    def claim(self, limit):
+        """Lease up to `limit` due deliveries; returns their rows."""
+        if limit <= 0:
+            return []
+        now = time.time()
+        return database.all_query(
+            '''UPDATE webhook_deliveries SET lease_owner = ?, lease_expires_at = ?
+            WHERE id IN (
+                SELECT id FROM webhook_deliveries
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                    AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                ORDER BY next_attempt_at
+                LIMIT ?
+            )
+            RETURNING id, download_id, url, event, payload, attempts''',
+            [self.owner, now + config.WEBHOOK_TIMEOUT + 30, now, now, limit]
+        )
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                with self._lock:
+                    free = config.WEBHOOK_CONCURRENCY - self._in_flight
+                deliveries = self.claim(free)
+                for delivery in deliveries:
+                    with self._lock:
+                        self._in_flight += 1
+                    self._pool.submit(self._run, delivery)
+                if deliveries:
+                    continue
+            except Exception as error:
+                logger.error('Error claiming webhook deliveries: %s', error)
+            self._wake.wait(config.WEBHOOK_POLL_INTERVAL)
+            self._wake.clear()
+
+    def _run(self, delivery):
+        try:
+            self.deliver(delivery)
+        except Exception as error:
+            logger.error('Error delivering webhook %s: %s', delivery['id'], error)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            # A slot freed up; look for more work right away
+            self._wake.set()
+
+    def deliver(self, delivery):
+        """POST one delivery and record the outcome."""
+        body = delivery['payload'].encode('utf-8')
+        timestamp = str(int(time.time()))
+        request = urllib.request.Request(delivery['url'], data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'User-Agent': 'yt-converter-webhooks/1.0',
+            'X-Webhook-Id': str(delivery['id']),
+            'X-Webhook-Event': delivery['event'],
+            'X-Webhook-Timestamp': timestamp,
+            'X-Webhook-Signature': f'sha256={sign(body, timestamp)}',
+        })
+        attempts = delivery['attempts'] + 1
+
+        status, error, blocked = None, None, False
+        try:
+            with _opener.open(request, timeout=config.WEBHOOK_TIMEOUT) as response:
+                status = response.status
+        except urllib.error.HTTPError as http_error:
+            status, error = http_error.code, f'HTTP {http_error.code}'
+        except WebhookError as refused_host:
+            error, blocked = refused_host.message, True
+        except Exception as other:
+            error = str(getattr(other, 'reason', None) or other)[:500]
+
+        if error is None and 200 <= status < 300:
+            database.run_query(
+                '''UPDATE webhook_deliveries SET status = 'delivered', attempts = ?, response_status = ?,
+                    last_error = NULL, lease_owner = NULL, lease_expires_at = NULL, delivered_at = CURRENT_TIMESTAMP
+                WHERE id = ?''',
+                [attempts, status, delivery['id']]
+            )
+            with self._lock:
+                self.delivered += 1
+            metrics.increment('webhook_deliveries', result='delivered')
+            logger.info('Webhook delivered', extra={'delivery_id': delivery['id'], 'attempts': attempts})
+            return True
+
+        refused = blocked or (status is not None and 400 <= status < 500
+                              and status not in RETRYABLE_CLIENT_ERRORS)
+        if refused or attempts >= config.WEBHOOK_MAX_ATTEMPTS:
+            self.dead_letter(delivery['id'], attempts, status, error)
+            with self._lock:
+                self.failed += 1
+            metrics.increment('webhook_deliveries', result='dead')
+            logger.warning('Webhook dead-lettered', extra={
+                'delivery_id': delivery['id'], 'attempts': attempts, 'error': error,
+            })
+            return False
+
+        delay = delivery_delay(attempts)
+        database.run_query(
+            '''UPDATE webhook_deliveries SET attempts = ?, response_status = ?, last_error = ?,
+                next_attempt_at = ?, lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = ?''',
+            [attempts, status, error, time.time() + delay, delivery['id']]
+        )
+        metrics.increment('webhook_deliveries', result='retry')
+        logger.info('Webhook delivery failed, retrying', extra={
+            'delivery_id': delivery['id'], 'attempts': attempts, 'error': error, 'retry_in': round(delay, 1),
+        })
+        return False
+
+    @staticmethod
+    def dead_letter(delivery_id, attempts, status, error):
+        """Move a delivery out of the queue into webhook_dead_letters."""
+        with database.get_db_cursor() as cursor:
+            cursor.execute(
+                '''INSERT INTO webhook_dead_letters (delivery_id, download_id, url, event, payload,
+                    attempts, response_status, last_error, created_at)
+                SELECT id, download_id, url, event, payload, ?, ?, ?, created_at
+                FROM webhook_deliveries WHERE id = ?''',
+                [attempts, status, error, delivery_id]
+            )
+            cursor.execute('DELETE FROM webhook_deliveries WHERE id = ?', [delivery_id])
+
+
+def dead_letters(limit=50, offset=0):
+    return database.all_query(
+        'SELECT * FROM webhook_dead_letters ORDER BY id DESC LIMIT ? OFFSET ?', [limit, offset]
+    )
+
+
+def replay(dead_letter_id):
+    """Queue a dead-lettered delivery again with fresh attempts; returns the new delivery id or None."""
+    with database.get_db_cursor() as cursor:
+        cursor.execute(
+            '''INSERT INTO webhook_deliveries (download_id, url, event, payload)
+            SELECT download_id, url, event, payload FROM webhook_dead_letters WHERE id = ?''',
+            [dead_letter_id]
+        )
+        if not cursor.rowcount:
+            return None
+        delivery_id = cursor.lastrowid
+        cursor.execute('DELETE FROM webhook_dead_letters WHERE id = ?', [dead_letter_id])
+    if _dispatcher is not None:
+        _dispatcher.notify()
+    return delivery_id
+
+
+def get_dispatcher():
+    """Return this process's webhook dispatcher, creating it on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = WebhookDispatcher()
+            metrics.register_collector('webhooks', _dispatcher.status)
+        return _dispatcher
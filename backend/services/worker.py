@@ -0,0 +1,215 @@
+import os
+import socket
+import threading
+import time
+import config
+import database
+import metrics
+from logger import get_logger
+from services.pipeline import DownloadJob, get_pipeline
+from services.scheduler import claim_order
+
+logger = get_logger(__name__)
+
+_worker = None
+_worker_lock = threading.Lock()
+
+# Columns a claimed job is built from
+JOB_COLUMNS = '''id, youtube_url, title, quality, format, duration, client_ip,
+    clip_start, clip_end, normalize, request_id, trace_id'''
+
+
+def lease_owner(download_id):
+    """Id of the worker currently holding a download's lease, or None."""
+    row = database.get_query(
+        'SELECT owner FROM download_leases WHERE download_id = ? AND expires_at >= ?',
+        [download_id, time.time()]
+    )
+    return row['owner'] if row else None
+
+
+def lease_owners(download_ids):
+    """{download id: worker id} for those of `download_ids` currently leased."""
+    if not download_ids:
+        return {}
+    rows = database.all_query(
+        f'''SELECT download_id, owner FROM download_leases
+        WHERE download_id IN ({", ".join("?" * len(download_ids))}) AND expires_at >= ?''',
+        list(download_ids) + [time.time()]
+    )
+    return {row['download_id']: row['owner'] for row in rows}
+
+
+class QueueWorker:
+    """Claims downloads from the shared database queue and runs them on a DownloadPipeline.
+
+    The downloads table is the queue: pending rows, and processing rows
+    whose worker stopped renewing its lease (it died), can be claimed. A
+    claim leases the row to this worker for WORKER_LEASE_SECONDS; every
+    WORKER_HEARTBEAT_INTERVAL the worker renews the leases of the jobs it
+    still tracks (queued, running or backing off), releases the rest, and
+    cancels jobs whose rows were cancelled or deleted through the API,
+    possibly by another process. Any number of workers, in any number of
+    processes sharing the database, can serve one queue.
+    """
+
+    def __init__(self, pipeline, worker_id=None):
+        self.pipeline = pipeline
+        self.worker_id = worker_id or config.WORKER_ID or f'{socket.gethostname()}:{os.getpid()}'
+        self.claimed = 0
+        self._leased = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self, claim=True):
+        """Start the heartbeat and, with `claim`, the loop that takes queued jobs."""
+        targets = [self._heartbeat_loop] + ([self._claim_loop] if claim else [])
+        for target in targets:
+            threading.Thread(target=target, name=target.__name__.strip('_').replace('_', '-'), daemon=True).start()
+        logger.info('Queue worker started', extra={'worker_id': self.worker_id})
+        return self
+
+    def notify(self):
+        """Wake the claim loop, e.g. right after a job was enqueued in this process."""
+        self._wake.set()
+
+    def claim(self, limit, ids=None):
+        """Lease up to `limit` claimable downloads (only `ids`, if given) and submit them."""
+        if limit <= 0:
+            return 0
+
+        now = time.time()
+        params = [self.worker_id, now + config.WORKER_LEASE_SECONDS, now]
+        only = ''
+        if ids is not None:
+            if not ids:
+                return 0
+            only = f'AND d.id IN ({", ".join("?" * len(ids))})'
+            params.extend(ids)
+        params.append(limit)
+
+        # One statement, so concurrent workers can never lease the same row
+        leased = database.all_query(
+            f'''INSERT INTO download_leases (download_id, owner, expires_at)
+            SELECT d.id, ?, ? FROM downloads d
+            WHERE d.status IN ('pending', 'processing')
+                AND NOT EXISTS (
+                    SELECT 1 FROM download_leases l WHERE l.download_id = d.id AND l.expires_at >= ?
+                )
+                {only}
+            ORDER BY {claim_order(self.pipeline.scheduler_policy)}
+            LIMIT ?
+            ON CONFLICT (download_id) DO UPDATE SET
+                owner = excluded.owner, expires_at = excluded.expires_at
+            RETURNING download_id''',
+            params
+        )
+        if not leased:
+            return 0
+
+        leased_ids = [row['download_id'] for row in leased]
+        rows = database.all_query(
+            f'SELECT {JOB_COLUMNS} FROM downloads WHERE id IN ({", ".join("?" * len(leased_ids))})',
+            leased_ids
+        )
+        with self._lock:
+            self._leased.update(leased_ids)
+        for row in rows:
+            self.pipeline.submit(DownloadJob.from_row(row))
+
+        self.claimed += len(rows)
+        metrics.increment('jobs_claimed', len(rows))
+        return len(rows)
+
+    def stop(self, timeout=None):
+        """Stop claiming, checkpoint running jobs and hand their leases back."""
+        self._stopping.set()
+        self._wake.set()
+        self.pipeline.shutdown(timeout)
+        with self._lock:
+            ids = list(self._leased)
+            self._leased.clear()
+        self._release(ids)
+
+    def status(self):
+        return {
+            'worker_id': self.worker_id,
+            'leased': len(self._leased),
+            'claimed': self.claimed,
+        }
+
+    def _claim_loop(self):
+        while not self._stopping.is_set():
+            try:
+                if self.claim(self.pipeline.capacity()):
+                    continue
+            except Exception as error:
+                logger.error('Error claiming jobs: %s', error)
+            self._wake.wait(config.WORKER_POLL_INTERVAL)
+            self._wake.clear()
+
+    def _heartbeat_loop(self):
+        while not self._stopping.wait(config.WORKER_HEARTBEAT_INTERVAL):
+            try:
+                self._heartbeat()
+            except Exception as error:
+                logger.error('Error renewing job leases: %s', error)
+
+    def _heartbeat(self):
+        with self._lock:
+            ids = list(self._leased)
+        finished = [i for i in ids if self.pipeline.registry.get(i) is None]
+        active = [i for i in ids if i not in finished]
+
+        if finished:
+            with self._lock:
+                self._leased.difference_update(finished)
+            self._release(finished)
+
+        if not active:
+            return
+
+        placeholders = ', '.join('?' * len(active))
+        database.run_query(
+            f'''UPDATE download_leases SET expires_at = ?
+            WHERE owner = ? AND download_id IN ({placeholders})''',
+            [time.time() + config.WORKER_LEASE_SECONDS, self.worker_id] + active
+        )
+
+        # Rows cancelled or deleted through the API stop here
+        statuses = {
+            row['id']: row['status']
+            for row in database.all_query(
+                f'SELECT id, status FROM downloads WHERE id IN ({placeholders})', active
+            )
+        }
+        for download_id in active:
+            if statuses.get(download_id, 'cancelled') == 'cancelled':
+                logger.info('Download cancelled elsewhere, stopping it', extra={'download_id': download_id})
+                self.pipeline.cancel(download_id)
+
+    def _release(self, ids):
+        if not ids:
+            return
+        database.run_query(
+            f'''DELETE FROM download_leases
+            WHERE owner = ? AND download_id IN ({", ".join("?" * len(ids))})''',
+            [self.worker_id] + ids
+        )
+
+
+def get_worker():
+    """Return this process's queue worker, creating it on first use."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = QueueWorker(get_pipeline())
+            metrics.register_collector('worker', _worker.status)
+        return _worker
+
+
+def notify():
+    """Tell this process's worker, if it runs one, that a job was enqueued."""
+    if _worker is not None:
+        _worker.notify()
@@ -2,16 +2,113 @@ import subprocess
 import os
 import re
 import json
+import logging
 from pathlib import Path
 import config
+from services.jobs import JobCancelled, run_bounded, run_process
+from logger import get_logger
+import tracing
+
+logger = get_logger(__name__)
+
+YTDLP_MISSING_MESSAGE = (
+    'yt-dlp is not installed. Please install it first:\n'
+    'Ubuntu/Debian: sudo apt-get install yt-dlp\n'
+    'macOS: brew install yt-dlp\n'
+    'Windows: Download from https://github.com/yt-dlp/yt-dlp/releases'
+)
+
+# The info fields a probe needs; yt-dlp prints just these as one JSON object
+# instead of the full info JSON (every format, thumbnail and subtitle track)
+PROBE_FIELDS = ('title', 'duration', 'uploader', 'thumbnail')
+PROBE_TEMPLATE = '%(.{' + ','.join(PROBE_FIELDS) + '})j'
+
+
+# yt-dlp error output that means retrying cannot help
+PERMANENT_ERROR_PATTERNS = [
+    'video unavailable',
+    'private video',
+    'this video is not available',
+    'has been removed',
+    'copyright',
+    'sign in to confirm your age',
+    'members-only',
+    'unsupported url',
+    'is not a valid url',
+    'http error 404',
+    'no video formats found',
+    'requested format is not available',
+]
+
+# yt-dlp error output that means we are being rate limited
+THROTTLE_ERROR_PATTERNS = [
+    'http error 429',
+    'too many requests',
+]
 
 
 class YouTubeDownloadError(Exception):
-    """Custom exception for YouTube download errors."""
-    def __init__(self, message):
+    """Custom exception for YouTube download errors.
+
+    `kind` is one of 'transient' (network trouble, worth retrying),
+    'throttled' (rate limited, retry after a longer pause) or 'permanent'.
+    """
+    def __init__(self, message, kind='permanent'):
         self.message = message
+        self.kind = kind
         super().__init__(self.message)
 
+    @property
+    def retryable(self):
+        return self.kind != 'permanent'
+
+
+def classify_error(stderr):
+    """Classify yt-dlp error output as 'permanent', 'throttled' or 'transient'."""
+    text = (stderr or '').lower()
+    if any(pattern in text for pattern in THROTTLE_ERROR_PATTERNS):
+        return 'throttled'
+    if any(pattern in text for pattern in PERMANENT_ERROR_PATTERNS):
+        return 'permanent'
+    return 'transient'
+
+
+def parse_timestamp(value):
+    """Parse seconds given as a number or '[[hh:]mm:]ss[.fff]' into a float."""
+    if isinstance(value, bool):
+        raise ValueError('Invalid time')
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        parts = str(value).strip().split(':')
+        if not 1 <= len(parts) <= 3 or not all(re.fullmatch(r'\d+(\.\d+)?', p) for p in parts):
+            raise ValueError(f'Invalid time: {value}')
+        seconds = 0.0
+        for part in parts:
+            seconds = seconds * 60 + float(part)
+    if seconds < 0 or seconds != seconds or seconds == float('inf'):
+        raise ValueError(f'Invalid time: {value}')
+    return seconds
+
+
+def format_timestamp(seconds):
+    """Seconds as yt-dlp section syntax ('inf' for None)."""
+    if seconds is None:
+        return 'inf'
+    return f'{seconds:.3f}'.rstrip('0').rstrip('.')
+
+
+def display_timestamp(seconds):
+    """Seconds as 'm:ss' or 'h:mm:ss' (with any fraction kept), for people to read."""
+    seconds = round(seconds, 3)
+    whole = int(seconds)
+    fraction = f'{seconds - whole:.3f}'.rstrip('0').rstrip('.')[1:]
+    hours, rest = divmod(whole, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f'{hours}:{minutes:02d}:{secs:02d}{fraction}'
+    return f'{minutes}:{secs:02d}{fraction}'
+
 
 class YouTubeService:
     """Service for downloading and processing YouTube videos."""
@@ -27,6 +124,12 @@ class YouTubeService:
         youtube_regex = r'^(https?:\/\/)?(www\.)?(youtube\.com|youtu\.be)\/.*'
         return re.match(youtube_regex, url) is not None
 
+    @staticmethod
+    def video_id(url):
+        """Extract the 11-character video id from a YouTube URL, if present."""
+        match = re.search(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([\w-]{11})', url)
+        return match.group(1) if match else None
+
     @staticmethod
     def sanitize_filename(filename):
         """Sanitize filename by removing invalid characters."""
@@ -39,42 +142,67 @@ class YouTubeService:
             sanitized = sanitized[:200]
         return sanitized or 'download'
 
-    def get_video_info(self, url):
-        """Get video information using yt-dlp."""
+    def playlist_urls(self, url):
+        """Video URLs of a playlist (or channel/list page), without probing each video."""
         try:
-            # Check if yt-dlp is installed
-            try:
-                subprocess.run(['yt-dlp', '--version'], capture_output=True, check=True)
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                raise YouTubeDownloadError(
-                    'yt-dlp is not installed. Please install it first:\n'
-                    'Ubuntu/Debian: sudo apt-get install yt-dlp\n'
-                    'macOS: brew install yt-dlp\n'
-                    'Windows: Download from https://github.com/yt-dlp/yt-dlp/releases'
-                )
-
-            print(f'[YT-DLP] Running command for URL: {url}')
-            
-            # Get video info in JSON format
             result = subprocess.run([
                 'yt-dlp',
-                '--dump-json',
+                '--flat-playlist',
+                '--print', 'url',
                 '--no-warnings',
                 '-q',
                 url
-            ], capture_output=True, text=True, timeout=60)
+            ], capture_output=True, text=True, timeout=120)
+        except subprocess.TimeoutExpired:
+            raise YouTubeDownloadError('Playlist listing timed out', 'transient')
+        except FileNotFoundError:
+            raise YouTubeDownloadError(YTDLP_MISSING_MESSAGE)
+
+        if result.returncode != 0:
+            raise YouTubeDownloadError(
+                f'Error listing playlist: {result.stderr}', classify_error(result.stderr)
+            )
+        return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+    def get_video_info(self, url):
+        """Get video information using yt-dlp."""
+        with tracing.span('probe'):
+            return self._probe(url)
+
+    @staticmethod
+    def probe_command(url):
+        """yt-dlp command printing a video's PROBE_FIELDS as one JSON object."""
+        return ['yt-dlp', '--print', PROBE_TEMPLATE, '--no-playlist', '--no-warnings', url]
+
+    def _probe(self, url):
+        """Run the yt-dlp metadata probe."""
+        try:
+            logger.debug('Fetching video info', extra={'url': url})
+
+            # Only the fields we use, with bounded capture of what yt-dlp prints
+            try:
+                result = run_bounded(self.probe_command(url), timeout=60)
+            except FileNotFoundError:
+                raise YouTubeDownloadError(YTDLP_MISSING_MESSAGE)
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('yt-dlp probe finished', extra={
+                    'returncode': result.returncode,
+                    'stderr_tail': result.stderr,
+                    'stdout_bytes': len(result.stdout),
+                })
 
-            print(f'[YT-DLP] Return code: {result.returncode}')
-            print(f'[YT-DLP] STDERR: {result.stderr}')
-            print(f'[YT-DLP] STDOUT length: {len(result.stdout)}')
-            
             if result.returncode != 0:
                 if 'ERROR' in result.stderr:
-                    raise YouTubeDownloadError(f'Video not found or unavailable: {result.stderr}')
-                raise YouTubeDownloadError(f'Error fetching video info: {result.stderr}')
+                    raise YouTubeDownloadError(
+                        f'Video not found or unavailable: {result.stderr}', classify_error(result.stderr)
+                    )
+                raise YouTubeDownloadError(
+                    f'Error fetching video info: {result.stderr}', classify_error(result.stderr)
+                )
 
             if not result.stdout.strip():
-                raise YouTubeDownloadError('No output from yt-dlp - possible network issue')
+                raise YouTubeDownloadError('No output from yt-dlp - possible network issue', 'transient')
 
             info = json.loads(result.stdout)
 
@@ -90,69 +218,96 @@ class YouTubeService:
         except json.JSONDecodeError as e:
             raise YouTubeDownloadError(f'Invalid response from yt-dlp: {e}')
         except subprocess.TimeoutExpired:
-            raise YouTubeDownloadError('Video info request timed out')
+            raise YouTubeDownloadError('Video info request timed out', 'transient')
         except Exception as e:
             raise YouTubeDownloadError(f'Error fetching video info: {str(e)}')
 
-    def download_audio(self, url, quality='192'):
-        """Download audio from YouTube as MP3."""
+    @staticmethod
+    def find_source(work_dir):
+        """Return the completed source stream in a work dir, if there is one."""
+        try:
+            names = os.listdir(work_dir)
+        except FileNotFoundError:
+            return None
+
+        # yt-dlp renames .part files on completion, so anything else is whole
+        for name in names:
+            if name.startswith('source.') and not name.endswith(('.part', '.ytdl')):
+                return os.path.join(work_dir, name)
+        return None
+
+    @staticmethod
+    def partial_bytes(work_dir):
+        """Bytes already fetched into .part files of an interrupted download."""
         try:
-            # Ensure output directory exists
-            os.makedirs(self.output_path, exist_ok=True)
+            return sum(
+                os.path.getsize(os.path.join(work_dir, name))
+                for name in os.listdir(work_dir) if name.endswith('.part')
+            )
+        except FileNotFoundError:
+            return 0
 
-            # Get video info first
-            info = self.get_video_info(url)
-            title = info['title']
-            safe_title = self.sanitize_filename(title)
+    def download_source(self, url, work_dir, start=None, end=None):
+        """Download the best audio stream as-is, without re-encoding.
 
-            # Output template for yt-dlp
-            output_template = os.path.join(self.output_path, safe_title)
+        The work dir is kept between attempts: a completed stream is reused and
+        yt-dlp resumes any .part file left by an interrupted one. With `start`
+        and/or `end` (seconds) only that section is fetched; yt-dlp has ffmpeg
+        seek in the remote stream, so the transfer scales with the clip.
+        """
+        try:
+            os.makedirs(work_dir, exist_ok=True)
 
-            # Download audio and convert to MP3 using yt-dlp
-            # Use bestaudio quality selector without specifying format
-            result = subprocess.run([
-                'yt-dlp',
-                url,
-                '-x',
-                '--audio-format', 'mp3',
-                '-o', output_template + '.%(ext)s',
-                '--quiet',
-            ], capture_output=True, text=True, timeout=600)
+            with tracing.span('download') as span:
+                source_file = self.find_source(work_dir)
+                resumed_from = 0
 
-            if result.returncode != 0:
-                raise YouTubeDownloadError(f'yt-dlp failed: {result.stderr}')
+                if source_file is None:
+                    resumed_from = self.partial_bytes(work_dir)
+                    cmd = [
+                        'yt-dlp',
+                        url,
+                        '-f', 'bestaudio/best',
+                        '--no-playlist',
+                        '--continue',
+                        '--part',
+                        '-o', os.path.join(work_dir, 'source.%(ext)s'),
+                        '--quiet',
+                    ]
+                    if start is not None or end is not None:
+                        cmd.extend([
+                            '--download-sections',
+                            f'*{format_timestamp(start or 0)}-{format_timestamp(end)}',
+                        ])
+                    result = run_process(cmd, timeout=config.DOWNLOAD_TIMEOUT)
 
-            # Find the created MP3 file
-            files = os.listdir(self.output_path)
-            mp3_files = [f for f in files if f.startswith(safe_title) and f.endswith('.mp3')]
+                    if result.returncode != 0:
+                        raise YouTubeDownloadError(
+                            f'yt-dlp failed: {result.stderr}', classify_error(result.stderr)
+                        )
 
-            if not mp3_files:
-                raise YouTubeDownloadError('MP3 file was not created')
+                    source_file = self.find_source(work_dir)
 
-            mp3_file = os.path.join(self.output_path, mp3_files[0])
-            file_size = os.path.getsize(mp3_file)
+                if source_file is None:
+                    raise YouTubeDownloadError('Audio stream was not downloaded', 'transient')
+
+                file_size = os.path.getsize(source_file)
+                if span is not None:
+                    span.set_attribute('bytes', file_size)
+                    span.set_attribute('resumed_from', resumed_from)
+                    if start is not None or end is not None:
+                        span.set_attribute('section', f'{format_timestamp(start or 0)}-{format_timestamp(end)}')
 
             return {
-                'filePath': mp3_file,
-                'title': title,
+                'filePath': source_file,
                 'fileSize': file_size,
+                'resumedFrom': resumed_from,
             }
 
-        except YouTubeDownloadError:
+        except (YouTubeDownloadError, JobCancelled):
             raise
         except subprocess.TimeoutExpired:
-            raise YouTubeDownloadError('Download timed out')
-        except Exception as e:
-            raise YouTubeDownloadError(f'Error downloading audio: {str(e)}')
-
-    @staticmethod
-    def cleanup_file(file_path):
-        """Delete a file if it exists."""
-        try:
-            if file_path and os.path.isfile(file_path):
-                os.unlink(file_path)
-                return True
-            return False
+            # The .part file stays in work_dir, so the next attempt resumes
+            raise YouTubeDownloadError('Download timed out', 'transient')
         except Exception as e:
-            print(f'Error deleting file {file_path}: {e}')
-            return False
+            raise YouTubeDownloadError(f'Error downloading audio: {str(e)}', 'transient')
@@ -0,0 +1,195 @@
+"""Webhook queue against a local http.server stub receiver.
+
+Run from backend/:  python -m unittest tests.test_webhooks  (or pytest)
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Settings are read at import time; the API role keeps the app from starting
+# its own dispatcher, so the tests drive deliveries one at a time
+_data_dir = tempfile.mkdtemp(prefix='webhook-test-')
+os.environ.update(
+    DATABASE_PATH=os.path.join(_data_dir, 'test.sqlite'),
+    UPLOAD_FOLDER=_data_dir,
+    PROCESS_ROLE='api',
+    WEBHOOK_SECRET='test-secret',
+    WEBHOOK_ALLOWED_HOSTS='127.0.0.1',
+    WEBHOOK_MAX_ATTEMPTS='3',
+    ADMIN_TOKEN='test-admin',
+)
+
+import config  # noqa: E402
+import database  # noqa: E402
+from services import webhooks  # noqa: E402
+
+
+class StubReceiver(BaseHTTPRequestHandler):
+    """Records every request; answers with the next status queued for its path (200 by default)."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append({'path': self.path, 'headers': dict(self.headers), 'body': body})
+        statuses = self.server.statuses.get(self.path) or [200]
+        status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebhookDeliveryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # In case another test module imported config first
+        config.WEBHOOK_SECRET = 'test-secret'
+        config.WEBHOOK_ALLOWED_HOSTS = ['127.0.0.1']
+        config.WEBHOOK_MAX_ATTEMPTS = 3
+        config.ADMIN_TOKEN = 'test-admin'
+        database.init_db()
+
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubReceiver)
+        cls.server.requests = []
+        cls.server.statuses = {}
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests.clear()
+        self.server.statuses.clear()
+        self.dispatcher = webhooks.WebhookDispatcher(owner='test')
+
+    def tearDown(self):
+        self.dispatcher.stop()
+
+    def finish_download(self, path, status='completed'):
+        """A download with a callback_url reaching `status`; returns the queued delivery."""
+        download_id = database.run_query(
+            '''INSERT INTO downloads (youtube_url, title, status, callback_url)
+            VALUES ('https://youtu.be/dQw4w9WgXcQ', 'Test', 'processing', ?)''',
+            [self.base_url + path]
+        )['id']
+        database.run_query('UPDATE downloads SET status = ? WHERE id = ?', [status, download_id])
+        return database.get_query('SELECT * FROM webhook_deliveries WHERE download_id = ?', [download_id])
+
+    def deliver_due(self):
+        """Claim and send whatever is due, as the dispatcher's loop would."""
+        return [self.dispatcher.deliver(delivery) for delivery in self.dispatcher.claim(10)]
+
+    def make_due(self, delivery_id):
+        # Skip the backoff instead of sleeping through it
+        database.run_query('UPDATE webhook_deliveries SET next_attempt_at = 0 WHERE id = ?', [delivery_id])
+
+    def test_signed_delivery(self):
+        delivery = self.finish_download('/ok')
+        self.assertEqual(self.deliver_due(), [True])
+
+        [received] = self.server.requests
+        headers = received['headers']
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(headers['X-Webhook-Id'], str(delivery['id']))
+        self.assertEqual(headers['X-Webhook-Event'], 'download.completed')
+        self.assertLessEqual(abs(int(headers['X-Webhook-Timestamp']) - time.time()), 5)
+        expected = webhooks.sign(received['body'], headers['X-Webhook-Timestamp'], 'test-secret')
+        self.assertEqual(headers['X-Webhook-Signature'], f'sha256={expected}')
+
+        payload = json.loads(received['body'])
+        self.assertEqual(payload['event'], 'download.completed')
+        self.assertEqual(payload['download']['id'], delivery['download_id'])
+        self.assertEqual(payload['download']['file_url'], f'/api/download/{delivery["download_id"]}/file')
+
+        row = database.get_query('SELECT * FROM webhook_deliveries WHERE id = ?', [delivery['id']])
+        self.assertEqual((row['status'], row['attempts'], row['response_status']), ('delivered', 1, 200))
+
+    def test_server_errors_retry_with_backoff_then_dead_letter(self):
+        self.server.statuses['/flaky'] = [503]
+        delivery = self.finish_download('/flaky', status='failed')
+
+        self.assertEqual(self.deliver_due(), [False])
+        row = database.get_query('SELECT * FROM webhook_deliveries WHERE id = ?', [delivery['id']])
+        self.assertEqual((row['status'], row['attempts'], row['response_status']), ('pending', 1, 503))
+        self.assertIsNone(row['lease_owner'])
+        # Backoff: half to all of WEBHOOK_BACKOFF_BASE for the first retry
+        delay = row['next_attempt_at'] - time.time()
+        self.assertGreater(delay, config.WEBHOOK_BACKOFF_BASE / 2 - 1)
+        self.assertLessEqual(delay, config.WEBHOOK_BACKOFF_BASE)
+        self.assertEqual(self.deliver_due(), [], 'not due again before the backoff ends')
+
+        self.make_due(delivery['id'])
+        self.assertEqual(self.deliver_due(), [False])
+        second = database.get_query('SELECT next_attempt_at FROM webhook_deliveries WHERE id = ?', [delivery['id']])
+        self.assertGreater(second['next_attempt_at'] - time.time(), config.WEBHOOK_BACKOFF_BASE - 1)
+
+        self.make_due(delivery['id'])
+        self.assertEqual(self.deliver_due(), [False])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertIsNone(database.get_query('SELECT id FROM webhook_deliveries WHERE id = ?', [delivery['id']]))
+        dead = database.get_query('SELECT * FROM webhook_dead_letters WHERE delivery_id = ?', [delivery['id']])
+        self.assertEqual((dead['attempts'], dead['response_status']), (3, 503))
+
+    def test_client_error_dead_letters_at_once(self):
+        self.server.statuses['/gone'] = [410]
+        delivery = self.finish_download('/gone')
+
+        self.assertEqual(self.deliver_due(), [False])
+        self.assertEqual(len(self.server.requests), 1)
+        dead = database.get_query('SELECT * FROM webhook_dead_letters WHERE delivery_id = ?', [delivery['id']])
+        self.assertEqual((dead['attempts'], dead['response_status'], dead['last_error']), (1, 410, 'HTTP 410'))
+
+    def test_replay_through_admin_route(self):
+        import app as app_module
+        app_module.startup['status'] = 'ready'
+        client = app_module.app.test_client()
+
+        self.server.statuses['/replay'] = [404, 200]
+        delivery = self.finish_download('/replay')
+        self.assertEqual(self.deliver_due(), [False])
+
+        headers = {'Authorization': 'Bearer test-admin'}
+        self.assertEqual(client.get('/api/admin/webhooks/dead-letters').status_code, 401)
+        listed = client.get('/api/admin/webhooks/dead-letters', headers=headers).get_json()['data']
+        [dead] = [row for row in listed if row['delivery_id'] == delivery['id']]
+
+        response = client.post(f'/api/admin/webhooks/dead-letters/{dead["id"]}/replay', headers=headers)
+        self.assertEqual(response.status_code, 202)
+        replayed_id = response.get_json()['delivery_id']
+        self.assertEqual(
+            client.post(f'/api/admin/webhooks/dead-letters/{dead["id"]}/replay', headers=headers).status_code, 404
+        )
+
+        self.assertEqual(self.deliver_due(), [True])
+        self.assertEqual(self.server.requests[-1]['headers']['X-Webhook-Id'], str(replayed_id))
+        self.assertEqual(self.server.requests[-1]['body'], self.server.requests[0]['body'])
+        row = database.get_query('SELECT status, attempts FROM webhook_deliveries WHERE id = ?', [replayed_id])
+        self.assertEqual((row['status'], row['attempts']), ('delivered', 1))
+
+    def test_internal_address_refused_unless_allowed(self):
+        config.WEBHOOK_ALLOWED_HOSTS = []
+        try:
+            with self.assertRaises(webhooks.WebhookError):
+                webhooks.validate_callback_url(self.base_url + '/ok')
+            # Queued before the rule applied (or re-resolved since): refused when sending
+            delivery = self.finish_download('/ok')
+            self.assertEqual(self.deliver_due(), [False])
+            self.assertEqual(self.server.requests, [])
+            self.assertIsNotNone(database.get_query(
+                'SELECT id FROM webhook_dead_letters WHERE delivery_id = ?', [delivery['id']]
+            ))
+        finally:
+            config.WEBHOOK_ALLOWED_HOSTS = ['127.0.0.1']
+
+
+if __name__ == '__main__':
+    unittest.main()
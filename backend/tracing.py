@@ -0,0 +1,230 @@
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import config
+import database
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# The trace of the job currently executing on this thread, if any
+current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+_export_queue = None
+_export_lock = threading.Lock()
+
+
+class Span:
+    """A single timed stage of a job."""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns',
+                 'end_ns', '_perf_start', 'attributes', 'status', 'saved')
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self._perf_start = time.perf_counter_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.saved = False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, status=None):
+        if self.end_ns is None:
+            self.end_ns = self.start_ns + (time.perf_counter_ns() - self._perf_start)
+        if status:
+            self.status = status
+
+    @property
+    def duration_ms(self):
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """Collects the spans of one download job, from request to publish."""
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.download_id = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def start_span(self, name, parent=None, **attributes):
+        """Start a span that is ended explicitly (e.g. one crossing threads)."""
+        parent_id = parent.span_id if parent is not None else None
+        span = Span(name, self.trace_id, parent_id, attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time a block as a child of the innermost active span."""
+        span = self.start_span(name, _current_span.get(), **attributes)
+        trace_token = current_trace.set(self)
+        span_token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.set_attribute('error', str(error)[:500])
+            span.end('error')
+            raise
+        finally:
+            span.end()
+            _current_span.reset(span_token)
+            current_trace.reset(trace_token)
+
+    def save(self, download_id):
+        """Persist finished, unsaved spans for a download row and export them."""
+        with self._lock:
+            pending = [s for s in self.spans if s.end_ns is not None and not s.saved]
+            for s in pending:
+                s.saved = True
+
+        if not pending:
+            return
+
+        try:
+            with database.get_db_cursor() as cursor:
+                cursor.executemany(
+                    '''INSERT INTO download_spans
+                        (download_id, trace_id, span_id, parent_span_id, name,
+                         start_ns, end_ns, status, attributes)
+                    SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+                    WHERE EXISTS (SELECT 1 FROM downloads WHERE id = ?)''',
+                    [(download_id, s.trace_id, s.span_id, s.parent_id, s.name,
+                      s.start_ns, s.end_ns, s.status,
+                      json.dumps(s.attributes, default=str), download_id)
+                     for s in pending]
+                )
+        except Exception as error:
+            logger.warning('Error saving spans: %s', error)
+
+        _export(download_id, pending)
+
+
+def current_span():
+    """Return the innermost active span on this thread, if any."""
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record a span in the current trace; a no-op when no trace is active."""
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attributes) as active:
+        yield active
+
+
+def get_timeline(download_id):
+    """Return the stored spans of a download, oldest first."""
+    rows = database.all_query(
+        '''SELECT trace_id, span_id, parent_span_id, name, start_ns, end_ns,
+                  status, attributes
+        FROM download_spans WHERE download_id = ? ORDER BY start_ns''',
+        [download_id]
+    )
+    for row in rows:
+        row['attributes'] = json.loads(row['attributes'] or '{}')
+    return rows
+
+
+def to_otlp(download_id, spans):
+    """Convert spans (Span objects or timeline rows) to OTLP/JSON."""
+    otlp_spans = []
+    for s in spans:
+        if isinstance(s, Span):
+            s = {
+                'trace_id': s.trace_id, 'span_id': s.span_id,
+                'parent_span_id': s.parent_id, 'name': s.name,
+                'start_ns': s.start_ns, 'end_ns': s.end_ns,
+                'status': s.status, 'attributes': s.attributes,
+            }
+        attributes = dict(s['attributes'], **{'download.id': download_id})
+        otlp_spans.append({
+            'traceId': s['trace_id'],
+            'spanId': s['span_id'],
+            'parentSpanId': s['parent_span_id'] or '',
+            'name': s['name'],
+            'kind': 1,
+            'startTimeUnixNano': str(s['start_ns']),
+            'endTimeUnixNano': str(s['end_ns']),
+            'attributes': [_otlp_attribute(k, v) for k, v in attributes.items()],
+            'status': {'code': 2 if s['status'] == 'error' else 1},
+        })
+
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [
+                _otlp_attribute('service.name', config.TRACE_SERVICE_NAME),
+            ]},
+            'scopeSpans': [{
+                'scope': {'name': 'yt-converter'},
+                'spans': otlp_spans,
+            }],
+        }],
+    }
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def _export(download_id, spans):
+    """Hand spans to the background exporter, if one is configured."""
+    if not (config.TRACE_EXPORT_FILE or config.TRACE_EXPORT_URL):
+        return
+
+    global _export_queue
+    with _export_lock:
+        if _export_queue is None:
+            _export_queue = queue.Queue(maxsize=1000)
+            threading.Thread(target=_export_loop, daemon=True).start()
+
+    try:
+        _export_queue.put_nowait((download_id, spans))
+    except queue.Full:
+        logger.warning('Trace export queue full, dropping spans')
+
+
+def _export_loop():
+    while True:
+        download_id, spans = _export_queue.get()
+        payload = to_otlp(download_id, spans)
+        try:
+            if config.TRACE_EXPORT_FILE:
+                with open(config.TRACE_EXPORT_FILE, 'a') as f:
+                    f.write(json.dumps(payload) + '\n')
+            if config.TRACE_EXPORT_URL:
+                # Only needed when exporting; kept off the API's import path
+                import urllib.request
+                req = urllib.request.Request(
+                    config.TRACE_EXPORT_URL,
+                    data=json.dumps(payload).encode(),
+                    headers={'Content-Type': 'application/json'},
+                )
+                urllib.request.urlopen(req, timeout=5).close()
+        except Exception as error:
+            logger.warning('Error exporting spans: %s', error)
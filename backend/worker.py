@@ -0,0 +1,58 @@
+"""Run queued downloads without serving HTTP.
+
+Run from the backend directory:
+
+    PROCESS_ROLE=worker python worker.py
+
+Start as many as the download and encode load needs, on this host or on
+others that share the database and the upload folder. Run the API with
+PROCESS_ROLE=api so it only enqueues and serves. Workers claim jobs with
+leases (see services.worker.QueueWorker); on SIGTERM/SIGINT a worker
+checkpoints its running jobs and hands them back to the queue. Workers also
+send completion webhooks (see services.webhooks).
+"""
+import os
+import signal
+import sys
+import threading
+import config
+import database
+from logger import get_logger
+from profiling import register_stack_dump
+from services.webhooks import get_dispatcher
+from services.worker import get_worker
+
+logger = get_logger(__name__)
+
+
+def main():
+    if config.PROCESS_ROLE != 'worker':
+        logger.warning('PROCESS_ROLE is %r; an API process with role "all" also runs downloads',
+                       config.PROCESS_ROLE)
+
+    os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
+    database.init_db()
+    worker = get_worker().start()
+    dispatcher = get_dispatcher().start()
+
+    stopped = threading.Event()
+
+    def stop(sig, frame):
+        logger.info('%s received: stopping worker', signal.Signals(sig).name)
+        stopped.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    register_stack_dump()
+
+    while not stopped.wait(1):
+        pass
+
+    dispatcher.stop()
+    worker.stop()
+    database.close_db()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { FiRefreshCw } from 'react-icons/fi';
 import Downloader from './components/Downloader';
 import ProgressBar from './components/ProgressBar';
@@ -6,6 +6,9 @@ import DownloadHistory from './components/DownloadHistory';
 import apiService from './services/api';
 import './App.css';
 
+// Latest downloads kept for the queue and recent sections
+const RECENT_LIMIT = 50;
+
 /**
  * Main App Component
  * Coordinates all functionality
@@ -14,7 +17,7 @@ function App() {
   const [downloads, setDownloads] = useState([]);
   const [loading, setLoading] = useState(false);
   const [apiHealthy, setApiHealthy] = useState(false);
-  const [pollIntervals, setPollIntervals] = useState({});
+  const historyVersion = useRef(null);
 
   // Check API health on mount
   useEffect(() => {
@@ -35,13 +38,28 @@ function App() {
     checkHealth();
   }, []);
 
-  // Fetch history on mount and when needed
+  // Fetch the latest downloads on mount, then only what was added or
+  // changed since (deletions made elsewhere show up on the next reload)
   const refreshHistory = useCallback(async () => {
-    setLoading(true);
+    const since = historyVersion.current;
+    if (since === null) {
+      setLoading(true);
+    }
     try {
-      const response = await apiService.getHistory({ limit: 50 });
+      const response = await apiService.getHistory(
+        since === null ? { limit: RECENT_LIMIT } : { updated_since: since, limit: 100 }
+      );
       if (response.success) {
-        setDownloads(response.data);
+        historyVersion.current = response.version;
+        if (since === null) {
+          setDownloads(response.data);
+        } else if (response.data.length) {
+          setDownloads((prev) => {
+            const byId = new Map(prev.map((d) => [d.id, d]));
+            response.data.forEach((d) => byId.set(d.id, { ...byId.get(d.id), ...d }));
+            return [...byId.values()].sort((a, b) => b.id - a.id).slice(0, RECENT_LIMIT);
+          });
+        }
       }
     } catch (error) {
       console.error('Error fetching history:', error);
@@ -57,98 +75,69 @@ function App() {
     return () => clearInterval(interval);
   }, [refreshHistory]);
 
-  // Poll for status updates of pending/processing downloads
+  // Poll for status updates of pending/processing downloads, all in one
+  // request; restarts only when the set of active downloads changes
+  const activeIds = downloads
+    .filter((d) => d.status === 'pending' || d.status === 'processing')
+    .map((d) => d.id)
+    .join(',');
+
   useEffect(() => {
-    const pendingDownloads = downloads.filter(
-      (d) => d.status === 'pending' || d.status === 'processing'
-    );
-
-    pendingDownloads.forEach((download) => {
-      // Clear existing interval if any
-      if (pollIntervals[download.id]) {
-        clearInterval(pollIntervals[download.id]);
-      }
+    if (!activeIds) {
+      return undefined;
+    }
+    const ids = activeIds.split(',').map(Number);
+    // The first poll returns every download; later ones only what changed
+    let since = null;
 
-      // Poll every 2 seconds
-      const interval = setInterval(async () => {
-        try {
-          const response = await apiService.getDownloadStatus(download.id);
-          if (response.success) {
-            setDownloads((prev) =>
-              prev.map((d) =>
-                d.id === download.id ? { ...d, ...response } : d
-              )
-            );
-
-            // Stop polling if completed or failed
-            if (response.status === 'completed' || response.status === 'failed') {
-              clearInterval(interval);
-              setPollIntervals((prev) => {
-                const updated = { ...prev };
-                delete updated[download.id];
-                return updated;
-              });
-            }
-          }
-        } catch (error) {
-          console.error('Error fetching download status:', error);
+    // Poll every 2 seconds
+    const interval = setInterval(async () => {
+      try {
+        const response = await apiService.getDownloadStatuses(ids, since);
+        if (response.success) {
+          since = response.version;
+          const updates = Object.fromEntries(
+            response.downloads.map((status) => [status.download_id, status])
+          );
+          setDownloads((prev) =>
+            prev
+              .filter((d) => !response.missing.includes(d.id))
+              .map((d) => (updates[d.id] ? { ...d, ...updates[d.id] } : d))
+          );
         }
-      }, 2000);
-
-      setPollIntervals((prev) => ({ ...prev, [download.id]: interval }));
-    });
+      } catch (error) {
+        console.error('Error fetching download status:', error);
+      }
+    }, 2000);
 
-    return () => {
-      Object.values(pollIntervals).forEach((interval) => clearInterval(interval));
-    };
-  }, [downloads, pollIntervals]);
+    return () => clearInterval(interval);
+  }, [activeIds]);
 
   const handleDownloadAdded = (newDownload) => {
     setDownloads((prev) => [newDownload, ...prev]);
   };
 
-  const handleDownloadFile = async (downloadId) => {
-    try {
-      const response = await apiService.downloadFile(downloadId);
-
-      // Get filename from response or use default
-      const download = downloads.find((d) => d.id === downloadId);
-      const filename = download
-        ? `${download.title}.mp3`
-        : `download_${downloadId}.mp3`;
-
-      // Create blob and download
-      const url = window.URL.createObjectURL(new Blob([response.data]));
-      const link = document.createElement('a');
-      link.href = url;
-      link.setAttribute('download', filename);
-      document.body.appendChild(link);
-      link.click();
-      link.parentChild.removeChild(link);
-      window.URL.revokeObjectURL(url);
-    } catch (error) {
-      console.error('Error downloading file:', error);
-      alert('Failed to download file. Please try again.');
-    }
+  const handleDownloadFile = (downloadId) => {
+    // Let the browser fetch the file itself: it streams straight to disk,
+    // follows the redirect when files live in object storage, and takes
+    // the file name (and extension) from Content-Disposition
+    const link = document.createElement('a');
+    link.href = apiService.getFileUrl(downloadId);
+    link.setAttribute('download', '');
+    document.body.appendChild(link);
+    link.click();
+    link.remove();
   };
 
   const handleDeleteDownload = async (downloadId) => {
     try {
       await apiService.deleteDownload(downloadId);
       setDownloads((prev) => prev.filter((d) => d.id !== downloadId));
-
-      // Clear polling interval if exists
-      if (pollIntervals[downloadId]) {
-        clearInterval(pollIntervals[downloadId]);
-        setPollIntervals((prev) => {
-          const updated = { ...prev };
-          delete updated[downloadId];
-          return updated;
-        });
-      }
+      return true;
     } catch (error) {
       console.error('Error deleting download:', error);
       alert('Failed to delete download. Please try again.');
+      return false;
     }
   };
 
@@ -224,7 +213,6 @@ function App() {
           <section className="section history-section">
             <DownloadHistory
               downloads={downloads}
-              onRefresh={refreshHistory}
               onDelete={handleDeleteDownload}
               onDownload={handleDownloadFile}
             />
@@ -1,17 +1,59 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback, useMemo, useRef } from 'react';
 import { FiChevronDown, FiChevronUp, FiTrash2, FiRefreshCw } from 'react-icons/fi';
 import apiService from '../services/api';
+import VirtualList from './VirtualList';
 import '../styles/DownloadHistory.css';
 
+// Rows fetched per page while scrolling
+const PAGE_SIZE = 50;
+// Height of one history card including the gap below it; must match the CSS
+const ROW_HEIGHT = 212;
+// Height of the scrolling list
+const LIST_HEIGHT = 640;
+// How often to pick up changes while the history is open
+const SYNC_INTERVAL = 30000;
+
+/**
+ * Apply changed rows from an `updated_since` sync to the loaded rows:
+ * known rows are updated (or dropped when they no longer match the
+ * filter), unknown ones are added when they fall inside the loaded range.
+ */
+const mergeChanges = (rows, changes, status, complete) => {
+  const changed = new Map(changes.map((change) => [change.id, change]));
+  const matches = (row) => status === 'all' || row.status === status;
+  const oldestId = rows.length ? rows[rows.length - 1].id : 0;
+
+  const kept = rows
+    .filter((row) => !changed.has(row.id) || matches(changed.get(row.id)))
+    .map((row) => (changed.has(row.id) ? { ...row, ...changed.get(row.id) } : row));
+  const known = new Set(rows.map((row) => row.id));
+  const added = changes.filter(
+    (change) => !known.has(change.id) && matches(change) && (complete || change.id > oldestId)
+  );
+  if (!added.length) {
+    return kept;
+  }
+  return kept.concat(added).sort((a, b) => b.id - a.id);
+};
+
 /**
  * DownloadHistory Component
- * Display download history and statistics
+ * Display download history and statistics. The list is paged from the
+ * server as it scrolls and only the visible cards are rendered.
  */
-const DownloadHistory = ({ downloads, onRefresh, onDelete, onDownload }) => {
+const DownloadHistory = ({ downloads, onDelete, onDownload }) => {
   const [isExpanded, setIsExpanded] = useState(false);
   const [stats, setStats] = useState(null);
   const [loadingStats, setLoadingStats] = useState(false);
   const [filterStatus, setFilterStatus] = useState('all');
+  const [rows, setRows] = useState([]);
+  const [total, setTotal] = useState(0);
+  const [hasMore, setHasMore] = useState(false);
+  const [loadingPage, setLoadingPage] = useState(false);
+  // Bumped whenever the list is reloaded, so late answers for the old list are dropped
+  const generation = useRef(0);
+  const loadingRef = useRef(false);
+  const version = useRef(null);
 
   useEffect(() => {
     if (isExpanded) {
@@ -33,6 +75,108 @@ const DownloadHistory = ({ downloads, onRefresh, onDelete, onDownload }) => {
     }
   };
 
+  // First page when called without `beforeId`, otherwise the page after it
+  const loadPage = useCallback(async (beforeId = null) => {
+    if (beforeId && loadingRef.current) {
+      return;
+    }
+    const current = beforeId ? generation.current : ++generation.current;
+    loadingRef.current = true;
+    setLoadingPage(true);
+    try {
+      const options = { limit: PAGE_SIZE };
+      if (filterStatus !== 'all') {
+        options.status = filterStatus;
+      }
+      if (beforeId) {
+        options.before_id = beforeId;
+      }
+      const response = await apiService.getHistory(options);
+      if (response.success && current === generation.current) {
+        setRows((prev) => (beforeId ? prev.concat(response.data) : response.data));
+        setTotal(response.total);
+        setHasMore(response.data.length === PAGE_SIZE);
+        if (!beforeId) {
+          version.current = response.version;
+        }
+      }
+    } catch (error) {
+      console.error('Error loading history:', error);
+    } finally {
+      if (current === generation.current) {
+        loadingRef.current = false;
+        setLoadingPage(false);
+      }
+    }
+  }, [filterStatus]);
+
+  const loadMore = useCallback(() => {
+    if (hasMore && rows.length) {
+      loadPage(rows[rows.length - 1].id);
+    }
+  }, [hasMore, rows, loadPage]);
+
+  // Pick up rows added or changed since the last load, without refetching the list
+  const sync = useCallback(async () => {
+    const current = generation.current;
+    try {
+      let more = version.current !== null;
+      while (more) {
+        const response = await apiService.getHistory({ updated_since: version.current, limit: 100 });
+        if (!response.success || current !== generation.current) {
+          return;
+        }
+        version.current = response.version;
+        more = response.more;
+        if (response.data.length) {
+          setRows((prev) => mergeChanges(prev, response.data, filterStatus, !hasMore));
+          if (filterStatus === 'all') {
+            setTotal(response.total);
+          } else {
+            const counted = await apiService.getHistory({ status: filterStatus, limit: 1 });
+            if (counted.success && current === generation.current) {
+              setTotal(counted.total);
+            }
+          }
+        }
+      }
+    } catch (error) {
+      console.error('Error syncing history:', error);
+    }
+  }, [filterStatus, hasMore]);
+
+  useEffect(() => {
+    if (isExpanded) {
+      loadPage();
+    }
+  }, [isExpanded, loadPage]);
+
+  useEffect(() => {
+    if (!isExpanded) {
+      return undefined;
+    }
+    const interval = setInterval(sync, SYNC_INTERVAL);
+    return () => clearInterval(interval);
+  }, [isExpanded, sync]);
+
+  // Keep paging while the loaded cards don't fill the list (nothing to scroll yet)
+  useEffect(() => {
+    if (isExpanded && hasMore && !loadingPage && rows.length * ROW_HEIGHT < LIST_HEIGHT) {
+      loadMore();
+    }
+  }, [isExpanded, hasMore, loadingPage, rows.length, loadMore]);
+
+  // Downloads the app is already polling are fresher than the last sync
+  const visibleRows = useMemo(() => {
+    const live = new Map(downloads.map((download) => [download.id, download]));
+    const newestId = rows.length ? rows[0].id : 0;
+    return downloads
+      .filter((download) => download.id > newestId)
+      .concat(rows.map((row) => (live.has(row.id) ? { ...row, ...live.get(row.id) } : row)))
+      .filter((download) => filterStatus === 'all' || download.status === filterStatus);
+  }, [rows, downloads, filterStatus]);
+  const shownTotal = total + (visibleRows.length - rows.length);
+
   const formatFileSize = (bytes) => {
     if (!bytes) return 'N/A';
     const sizes = ['B', 'KB', 'MB', 'GB'];
@@ -40,22 +184,32 @@ const DownloadHistory = ({ downloads, onRefresh, onDelete, onDownload }) => {
     return Math.round((bytes / Math.pow(1024, i)) * 100) / 100 + ' ' + sizes[i];
   };
 
+  const formatDuration = (seconds) => {
+    if (!seconds) return null;
+    const minutes = Math.floor(seconds / 60);
+    const rest = String(Math.floor(seconds % 60)).padStart(2, '0');
+    return `${minutes}:${rest}`;
+  };
+
   const formatDate = (dateString) => {
     if (!dateString) return 'N/A';
     const date = new Date(dateString);
     return date.toLocaleDateString() + ' ' + date.toLocaleTimeString();
   };
 
-  const filteredDownloads = filterStatus === 'all'
-    ? downloads
-    : downloads.filter(d => d.status === filterStatus);
+  const handleDelete = async (downloadId) => {
+    if (window.confirm('Delete this download?') && await onDelete(downloadId)) {
+      setRows((prev) => prev.filter((row) => row.id !== downloadId));
+      setTotal((prev) => Math.max(0, prev - 1));
+    }
+  };
 
   const handleClearOld = async () => {
     if (window.confirm('Delete completed downloads older than 7 days?')) {
       try {
         const response = await apiService.clearHistory({ older_than_days: 7 });
         if (response.success) {
-          onRefresh();
+          loadPage();
           loadStats();
         }
       } catch (error) {
@@ -72,7 +226,7 @@ const DownloadHistory = ({ downloads, onRefresh, onDelete, onDownload }) => {
       >
         <span className="history-title">
           {isExpanded ? <FiChevronUp /> : <FiChevronDown />}
-          Download History ({downloads.length})
+          Download History{isExpanded && ` (${shownTotal})`}
         </span>
       </button>
 
@@ -114,6 +268,7 @@ const DownloadHistory = ({ downloads, onRefresh, onDelete, onDownload }) => {
                 <option value="failed">Failed</option>
                 <option value="processing">Processing</option>
                 <option value="pending">Pending</option>
+                <option value="cancelled">Cancelled</option>
               </select>
             </div>
             <button
@@ -132,17 +287,33 @@ const DownloadHistory = ({ downloads, onRefresh, onDelete, onDownload }) => {
           </div>
 
           {/* Downloads List */}
-          <div className="history-list">
-            {filteredDownloads.length === 0 ? (
-              <p className="empty-message">No downloads found</p>
-            ) : (
-              filteredDownloads.map((download) => (
-                <div key={download.id} className={`history-item status-${download.status}`}>
+          {visibleRows.length === 0 ? (
+            <p className="empty-message">{loadingPage ? 'Loading...' : 'No downloads found'}</p>
+          ) : (
+            <VirtualList
+              items={visibleRows}
+              rowHeight={ROW_HEIGHT}
+              height={Math.min(LIST_HEIGHT, visibleRows.length * ROW_HEIGHT)}
+              getKey={(download) => download.id}
+              onEndReached={loadMore}
+              footer={loadingPage && rows.length > 0 && <p className="history-loading">Loading more...</p>}
+              renderRow={(download) => (
+                <div className={`history-item status-${download.status}`}>
                   <div className="history-item-header">
+                    {download.thumbnail_url && (
+                      <img
+                        className="history-thumbnail"
+                        src={apiService.getThumbnailUrl(download.id)}
+                        alt=""
+                        loading="lazy"
+                      />
+                    )}
                     <div className="history-item-info">
                       <h5>{download.title}</h5>
                       <p className="history-meta">
                         <span className="status-badge">{download.status}</span>
+                        {download.uploader && <span>{download.uploader}</span>}
+                        {download.duration > 0 && <span>{formatDuration(download.duration)}</span>}
                         <span>{download.quality} kbps</span>
                         {download.file_size && (
                           <span>{formatFileSize(download.file_size)}</span>
@@ -179,19 +350,15 @@ const DownloadHistory = ({ downloads, onRefresh, onDelete, onDownload }) => {
                     )}
                     <button
                       className="btn btn-small btn-danger"
-                      onClick={() => {
-                        if (window.confirm('Delete this download?')) {
-                          onDelete(download.id);
-                        }
-                      }}
+                      onClick={() => handleDelete(download.id)}
                     >
                       <FiTrash2 /> Delete
                     </button>
                   </div>
                 </div>
-              ))
-            )}
-          </div>
+              )}
+            />
+          )}
         </div>
       )}
     </div>
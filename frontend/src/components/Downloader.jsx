@@ -3,13 +3,25 @@ import { FiPlay, FiAlertCircle } from 'react-icons/fi';
 import apiService from '../services/api';
 import '../styles/Downloader.css';
 
+const FORMATS = [
+  { value: 'mp3', label: 'MP3' },
+  { value: 'm4a', label: 'M4A (AAC)' },
+  { value: 'opus', label: 'Opus' },
+  { value: 'ogg', label: 'Ogg Vorbis' },
+  { value: 'native', label: 'Original (no re-encode)' },
+];
+
 /**
  * Downloader Component
- * Main component for downloading YouTube videos to MP3
+ * Main component for downloading YouTube videos as audio files
  */
 const Downloader = ({ onDownloadAdded, isLoading }) => {
   const [url, setUrl] = useState('');
   const [quality, setQuality] = useState('192');
+  const [format, setFormat] = useState('mp3');
+  const [clipStart, setClipStart] = useState('');
+  const [clipEnd, setClipEnd] = useState('');
+  const [normalize, setNormalize] = useState(false);
   const [error, setError] = useState('');
   const [success, setSuccess] = useState('');
   const [submitting, setSubmitting] = useState(false);
@@ -38,18 +50,28 @@ const Downloader = ({ onDownloadAdded, isLoading }) => {
     setSubmitting(true);
 
     try {
-      const response = await apiService.createDownload(url, quality);
+      const response = await apiService.createDownload(url, quality, {
+        start: clipStart.trim() || undefined,
+        end: clipEnd.trim() || undefined,
+        format,
+        normalize: format !== 'native' && normalize,
+      });
 
       if (response.success) {
         setSuccess(`Download queued! Download ID: ${response.download_id}`);
         setUrl('');
         setQuality('192');
+        setFormat('mp3');
+        setClipStart('');
+        setClipEnd('');
+        setNormalize(false);
 
         // Notify parent component
         onDownloadAdded({
           id: response.download_id,
           status: 'pending',
           quality: quality,
+          format: format,
         });
 
         // Clear success message after 5 seconds
@@ -78,7 +100,7 @@ const Downloader = ({ onDownloadAdded, isLoading }) => {
   return (
     <div className="downloader-container">
       <h2 className="downloader-title">YouTube to MP3 Converter</h2>
-      <p className="downloader-subtitle">Convert YouTube videos to MP3 format</p>
+      <p className="downloader-subtitle">Convert YouTube videos to MP3, M4A, Opus or Ogg</p>
 
       <form onSubmit={handleSubmit} className="downloader-form">
         {error && (
@@ -120,6 +142,25 @@ const Downloader = ({ onDownloadAdded, isLoading }) => {
           </div>
         </div>
 
+        <div className="form-group">
+          <label className="form-label">Format</label>
+          <div className="format-grid">
+            {FORMATS.map((f) => (
+              <label key={f.value} className="quality-radio">
+                <input
+                  type="radio"
+                  name="format"
+                  value={f.value}
+                  checked={format === f.value}
+                  onChange={(e) => setFormat(e.target.value)}
+                  disabled={submitting || isLoading}
+                />
+                <span className={format === f.value ? 'selected' : ''}>{f.label}</span>
+              </label>
+            ))}
+          </div>
+        </div>
+
         <div className="form-group">
           <label className="form-label">Audio Quality</label>
           <div className="quality-grid">
@@ -131,7 +172,7 @@ const Downloader = ({ onDownloadAdded, isLoading }) => {
                   value={q}
                   checked={quality === q}
                   onChange={(e) => setQuality(e.target.value)}
-                  disabled={submitting || isLoading}
+                  disabled={submitting || isLoading || format === 'native'}
                 />
                 <span className={quality === q ? 'selected' : ''}>
                   {q} kbps
@@ -142,6 +183,40 @@ const Downloader = ({ onDownloadAdded, isLoading }) => {
           </div>
         </div>
 
+        <div className="form-group">
+          <label className="form-label">Clip (optional)</label>
+          <div className="clip-range">
+            <input
+              type="text"
+              value={clipStart}
+              onChange={(e) => setClipStart(e.target.value)}
+              placeholder="Start, e.g. 1:30"
+              className="form-input"
+              disabled={submitting || isLoading}
+            />
+            <input
+              type="text"
+              value={clipEnd}
+              onChange={(e) => setClipEnd(e.target.value)}
+              placeholder="End, e.g. 4:05"
+              className="form-input"
+              disabled={submitting || isLoading}
+            />
+          </div>
+        </div>
+
+        <div className="form-group">
+          <label className="normalize-option">
+            <input
+              type="checkbox"
+              checked={format !== 'native' && normalize}
+              onChange={(e) => setNormalize(e.target.checked)}
+              disabled={submitting || isLoading || format === 'native'}
+            />
+            <span>Normalize loudness (EBU R128)</span>
+          </label>
+        </div>
+
         <button
           type="submit"
           className="btn btn-primary btn-large"
@@ -160,10 +235,10 @@ const Downloader = ({ onDownloadAdded, isLoading }) => {
         <h4>How it works:</h4>
         <ol>
           <li>Paste or enter a YouTube URL</li>
-          <li>Select your preferred audio quality</li>
+          <li>Select a format and your preferred audio quality</li>
           <li>Click "Add to Queue" to start the download</li>
           <li>Downloads process one by one in the background</li>
-          <li>Download your MP3 when it's ready!</li>
+          <li>Download your file when it's ready!</li>
         </ol>
       </div>
     </div>
@@ -84,7 +84,7 @@ const ProgressBar = ({ download, onDownload, onDelete }) => {
       <div className="progress-actions">
         {download.status === 'completed' && (
           <button className="btn btn-primary" onClick={handleDownload}>
-            <FiDownload /> Download MP3
+            <FiDownload /> Download {download.format && download.format !== 'native' ? download.format.toUpperCase() : 'File'}
           </button>
         )}
         <button className="btn btn-danger" onClick={handleDelete}>
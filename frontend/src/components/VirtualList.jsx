@@ -0,0 +1,57 @@
+import React, { useState, useCallback } from 'react';
+
+/**
+ * VirtualList Component
+ * Renders only the rows in (and just around) the visible part of a
+ * fixed-height scroll area. Every row is `rowHeight` pixels tall.
+ * `onEndReached` fires when the last rows come into view.
+ */
+const VirtualList = ({
+  items,
+  rowHeight,
+  height,
+  renderRow,
+  getKey,
+  onEndReached,
+  overscan = 4,
+  endThreshold = 5,
+  footer = null,
+}) => {
+  const [scrollTop, setScrollTop] = useState(0);
+
+  const first = Math.max(0, Math.floor(scrollTop / rowHeight) - overscan);
+  const last = Math.min(items.length, Math.ceil((scrollTop + height) / rowHeight) + overscan);
+
+  const handleScroll = useCallback(
+    (event) => {
+      const { scrollTop: top } = event.currentTarget;
+      setScrollTop(top);
+      if (onEndReached && Math.ceil((top + height) / rowHeight) >= items.length - endThreshold) {
+        onEndReached();
+      }
+    },
+    [height, rowHeight, items.length, endThreshold, onEndReached]
+  );
+
+  const rows = [];
+  for (let index = first; index < last; index += 1) {
+    rows.push(
+      <div
+        key={getKey(items[index])}
+        className="virtual-row"
+        style={{ position: 'absolute', top: index * rowHeight, left: 0, right: 0, height: rowHeight }}
+      >
+        {renderRow(items[index], index)}
+      </div>
+    );
+  }
+
+  return (
+    <div className="virtual-list" style={{ height, overflowY: 'auto', position: 'relative' }} onScroll={handleScroll}>
+      <div style={{ height: items.length * rowHeight, position: 'relative' }}>{rows}</div>
+      {footer}
+    </div>
+  );
+};
+
+export default VirtualList;
@@ -18,13 +18,16 @@ const apiService = {
    * Create a new download request
    * @param {string} url - YouTube URL
    * @param {string} quality - Audio quality (128, 192, 256, 320)
+   * @param {Object} options - Optional { start, end } clip range in seconds or
+   *   [[hh:]mm:]ss, and { normalize } for loudness normalization
    * @returns {Promise<Object>} Download response with download_id
    */
-  createDownload: async (url, quality = '192') => {
+  createDownload: async (url, quality = '192', options = {}) => {
     try {
       const response = await api.post('/download', {
         url,
         quality,
+        ...options,
       });
       return response.data;
     } catch (error) {
@@ -47,21 +50,32 @@ const apiService = {
   },
 
   /**
-   * Download the MP3 file
-   * @param {number} downloadId - Download ID
-   * @returns {Promise} File download
+   * Get the status of several downloads in one request
+   * @param {number[]} downloadIds - Download IDs
+   * @param {number|null} since - `version` of an earlier response; only
+   *   downloads changed after it are returned
+   * @returns {Promise<Object>} { version, downloads, missing }
    */
-  downloadFile: async (downloadId) => {
+  getDownloadStatuses: async (downloadIds, since = null) => {
     try {
-      const response = await api.get(`/download/${downloadId}/file`, {
-        responseType: 'blob',
+      const response = await api.post('/download/status', {
+        ids: downloadIds,
+        since,
       });
-      return response;
+      return response.data;
     } catch (error) {
       throw error.response?.data || error.message;
     }
   },
 
+  /**
+   * URL of a converted file; the browser follows it (and any redirect to
+   * object storage) and saves the file under the name the server gives
+   * @param {number} downloadId - Download ID
+   * @returns {string} File URL
+   */
+  getFileUrl: (downloadId) => `${API_BASE_URL}/download/${downloadId}/file`,
+
   /**
    * Delete a download
    * @param {number} downloadId - Download ID
@@ -82,7 +96,9 @@ const apiService = {
    * @param {string} options.status - Filter by status
    * @param {number} options.limit - Number of records
    * @param {number} options.offset - Offset
-   * @returns {Promise<Object>} History data
+   * @param {number} options.before_id - Only downloads older than this id (cursor paging)
+   * @param {number} options.updated_since - Only downloads added or changed since this `version`
+   * @returns {Promise<Object>} History data: { data, total, version, more }
    */
   getHistory: async (options = {}) => {
     try {
@@ -145,6 +161,13 @@ const apiService = {
       throw error.response?.data || error.message;
     }
   },
+
+  /**
+   * Absolute URL of a download's cached thumbnail
+   * @param {number} downloadId - Download ID
+   * @returns {string} Thumbnail URL
+   */
+  getThumbnailUrl: (downloadId) => `${API_BASE_URL}/download/${downloadId}/thumbnail`,
 };
 
 export default apiService;